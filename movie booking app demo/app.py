@@ -8,14 +8,49 @@ from datetime import datetime, timedelta
 import tempfile
 import qrcode
 from io import BytesIO
+import uuid
+import json
+import threading
+import time
+from collections import OrderedDict
 
 API_URL = "http://localhost:5000"
+LIVE_SEATMAP_LIMIT = 32  # shows this frontend follows at once; the least recently viewed is dropped
+LIVE_SEATMAP_IDLE_SECONDS = 300  # a show nobody has viewed for this long stops being followed
 st.set_page_config(layout="wide", page_title="Cinema Booking Modern App")
 
+def api_headers(headers=None):
+    """Headers for an API call; the session id gives each browser session its own rate-limit buckets"""
+    headers = dict(headers or {})
+    session_id = st.session_state.get("holder_id")
+    if session_id:
+        headers['X-Session-Id'] = session_id
+    return headers
+
+@st.cache_resource
+def etag_store():
+    """Last ETag and payload per request, kept across reruns"""
+    return {}
+
+def get_json_revalidated(url, params=None, timeout=5):
+    """GET a JSON resource, reusing the previous payload when the server answers 304"""
+    store = etag_store()
+    key = (url, tuple(sorted((params or {}).items())))
+    cached = store.get(key)
+    headers = api_headers({'If-None-Match': cached[0]} if cached else None)
+    response = requests.get(url, params=params, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached:
+        return cached[1]
+    response.raise_for_status()
+    data = response.json()
+    if response.headers.get('ETag'):
+        store[key] = (response.headers['ETag'], data)
+    return data
+
 @st.cache_data(ttl=600)
 def fetch_locations():
     try:
-        response = requests.get(f"{API_URL}/locations", timeout=5)
+        response = requests.get(f"{API_URL}/locations", headers=api_headers(), timeout=5)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException:
@@ -25,7 +60,7 @@ def fetch_locations():
 @st.cache_data(ttl=600)
 def fetch_movies():
     try:
-        response = requests.get(f"{API_URL}/movies", timeout=5)
+        response = requests.get(f"{API_URL}/movies", headers=api_headers(), timeout=5)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException:
@@ -35,7 +70,7 @@ def fetch_movies():
 @st.cache_data(ttl=300)
 def fetch_theatres(location):
     try:
-        response = requests.get(f"{API_URL}/theatres/{location}", timeout=5)
+        response = requests.get(f"{API_URL}/theatres/{location}", headers=api_headers(), timeout=5)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException:
@@ -46,22 +81,60 @@ def fetch_theatres(location):
 def fetch_showtimes(theatre_id, movie_id=None):
     try:
         params = {'movie_id': movie_id} if movie_id else {}
-        response = requests.get(f"{API_URL}/showtimes/{theatre_id}", params=params, timeout=5)
-        response.raise_for_status()
-        return response.json()
+        return get_json_revalidated(f"{API_URL}/showtimes/{theatre_id}", params=params, timeout=5)
     except requests.exceptions.RequestException:
         st.error("Failed to fetch showtimes")
         return []
 
+@st.cache_data(ttl=15)
+def fetch_availability(theatre_id, movie_id=None, days=5):
+    try:
+        params = {'theatre_id': theatre_id, 'days': days}
+        if movie_id:
+            params['movie_id'] = movie_id
+        response = requests.get(f"{API_URL}/availability", params=params, headers=api_headers(), timeout=5)
+        response.raise_for_status()
+        return {show['showtime_id']: show['free'] for show in response.json()['showtimes']}
+    except requests.exceptions.RequestException:
+        return {}
+
+@st.cache_data(ttl=3600)
+def fetch_hall_layout():
+    try:
+        response = requests.get(f"{API_URL}/seatmap/layout", headers=api_headers(), timeout=5)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException:
+        return None
+
+def expand_compact_seatmap(layout, compact):
+    """Rebuild the row/block/seat structure from the layout and per-row occupancy strings"""
+    seat_map = []
+    for row, bits in zip(layout['rows'], compact['rows']):
+        blocks = []
+        pos = 0
+        for block in layout['blocks']:
+            blocks.append([{'label': f"{row}{n:02d}", 'booked': bits[pos + i] == '1'} for i, n in enumerate(block)])
+            pos += len(block)
+        seat_map.append({'row': row, 'blocks': blocks})
+    return seat_map
+
 @st.cache_data(ttl=60)
-def fetch_seatmap(showtime_id, booking_date=None):
+def fetch_seatmap(showtime_id, booking_date=None, holder=None):
     try:
+        layout = fetch_hall_layout()
         params = {'date': booking_date} if booking_date else {}
-        response = requests.get(f"{API_URL}/seatmap/{showtime_id}", params=params, timeout=3)
+        if holder:
+            params['holder'] = holder
+        if layout:
+            params['format'] = 'compact'
+        response = requests.get(f"{API_URL}/seatmap/{showtime_id}", params=params, headers=api_headers(), timeout=3)
         if response.status_code != 200:
             status_code = str(response.status_code)[:10]
             st.error(f"API Error: {status_code}")
             return []
+        if layout:
+            return expand_compact_seatmap(layout, response.json())
         return response.json()
     except requests.exceptions.JSONDecodeError:
         st.error("Invalid response from server")
@@ -71,6 +144,234 @@ def fetch_seatmap(showtime_id, booking_date=None):
         st.error(f"Network error: {error_msg}")
         return []
 
+class LiveSeatMap:
+    """Compact seat map for one show and date, patched in place from the backend's seat event stream"""
+    
+    def __init__(self, showtime_id, booking_date, layout):
+        self.showtime_id = showtime_id
+        self.booking_date = booking_date
+        self.layout = layout
+        self.index = {}
+        for row in layout['rows']:
+            for block in layout['blocks']:
+                for n in block:
+                    self.index[f"{row}{n:02d}"] = len(self.index)
+        self.lock = threading.Lock()
+        self.bits = None
+        self.version = -1
+        self.stale = True
+        self.last_used = time.monotonic()
+        self.stopped = threading.Event()
+        self.response = None
+        threading.Thread(target=self._follow, daemon=True).start()
+    
+    def close(self):
+        """Stop following the show: ends the thread and closes its event stream"""
+        self.stopped.set()
+        self.invalidate()
+        with self.lock:
+            response = self.response
+        if response is not None:
+            response.close()
+    
+    def invalidate(self):
+        with self.lock:
+            self.stale = True
+    
+    def seat_map(self, selected=()):
+        """Seat map in the API's row/block shape; our own selected (held) seats stay available"""
+        with self.lock:
+            stale = self.stale
+        if stale:
+            response = requests.get(f"{API_URL}/seatmap/{self.showtime_id}",
+                                    params={'date': self.booking_date, 'format': 'compact'},
+                                    headers=api_headers(), timeout=3)
+            response.raise_for_status()
+            compact = response.json()
+            with self.lock:
+                self.bits = list(''.join(compact['rows']))
+                self.version = compact['version']
+                self.stale = False
+        with self.lock:
+            bits = list(self.bits)
+        for label in selected:
+            if label in self.index:
+                bits[self.index[label]] = '0'
+        per_row = self.layout['seats_per_row']
+        rows = [''.join(bits[i:i + per_row]) for i in range(0, len(bits), per_row)]
+        return expand_compact_seatmap(self.layout, {'rows': rows})
+    
+    def _apply(self, event, payload):
+        with self.lock:
+            if event == 'hello':
+                # Anything that happened before we subscribed forces one refetch
+                self.stale = self.stale or payload['version'] != self.version
+                return
+            if self.bits is None or event == 'reset' or payload['version'] != self.version + 1:
+                self.stale = True
+                return
+            self.version = payload['version']
+            value = '0' if event in ('released', 'cancelled') else '1'
+            for label in payload['seats']:
+                if label in self.index:
+                    self.bits[self.index[label]] = value
+    
+    def _follow(self):
+        while not self.stopped.is_set():
+            try:
+                with requests.get(f"{API_URL}/seatmap/{self.showtime_id}/events", params={'date': self.booking_date},
+                                  stream=True, timeout=(3, 30)) as response:
+                    with self.lock:
+                        self.response = response
+                    if self.stopped.is_set():
+                        break
+                    event = None
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line.startswith('event:'):
+                            event = line[6:].strip()
+                        elif line.startswith('data:'):
+                            self._apply(event, json.loads(line[5:]))
+            except (requests.exceptions.RequestException, ValueError, AttributeError):
+                # close() from another thread can surface as any of these mid-read
+                pass
+            with self.lock:
+                self.response = None
+            # Missed events while disconnected, so refetch on the next read
+            self.invalidate()
+            self.stopped.wait(2)
+
+class LiveSeatMaps:
+    """Bounded set of followed shows; feeds that are evicted, idle or left by their last viewer are closed"""
+    
+    def __init__(self, limit=LIVE_SEATMAP_LIMIT, idle_seconds=LIVE_SEATMAP_IDLE_SECONDS):
+        self.limit = limit
+        self.idle_seconds = idle_seconds
+        self.feeds = OrderedDict()  # (showtime_id, date) -> LiveSeatMap, least recently viewed first
+        self.viewers = {}  # session id -> ((showtime_id, date), last viewed)
+        self.lock = threading.Lock()
+    
+    def get(self, session_id, showtime_id, booking_date, layout):
+        key = (showtime_id, booking_date)
+        now = time.monotonic()
+        with self.lock:
+            previous = self.viewers.get(session_id)
+            self.viewers[session_id] = (key, now)
+            closed = []
+            if previous and previous[0] != key:
+                closed += self._drop_unwatched(previous[0])
+            feed = self.feeds.get(key)
+            if feed is None:
+                feed = self.feeds[key] = LiveSeatMap(showtime_id, booking_date, layout)
+            self.feeds.move_to_end(key)
+            feed.last_used = now
+            closed += self._evict(now)
+        for old in closed:
+            old.close()
+        return feed
+    
+    def peek(self, showtime_id, booking_date):
+        with self.lock:
+            return self.feeds.get((showtime_id, booking_date))
+    
+    def leave(self, session_id):
+        """The session stopped viewing its show; close the feed if nobody else is watching it"""
+        with self.lock:
+            previous = self.viewers.pop(session_id, None)
+            closed = self._drop_unwatched(previous[0]) if previous else []
+        for old in closed:
+            old.close()
+    
+    def _drop_unwatched(self, key):
+        if any(watched == key for watched, _ in self.viewers.values()):
+            return []
+        feed = self.feeds.pop(key, None)
+        return [feed] if feed else []
+    
+    def _evict(self, now):
+        self.viewers = {session: (key, seen) for session, (key, seen) in self.viewers.items()
+                        if now - seen <= self.idle_seconds}
+        closed = []
+        for key in list(self.feeds):
+            if len(self.feeds) > self.limit or now - self.feeds[key].last_used > self.idle_seconds:
+                closed.append(self.feeds.pop(key))
+        return closed
+
+@st.cache_resource
+def live_seatmaps():
+    """Event-driven seat maps per show and date, shared by every session"""
+    return LiveSeatMaps()
+
+def live_seatmap(showtime_id, booking_date):
+    layout = fetch_hall_layout()
+    if not layout:
+        return None
+    return live_seatmaps().get(st.session_state["holder_id"], showtime_id, booking_date, layout)
+
+def leave_seatmap():
+    live_seatmaps().leave(st.session_state["holder_id"])
+
+def current_seatmap(showtime_id, booking_date, holder, selected):
+    """Event-driven seat map when the layout is available, otherwise a cached full fetch"""
+    feed = live_seatmap(showtime_id, booking_date)
+    if feed is None:
+        return fetch_seatmap(showtime_id, booking_date, holder)
+    try:
+        return feed.seat_map(selected)
+    except requests.exceptions.RequestException as e:
+        error_msg = str(e).replace('\n', ' ').replace('\r', ' ')[:100]
+        st.error(f"Network error: {error_msg}")
+        return []
+
+def invalidate_seatmap(showtime_id, booking_date):
+    fetch_seatmap.clear()
+    feed = live_seatmaps().peek(showtime_id, booking_date)
+    if feed is not None:
+        feed.invalidate()
+
+def toggle_seat_hold(showtime_id, booking_date, seat, selected):
+    """Hold a seat when it is selected and release it when deselected; returns an error message or None"""
+    payload = {
+        "showtime_id": showtime_id,
+        "seats": [seat],
+        "date": booking_date,
+        "holder": st.session_state["holder_id"]
+    }
+    try:
+        if selected:
+            requests.delete(f"{API_URL}/hold", json=payload, headers=api_headers(), timeout=3)
+            return None
+        response = requests.post(f"{API_URL}/hold", json=payload, headers=api_headers(), timeout=3)
+        if response.status_code == 409:
+            invalidate_seatmap(showtime_id, booking_date)
+            return f"Seat {seat} was just taken by someone else"
+        response.raise_for_status()
+        return None
+    except requests.exceptions.RequestException as e:
+        return f"Could not hold seat {seat}: {str(e)[:100]}"
+
+def allocate_best_seats(showtime_id, booking_date, size):
+    """Ask the backend for the best adjacent seats and hold them; returns (seats, error message)"""
+    try:
+        response = requests.post(f"{API_URL}/allocate", json={
+            "showtime_id": showtime_id,
+            "date": booking_date,
+            "size": size,
+            "holder": st.session_state["holder_id"]
+        }, headers=api_headers(), timeout=5)
+        result = response.json()
+        if response.status_code == 200:
+            return result['seats'], None
+        return [], result.get('error', f"HTTP {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        return [], f"Could not pick seats: {str(e)[:100]}"
+
+def format_seat_prices(ticket_data):
+    """One price when every seat cost the same, otherwise each seat with its price"""
+    prices = ticket_data.get('seat_prices') or [ticket_data.get('price_per_seat', 200)] * len(ticket_data['seats'])
+    if len(set(prices)) == 1:
+        return f"₹{prices[0]}"
+    return ', '.join(f"{seat} ₹{price}" for seat, price in zip(ticket_data['seats'], prices))
+
 def generate_ticket_pdf(ticket_data):
     """Generate a PDF ticket with QR code and cinema icon"""
     try:
@@ -116,7 +417,7 @@ def generate_ticket_pdf(ticket_data):
             f"⏰ Show Time: {ticket_data['showtime']}",
             f"📺 Technology: {ticket_data['technology']}",
             f"🪑 Seats: {', '.join(ticket_data['seats'])}",
-            f"💰 Price per Seat: ₹{ticket_data.get('price_per_seat', 200)}",
+            f"💰 Price per Seat: {format_seat_prices(ticket_data)}",
             f"💵 Total Amount: ₹{ticket_data.get('total_price', 200)}"
         ]
         
@@ -449,6 +750,8 @@ if "booking_success" not in st.session_state: st.session_state["booking_success"
 if "booking_message" not in st.session_state: st.session_state["booking_message"] = ""
 if "seat_selected" not in st.session_state: st.session_state["seat_selected"] = set()
 if "selected_date" not in st.session_state: st.session_state["selected_date"] = datetime.now().date()
+if "holder_id" not in st.session_state: st.session_state["holder_id"] = uuid.uuid4().hex
+if not st.session_state["inline_seatmap_id"]: leave_seatmap()
 
 # Location and Movie Selection
 locations = fetch_locations()
@@ -588,11 +891,18 @@ if selected_movie:
         st.markdown("<div class='theatre-section'>", unsafe_allow_html=True)
         st.markdown(f"<h3 style='color:#333; font-weight:600; margin:0 0 20px 0;'>🎭 {tname}</h3>", unsafe_allow_html=True)
         
+        availability = fetch_availability(tid, selected_movie)
+        selected_date_key = st.session_state["selected_date"].strftime('%Y-%m-%d')
         pill_cols = st.columns(len(showtimes))
         for idx, show in enumerate(showtimes):
             with pill_cols[idx]:
                 cancellable_icon = "✅" if show["cancellable"] else "❌"
                 price = show.get('price', 200)
+                seats_left = availability.get(show['showtime_id'], {}).get(selected_date_key)
+                seats_left_html = "" if seats_left is None else f"""
+                        <div style='font-size:11px; font-weight:700; margin-top:6px;'>
+                            {"Sold out" if seats_left == 0 else f"🎟️ {seats_left} seats left"}
+                        </div>"""
                 st.markdown(f"""
                 <div class='showtime-card'>
                     <div style='position:relative; z-index:2;'>
@@ -607,7 +917,7 @@ if selected_movie:
                         </div>
                         <div style='font-size:11px; opacity:0.9; margin-top:8px;'>
                             {cancellable_icon} {"Cancellable" if show["cancellable"] else "Non-cancellable"}
-                        </div>
+                        </div>{seats_left_html}
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
@@ -636,8 +946,26 @@ if selected_movie:
                 """, unsafe_allow_html=True)
                 
                 booking_date = st.session_state["selected_date"].strftime('%Y-%m-%d')
-                seat_map = fetch_seatmap(seatmap_to_show, booking_date)
+                seat_map = current_seatmap(seatmap_to_show, booking_date, st.session_state["holder_id"],
+                                           st.session_state["seat_selected"])
+                if st.session_state.get("hold_error"):
+                    st.warning(st.session_state.pop("hold_error"))
                 if seat_map:
+                    # One click picks and holds the best adjacent seats for the whole party
+                    pick_cols = st.columns([1, 1, 2])
+                    with pick_cols[0]:
+                        party_size = st.number_input("Party size", min_value=1, max_value=10, value=2,
+                                                     key=f"party_size_{seatmap_to_show}")
+                    with pick_cols[1]:
+                        st.markdown("<div style='height:28px;'></div>", unsafe_allow_html=True)
+                        if st.button("✨ Best available", key=f"best_available_{seatmap_to_show}", use_container_width=True):
+                            picked, pick_error = allocate_best_seats(seatmap_to_show, booking_date, int(party_size))
+                            if pick_error:
+                                st.session_state["hold_error"] = pick_error
+                            else:
+                                st.session_state["seat_selected"].update(picked)
+                            invalidate_seatmap(seatmap_to_show, booking_date)
+                            st.rerun()
                     for rowObj in seat_map:
                         row_label = rowObj['row']
                         blocks = rowObj['blocks']
@@ -663,7 +991,10 @@ if selected_movie:
                                             
                                             if st.button(seat['label'], key=btn_key, 
                                                        help=f"Seat {seat['label']} - {'Selected' if selected_now else 'Available'}"):
-                                                if not selected_now:
+                                                hold_error = toggle_seat_hold(seatmap_to_show, booking_date, seat['label'], selected_now)
+                                                if hold_error:
+                                                    st.session_state["hold_error"] = hold_error
+                                                elif not selected_now:
                                                     st.session_state["seat_selected"].add(seat['label'])
                                                 else:
                                                     st.session_state["seat_selected"].remove(seat['label'])
@@ -738,29 +1069,45 @@ if selected_movie:
                             successes = []
                             fails = []
                             
-                            for seat in seats:
-                                try:
-                                    resp = requests.post(f"{API_URL}/book", json={
-                                        "showtime_id": seatmap_to_show,
-                                        "seat": seat,
-                                        "date": booking_date
-                                    }, timeout=5)
-                                    if resp.status_code == 200:
-                                        result = resp.json()
-                                        if "message" in result:
-                                            successes.append(seat)
-                                        else:
-                                            fails.append((seat, result.get('error', 'Unknown error')))
-                                    else:
-                                        fails.append((seat, f"HTTP {resp.status_code}"))
-                                except Exception as e:
-                                    fails.append((seat, str(e)))
+                            # All seats are reserved together in a single request; the checkout's
+                            # idempotency key makes a retried click return the same booking
+                            if "checkout_key" not in st.session_state:
+                                st.session_state["checkout_key"] = uuid.uuid4().hex
+                            booking_id = None
+                            booked_prices = None
+                            try:
+                                resp = requests.post(f"{API_URL}/book/batch", json={
+                                    "showtime_id": seatmap_to_show,
+                                    "seats": seats,
+                                    "date": booking_date,
+                                    "holder": st.session_state["holder_id"],
+                                    "user": st.session_state["holder_id"]
+                                }, headers=api_headers({"Idempotency-Key": st.session_state["checkout_key"]}), timeout=5)
+                                result = resp.json()
+                                if resp.status_code == 200:
+                                    successes = result.get('seats', seats)
+                                    booking_id = result.get('booking_id')
+                                    booked_prices = (result.get('booking') or {}).get('prices')
+                                elif resp.status_code == 409 and 'retry_after' in result:
+                                    # The first click is still booking; keep the key so the retry replays it
+                                    fails = [(seat, 'Booking still in progress, please confirm again shortly') for seat in seats]
+                                elif resp.status_code == 409:
+                                    fails = [(seat, 'Seat already booked') for seat in result.get('conflicts', [])]
+                                    # Drop the taken seats so the rest can be confirmed again
+                                    st.session_state["seat_selected"] -= set(result.get('conflicts', []))
+                                    invalidate_seatmap(seatmap_to_show, booking_date)
+                                else:
+                                    fails = [(seat, result.get('error', f"HTTP {resp.status_code}")) for seat in seats]
+                                # A rejected request made nothing to replay, so the next attempt needs a new key
+                                if 400 <= resp.status_code < 500 and 'retry_after' not in result:
+                                    st.session_state.pop("checkout_key", None)
+                            except Exception as e:
+                                fails = [(seat, str(e)) for seat in seats]
                             
                             if successes:
-                                # Generate and download ticket
-                                # Calculate total price
-                                price_per_seat = this_shows[0].get('price', 200)
-                                total_price = price_per_seat * len(successes)
+                                # Generate and download ticket at the prices the booking recorded
+                                seat_prices = booked_prices or [this_shows[0].get('price', 200)] * len(successes)
+                                total_price = sum(seat_prices)
                                 
                                 ticket_data = {
                                     'movie': movie_name,
@@ -769,8 +1116,8 @@ if selected_movie:
                                     'showtime': this_shows[0]['time'],
                                     'technology': this_shows[0]['technology'],
                                     'date': st.session_state["selected_date"].strftime('%Y-%m-%d'),
-                                    'booking_id': f"BK{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                                    'price_per_seat': price_per_seat,
+                                    'booking_id': booking_id or f"BK{datetime.now().strftime('%Y%m%d%H%M%S')}",
+                                    'seat_prices': seat_prices,
                                     'total_price': total_price
                                 }
                                 
@@ -780,6 +1127,7 @@ if selected_movie:
                                 st.session_state["booking_success"] = True
                                 st.session_state["booking_message"] = msg + f"\n\nTicket saved to: {pdf_path}"
                                 st.session_state["seat_selected"] = set()
+                                del st.session_state["checkout_key"]
                                 st.rerun()
                             
                             if fails:
@@ -1,217 +1,673 @@
-from flask import Flask, request, jsonify, send_from_directory
-import redis
+from flask import Flask, Response, request, jsonify, send_from_directory
+import click
 from flask_cors import CORS
-import random
 import os
-from functools import lru_cache
-from datetime import datetime
+import time
+import queue
+from datetime import datetime, timedelta
+from flask.json.provider import DefaultJSONProvider
+from seat_store import SEAT_LABELS, BookingInProgress, RedisSeatStore, seat_events_channel
+from seat_allocator import seat_segment
+from booking_archive import archive_past_dates, read_archive
+from booking_views import LocalBookingViews, RedisBookingViews, catch_up, movie_view_key, theatre_view_key
+from showtime_search import PRICE_BANDS, TIME_WINDOWS, ShowtimeSearchIndex, parse_clock
+from metrics import (
+    COUNT_BUCKETS, Counter, Histogram, RedisUsage, Registry, current_redis_usage, instrument_pool
+)
+from cinebook import (
+    SEAT_BACKEND, store, HOLD_TTL_SECONDS, ARCHIVE_DIR, LOCATIONS, THEATRES, MOVIES, TECH_TYPES, SHOWTIMES,
+    CATALOG_VERSION, initialize_data, seed_on_boot, theatres_in, json_bytes, json_body, negotiate_encoding,
+    compress_body, rate_limit_wait, BASE_PRICES, SHOWTIME_INDEX, SHOWTIME_RESPONSES,
+    EMPTY_LIST_RESPONSE, LOCATIONS_RESPONSE, MOVIES_RESPONSE, LAYOUT_RESPONSE, price_book, watch_prices,
+    shows_to_price, record_occupancy, priced_showtimes_response, seatmap_payload, book_seats, place_holds,
+    release_holds, warm_prebookings, parse_booking, idempotency_key_from, booking_outcome, cancel_bookings,
+    parse_cancellation, bulk_cancel_payload, seat_events, format_seat_event, seat_allocator, watch_allocations,
+    ALLOCATE_ATTEMPTS, parse_allocation, promote_waitlist, parse_waitlist, AVAILABILITY_TTL_SECONDS,
+    MAX_AVAILABILITY_DAYS, availability_cache, availability_lock, watch_availability, build_availability
+)
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used instead
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify and request parsing on orjson, several times faster than the stdlib encoder"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
 CORS(app)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
-# Optimized Redis connection with connection pooling
-pool = redis.ConnectionPool(host='localhost', port=6379, db=0, decode_responses=True, max_connections=20)
-r = redis.Redis(connection_pool=pool)
-
-LOCATIONS = ["Kolkata", "Delhi", "Mumbai", "Bangalore"]
-
-THEATRES = {
-    "1": {"name": "INOX: South City", "location": "Kolkata"},
-    "2": {"name": "PVR: Diamond Plaza", "location": "Kolkata"},
-    "3": {"name": "Cinepolis: Lake Mall", "location": "Kolkata"},
-    "4": {"name": "INOX: Quest Mall", "location": "Kolkata"},
-    "5": {"name": "Cinepolis: Acropolis Mall", "location": "Kolkata"},
-    "6": {"name": "INOX: Nehru Place", "location": "Delhi"},
-    "7": {"name": "PVR: DLF Promenade", "location": "Delhi"},
-    "8": {"name": "Cinepolis: Select Citywalk", "location": "Delhi"},
-    "9": {"name": "INOX: R City Mall", "location": "Mumbai"},
-    "10": {"name": "PVR: Phoenix Marketcity", "location": "Mumbai"},
-    "11": {"name": "Cinepolis: Andheri West", "location": "Mumbai"},
-    "12": {"name": "INOX: Orion Mall", "location": "Bangalore"},
-    "13": {"name": "PVR: Forum Mall", "location": "Bangalore"},
-    "14": {"name": "Cinepolis: ETA Mall", "location": "Bangalore"}
-}
+# Per-request Redis usage comes from the store's own connection pools
+if isinstance(store, RedisSeatStore):
+    for client in [store.r, store.rb] + store.nodes + store.nodes_raw:
+        instrument_pool(client.connection_pool)
 
-MOVIES = {
-    "201": {"name": "Param Sundari", "genres": "Comedy/Drama/Romantic", "rating": "164.8K Likes", "poster_url": "static/param_sundari.jpg"},
-    "202": {"name": "Vash Level 2", "genres": "Supernatural/Thriller", "rating": "8.7/10 936 Votes", "poster_url": "static/vash_level_2.jpg"},
-    "203": {"name": "Dhumketu", "genres": "Drama/Family", "rating": "7.3/10 15.3K Votes", "poster_url": "static/dhumketu.jpg"},
-    "204": {"name": "War 2", "genres": "Action/Thriller", "rating": "7.8/10 160.9K Votes", "poster_url": "static/war2.jpg"},
-    "205": {"name": "Mahavatar Narsimha", "genres": "Action/Animation/Drama", "rating": "9.6/10 289.6K Votes", "poster_url": "static/mahavatar_narsimha.jpg"}
-}
+@app.cli.command('seed-catalog')
+@click.option('--force', is_flag=True, help='Rewrite the catalog even if this version is already seeded')
+def seed_catalog_command(force):
+    """Seed theatre, movie and showtime hashes (workers also do this on boot unless SEED_ON_BOOT=0)"""
+    if initialize_data(force=force):
+        print(f"Seeded catalog version {CATALOG_VERSION}")
+    else:
+        print(f"Catalog version {CATALOG_VERSION} already seeded, nothing to do")
 
-TECH_TYPES = ['ATMOS', 'LASER', 'INSIGNIA', 'DOLBY 7.1']
-SHOWTIME_SLOTS = [
-    "09:10 AM", "10:00 AM", "11:00 AM", "12:05 PM", "01:50 PM", "03:10 PM", "04:45 PM",
-    "05:45 PM", "07:40 PM", "08:40 PM", "10:35 PM", "11:35 PM"
-]
-
-# Generate showtimes
-SHOWTIMES = []
-showtime_id = 1
-for tid in THEATRES:
-    for mid in MOVIES:
-        for idx, slot in enumerate(SHOWTIME_SLOTS):
-            SHOWTIMES.append({
-                "id": str(showtime_id),
-                "theatre_id": tid,
-                "movie_id": mid,
-                "time": slot,
-                "technology": TECH_TYPES[idx % len(TECH_TYPES)],
-                "cancellable": ((idx % 4) < 3),
-            })
-            showtime_id += 1
-
-def initialize_data():
-    """Initialize Redis data"""
-    for tid, tdat in THEATRES.items():
-        r.hset(f"theatre:{tid}", mapping=tdat)
-    for mid, mdat in MOVIES.items():
-        r.hset(f"movie:{mid}", mapping=mdat)
-    for st in SHOWTIMES:
-        r.hset(f"showtime:{st['id']}", mapping={
-            "movie_id": st["movie_id"],
-            "theatre_id": st["theatre_id"],
-            "time": st["time"],
-            "technology": st["technology"],
-            "cancellable": "yes" if st["cancellable"] else "no"
-        })
-        r.delete(f"showtime:{st['id']}:booked")
-
-initialize_data()
+# Every worker makes sure the catalog is seeded before it serves
+seed_on_boot()
 
 @app.route('/locations')
-@lru_cache(maxsize=1)
 def get_locations():
     """Get all available locations"""
-    return jsonify(LOCATIONS)
+    return cached_json_response(*LOCATIONS_RESPONSE, static=True)
 
 @app.route('/theatres/<location>')
 def get_theatres(location):
     """Get theatres for a specific location"""
-    result = {tid: t["name"] for tid, t in THEATRES.items() if t["location"].lower() == location.lower()}
-    return jsonify(result)
+    return jsonify(theatres_in(location))
 
 @app.route('/movies')
-@lru_cache(maxsize=1)
 def get_movies():
     """Get all available movies"""
-    return jsonify(MOVIES)
+    return cached_json_response(*MOVIES_RESPONSE, static=True)
 
-def get_pricing(show_time):
-    """Calculate pricing based on show timing"""
-    try:
-        # Extract hour from time string (e.g., "09:10 AM" -> 9)
-        time_part = show_time.split()[0]  # "09:10"
-        hour = int(time_part.split(':')[0])  # 9
-        is_pm = 'PM' in show_time
-        
-        if is_pm and hour != 12:
-            hour += 12
-        elif not is_pm and hour == 12:
-            hour = 0
-            
-        # Pricing logic
-        if 6 <= hour < 12:  # Morning (6 AM - 12 PM)
-            return 200  # Average price
-        elif 12 <= hour < 18:  # Afternoon (12 PM - 6 PM) 
-            return 300  # High price
-        else:  # Night (6 PM - 6 AM)
-            return 150  # Low price
-            
-    except:
-        return 200  # Default price
+def cached_json_response(body, etag, cache_control='no-cache', static=False):
+    """Serve pre-serialized JSON bytes, compressed when the client allows, answering repeat polls with 304"""
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), len(body))
+    resp = app.response_class(body, mimetype='application/json')
+    # Each encoding is its own representation, so it gets its own ETag
+    resp.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    resp.headers['Cache-Control'] = cache_control  # no-cache: clients may keep it but must revalidate
+    resp.vary.add('Accept-Encoding')
+    resp = resp.make_conditional(request)
+    if encoding and resp.status_code == 200:
+        resp.set_data(compress_body(body, encoding, etag if static else None))
+        resp.headers['Content-Encoding'] = encoding
+    return resp
+
+# Per-route request metrics served at /metrics; routes are labelled by their URL rule
+metrics = Registry()
+REQUEST_LATENCY = metrics.register(Histogram(
+    'http_request_duration_seconds', 'Time to build a response, compression included', ('route', 'method')))
+RESPONSES = metrics.register(Counter(
+    'http_responses_total', 'Responses by route and status code', ('route', 'method', 'status')))
+REDIS_COMMANDS = metrics.register(Histogram(
+    'redis_commands_per_request', 'Redis commands (replies read) per request', ('route',), COUNT_BUCKETS))
+REDIS_ROUNDTRIPS = metrics.register(Histogram(
+    'redis_roundtrips_per_request', 'Redis round trips (commands or pipelines sent) per request',
+    ('route',), COUNT_BUCKETS))
+REDIS_SECONDS = metrics.register(Histogram(
+    'redis_seconds_per_request', 'Time spent sending to and reading from Redis per request', ('route',)))
+SHED = metrics.register(Counter(
+    'http_requests_shed_total', 'Requests refused with 429 by the rate limiter, by the bucket that ran dry',
+    ('route', 'scope')))
+
+@app.before_request
+def start_request_metrics():
+    request.environ['metrics.started'] = time.perf_counter()
+    current_redis_usage.set(RedisUsage())
+
+def rate_limit_subject(scope):
+    """Who or what a request's bucket for a scope belongs to, or None when the scope does not apply"""
+    if scope == 'client':
+        return request.headers.get('X-Session-Id') or request.remote_addr
+    if scope == 'showtime':
+        showtime_id = (request.view_args or {}).get('showtime_id') or request.args.get('showtime_id')
+        if showtime_id is None and request.is_json:
+            showtime_id = (request.get_json(silent=True) or {}).get('showtime_id')
+        return showtime_id
+    return None
+
+@app.before_request
+def enforce_rate_limits():
+    """Refuse requests whose token buckets ran dry with 429 and a Retry-After"""
+    route = request.url_rule.rule if request.url_rule is not None else None
+    shed = rate_limit_wait(route, rate_limit_subject)
+    if shed is None:
+        return None
+    retry_after, scope = shed
+    SHED.inc((route, scope))
+    resp = jsonify({'error': 'Too many requests, please retry shortly', 'retry_after': retry_after})
+    resp.status_code = 429
+    resp.headers['Retry-After'] = str(retry_after)
+    return resp
+
+# Registered before compress_response so it runs after it and times compression too
+@app.after_request
+def record_request_metrics(resp):
+    """Record latency, status code and Redis usage of the request under its route"""
+    started = request.environ.get('metrics.started')
+    usage = current_redis_usage.get()
+    if started is None or usage is None:
+        return resp
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_LATENCY.observe((route, request.method), time.perf_counter() - started)
+    RESPONSES.inc((route, request.method, str(resp.status_code)))
+    REDIS_COMMANDS.observe((route,), usage.commands)
+    REDIS_ROUNDTRIPS.observe((route,), usage.roundtrips)
+    REDIS_SECONDS.observe((route,), usage.seconds)
+    return resp
+
+@app.teardown_request
+def stop_request_metrics(exc):
+    current_redis_usage.set(None)
+
+@app.route('/metrics')
+def get_metrics():
+    """Request metrics of this process in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.after_request
+def compress_response(resp):
+    """Compress large JSON replies built per request (e.g. jsonify'd seat maps)"""
+    if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+            or resp.mimetype != 'application/json' or 'Content-Encoding' in resp.headers):
+        return resp
+    resp.vary.add('Accept-Encoding')
+    body = resp.get_data()
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), len(body))
+    if encoding:
+        resp.set_data(compress_body(body, encoding))
+        resp.headers['Content-Encoding'] = encoding
+    return resp
 
 @app.route('/showtimes/<theatre_id>')
 def get_showtimes(theatre_id):
-    """Get showtimes for a specific theatre and optionally movie"""
-    mid = request.args.get('movie_id')
-    
-    # Pre-filter and optimize lookup
-    filtered_shows = [st for st in SHOWTIMES if st["theatre_id"] == theatre_id and (not mid or st["movie_id"] == mid)]
-    
-    out = []
-    for st in filtered_shows:
-        m = MOVIES[st["movie_id"]]
-        price = get_pricing(st["time"])
-        out.append({
-            "showtime_id": st["id"],
-            "movie_id": st["movie_id"],
-            "movie_name": m["name"],
-            "genres": m["genres"],
-            "rating": m["rating"],
-            "time": st["time"],
-            "technology": st["technology"],
-            "cancellable": st["cancellable"],
-            "price": price
-        })
-    return jsonify(out)
+    """Get showtimes for a specific theatre and optionally movie; with ?date= at that date's occupancy prices"""
+    mid = request.args.get('movie_id') or None
+    booking_date = request.args.get('date')
+    if booking_date:
+        pairs = shows_to_price(theatre_id, mid, booking_date)
+        if pairs:
+            record_occupancy(pairs, store.counts(pairs))
+        return cached_json_response(*priced_showtimes_response(theatre_id, mid, booking_date))
+    body, etag = SHOWTIME_RESPONSES.get((theatre_id, mid), EMPTY_LIST_RESPONSE)
+    return cached_json_response(body, etag, static=True)
+
+# City-wide showtime search answers from inverted indexes over the static catalog
+SEARCH_INDEX = ShowtimeSearchIndex(SHOWTIMES, THEATRES, BASE_PRICES)
+SEARCH_ROWS = {
+    show["showtime_id"]: dict(show, theatre_id=tid, theatre_name=THEATRES[tid]["name"])
+    for tid, by_movie in SHOWTIME_INDEX.items() for shows in by_movie.values() for show in shows
+}
+MAX_SEARCH_RESULTS = 500
+
+def csv_arg(args, name):
+    """A comma-separated query argument as a list of non-empty values"""
+    return [value.strip() for value in args.get(name, '').split(',') if value.strip()]
+
+def parse_search(args):
+    """Validate /search/showtimes arguments into ShowtimeSearchIndex.search keyword arguments; raises ValueError"""
+    locations = csv_arg(args, 'location')
+    unknown = {location.lower() for location in locations} - {location.lower() for location in LOCATIONS}
+    if not locations or unknown:
+        raise ValueError(f'location must be one of {", ".join(LOCATIONS)}')
+    technologies = [tech.upper() for tech in csv_arg(args, 'technology')]
+    if set(technologies) - set(TECH_TYPES):
+        raise ValueError(f'technology must be one of {", ".join(TECH_TYPES)}')
+    query = {'locations': locations, 'technologies': technologies,
+             'theatre_ids': csv_arg(args, 'theatre_id'), 'movie_ids': csv_arg(args, 'movie_id')}
+    band = args.get('price_band')
+    if band:
+        if band not in PRICE_BANDS:
+            raise ValueError(f'price_band must be one of {", ".join(PRICE_BANDS)}')
+        query['price_range'] = PRICE_BANDS[band]
+    window = args.get('window')
+    if window:
+        if window not in TIME_WINDOWS:
+            raise ValueError(f'window must be one of {", ".join(TIME_WINDOWS)}')
+        query['time_range'] = TIME_WINDOWS[window]
+    elif args.get('from') or args.get('to'):
+        query['time_range'] = (parse_clock(args.get('from') or '00:00'), parse_clock(args.get('to') or '24:00'))
+    return query
+
+@app.route('/search/showtimes')
+def search_showtimes():
+    """Find showtimes across a location by technology, price band and time window; with ?seats= only
+    shows with that many free seats on the date, at the date's prices"""
+    try:
+        query = parse_search(request.args)
+        seats = int(request.args.get('seats') or 0)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    booking_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    ids = SEARCH_INDEX.search(**query)
+    if not seats:
+        results = [SEARCH_ROWS[showtime_id] for showtime_id in ids[:MAX_SEARCH_RESULTS]]
+        return jsonify({'date': booking_date, 'count': len(ids), 'showtimes': results})
+    
+    # Availability changes with every booking, so it is read per query in one batched store call
+    watch_prices()
+    pairs = [(showtime_id, booking_date) for showtime_id in ids]
+    counts = store.counts(pairs)
+    record_occupancy(pairs, counts)
+    results = []
+    for (showtime_id, _), (booked, held) in zip(pairs, counts):
+        free = max(len(SEAT_LABELS) - booked - held, 0)
+        if free < seats:
+            continue
+        table = price_book.current(showtime_id, booking_date, BASE_PRICES[showtime_id])
+        results.append(dict(SEARCH_ROWS[showtime_id], free=free, band=table.band, price=table.standard,
+                            prices=table.by_tier()))
+    return jsonify({'date': booking_date, 'count': len(results), 'showtimes': results[:MAX_SEARCH_RESULTS]})
+
+@app.route('/seatmap/layout')
+def get_seatmap_layout():
+    """Get the fixed hall layout used to expand compact seat maps"""
+    body, etag = LAYOUT_RESPONSE
+    return cached_json_response(body, etag, cache_control='public, max-age=86400, immutable', static=True)
 
 @app.route('/seatmap/<showtime_id>')
 def seatmap_for_showtime(showtime_id):
-    """Get seat map for a specific showtime and date"""
+    """Get seat map for a specific showtime and date; held seats show as booked (?format=compact for per-row strings)"""
     try:
         booking_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+        holder = request.args.get('holder')  # the caller's own holds stay selectable
         
-        # Optimized seat map generation
-        rows = "ABCDEFGHIJKLMN"
-        blocks_ranges = [
-            list(range(20, 24)),     # left block: 20-23
-            list(range(12, 20)),     # center_left: 12-19  
-            list(range(2, 12)),      # center_right: 2-11
-            list(range(0, 2)) + list(range(24, 28))  # right: 0-1, 24-27
-        ]
-        
-        # Date-specific booking key
-        booked_key = f'showtime:{showtime_id}:booked:{booking_date}'
-        
-        # Single Redis call to get booked seats
-        booked = set(r.smembers(booked_key))
-        
-        # Initialize if empty (reduced pre-booking for faster load)
-        if not booked:
-            all_seats = [f"{row}{n:02d}" for row in rows for block_range in blocks_ranges for n in block_range]
-            prebook = random.sample(all_seats, int(0.15 * len(all_seats)))  # Reduced to 15%
-            if prebook:
-                r.sadd(booked_key, *prebook)
-                booked = set(prebook)
+        # One store read for occupancy, holds, seat-map version and prebook flag
+        bits, version, prebooked = store.seat_state(showtime_id, booking_date, holder)
         
-        # Build optimized seat map
-        seat_map = []
-        for row in rows:
-            blocks = []
-            for block_range in blocks_ranges:
-                block = [{"label": f"{row}{n:02d}", "booked": f"{row}{n:02d}" in booked} for n in block_range]
-                blocks.append(block)
-            seat_map.append({"row": row, "blocks": blocks})
+        # First read of a show that was not warmed up: prebook it once
+        if not prebooked:
+            store.prebook(showtime_id, booking_date)
+            bits, version, prebooked = store.seat_state(showtime_id, booking_date, holder)
         
-        return jsonify(seat_map)
+        compact = request.args.get('format') == 'compact'
+        payload = seatmap_payload(showtime_id, booking_date, bits, version, compact, holder)
+        if compact:
+            return cached_json_response(*json_body(payload))
+        return jsonify(payload)
     
     except Exception as e:
         print(f"Error in seatmap_for_showtime: {e}")
         return jsonify([])
 
+@app.route('/occupancy/<showtime_id>')
+def occupancy_for_showtime(showtime_id):
+    """Get booked, held and free seat counts for a showtime and date"""
+    booking_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    booked, held = store.count(showtime_id, booking_date)
+    return jsonify({
+        'showtime_id': showtime_id,
+        'date': booking_date,
+        'booked': booked,
+        'held': held,
+        'free': max(len(SEAT_LABELS) - booked - held, 0),
+        'total': len(SEAT_LABELS)
+    })
+
+@app.cli.command('warm-seats')
+@click.option('--days', default=5, show_default=True, help='Number of bookable days to warm, starting today')
+def warm_seats_command(days):
+    """Prebook all showtimes ahead of time so no customer request pays for it"""
+    applied, total = warm_prebookings(days)
+    print(f"Prebooked {applied} of {total} showtime dates ({total - applied} were already initialized)")
+
+@app.cli.command('sweep-holds')
+@click.option('--interval', default=5.0, show_default=True, help='Seconds between sweeps')
+@click.option('--once', is_flag=True, help='Run a single sweep and exit')
+def sweep_holds_command(interval, once):
+    """Expire lapsed seat holds so seat maps free them promptly"""
+    while True:
+        swept = store.sweep_holds()
+        if swept:
+            print(f"Released {swept} expired seat holds")
+        if once:
+            break
+        time.sleep(interval)
+
+@app.cli.command('archive-bookings')
+@click.option('--days', default=7, show_default=True, help='How many past show dates to check')
+@click.option('--interval', default=3600.0, show_default=True, help='Seconds between runs')
+@click.option('--once', is_flag=True, help='Run a single pass and exit')
+def archive_bookings_command(days, interval, once):
+    """Copy past show dates' bookings into compressed columnar files, then purge them from the store"""
+    while True:
+        for booking_date, count in archive_past_dates(store, ARCHIVE_DIR, days):
+            print(f"Archived {count} bookings for {booking_date}")
+        if once:
+            break
+        time.sleep(interval)
+
+@app.cli.command('migrate-bitmaps')
+def migrate_bitmaps_command():
+    """Move seat bookings from label sets to bitmaps (run before SEAT_STORAGE=bitmap)"""
+    if not isinstance(store, RedisSeatStore):
+        raise click.ClickException(f"migrate-bitmaps needs SEAT_BACKEND=redis, not {SEAT_BACKEND}")
+    migrated, skipped = store.migrate_sets_to_bitmaps()
+    print(f"Migrated {migrated} seat sets to bitmaps ({skipped} seats outside the hall layout dropped)")
+
+def handle_booking(data, batch):
+    """Shared body of the /book and /book/batch routes"""
+    try:
+        showtime_id, booking_date, seats, holder, user = parse_booking(data, batch)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Idempotency check, booking, record and version bump happen in one store call
+    try:
+        booking, conflicts, replayed = book_seats(showtime_id, booking_date, seats, holder, user,
+                                                  idempotency_key_from(request.headers.get('Idempotency-Key'), data))
+    except (ValueError, BookingInProgress) as e:
+        status, payload = booking_outcome(showtime_id, booking_date, seats, batch, error=e)
+        replayed = False
+    else:
+        status, payload = booking_outcome(showtime_id, booking_date, seats, batch, conflicts, booking=booking,
+                                          replayed=replayed)
+    resp = jsonify(payload)
+    if replayed and status == 200:
+        resp.headers['Idempotent-Replayed'] = 'true'
+    if 'retry_after' in payload:
+        resp.headers['Retry-After'] = str(payload['retry_after'])
+    return resp, status
+
 @app.route('/book', methods=['POST'])
 def book_seat():
     """Book a specific seat for a showtime and date"""
-    data = request.json
+    return handle_booking(request.json, batch=False)
+
+@app.route('/book/batch', methods=['POST'])
+def book_seats_batch():
+    """Atomically book several seats for a showtime and date"""
+    return handle_booking(request.json, batch=True)
+
+@app.route('/bookings/<booking_id>')
+def get_booking(booking_id):
+    """Get one booking record by its id"""
+    booking = store.get_booking(booking_id)
+    if booking is None:
+        return jsonify({'error': 'Booking not found'}), 404
+    return jsonify(booking)
+
+@app.route('/bookings/archive/<booking_date>')
+def get_archived_bookings(booking_date):
+    """Get an archived show date's bookings"""
+    bookings = read_archive(ARCHIVE_DIR, booking_date)
+    if bookings is None:
+        return jsonify({'error': f'No archive for {booking_date}'}), 404
+    return jsonify(bookings)
+
+@app.route('/bookings')
+def get_user_bookings():
+    """Get a user's bookings, oldest first"""
+    user = request.args.get('user')
+    if not user:
+        return jsonify({'error': 'Missing user'}), 400
+    return jsonify(store.user_bookings(user))
+
+@app.route('/bookings/<booking_id>', methods=['DELETE'])
+def cancel_booking(booking_id):
+    """Cancel a booking, freeing its seats, and report the refund"""
+    cancelled, refused = cancel_bookings([booking_id])
+    if refused:
+        status, error = refused[booking_id]
+        return jsonify({'error': error}), status
+    booking = cancelled[0]
+    return jsonify({'message': f'Booking {booking_id} cancelled.', 'booking': booking, 'refund': booking['refund']})
+
+@app.route('/bookings/cancel', methods=['POST'])
+def cancel_bookings_bulk():
+    """Cancel several bookings; each is cancelled or refused on its own"""
+    try:
+        booking_ids = parse_cancellation(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(bulk_cancel_payload(*cancel_bookings(booking_ids)))
+
+@app.route('/hold', methods=['POST'])
+def hold_seats():
+    """Hold seats for a short time while the customer completes the booking"""
+    data = request.json or {}
+    showtime_id = data.get('showtime_id')
+    seats = data.get('seats')
+    holder = data.get('holder')
+    booking_date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
+    
+    if not showtime_id or not holder or not seats or not isinstance(seats, list):
+        return jsonify({'error': 'Missing showtime_id, holder or seats'}), 400
+    
+    seats = list(dict.fromkeys(str(seat) for seat in seats))
+    try:
+        conflicts = place_holds(showtime_id, booking_date, seats, holder)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if conflicts:
+        return jsonify({'error': 'Some seats are not available', 'conflicts': conflicts}), 409
+    
+    return jsonify({'held': seats, 'holder': holder, 'expires_in': HOLD_TTL_SECONDS})
+
+@app.route('/hold', methods=['DELETE'])
+def release_held_seats():
+    """Release some or all of a holder's seat holds"""
+    data = request.json or {}
     showtime_id = data.get('showtime_id')
-    seat = data.get('seat')
+    holder = data.get('holder')
+    seats = data.get('seats') or []
     booking_date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
     
-    if not showtime_id or not seat:
-        return jsonify({'error': 'Missing showtime_id or seat'}), 400
+    if not showtime_id or not holder or not isinstance(seats, list):
+        return jsonify({'error': 'Missing showtime_id or holder'}), 400
+    
+    released = release_holds(showtime_id, booking_date, holder, [str(seat) for seat in seats])
+    if released:
+        promote_waitlist(showtime_id, booking_date)
+    return jsonify({'released': released})
+
+@app.route('/seatmap/<showtime_id>/events')
+def seatmap_events(showtime_id):
+    """Stream seat changes for a showtime and date as server-sent events"""
+    booking_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    channel = seat_events_channel(showtime_id, booking_date)
+    # Subscribe before reading the version so no change falls in between
+    events = seat_events.subscribe(channel)
+    version = store.version(showtime_id, booking_date)
+    
+    def stream():
+        try:
+            # Clients compare this with the version of the seat map they hold
+            yield f"event: hello\ndata: {{\"version\":{version}}}\n\n"
+            while True:
+                try:
+                    message = events.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_seat_event(message)
+        finally:
+            seat_events.unsubscribe(channel, events)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/allocate', methods=['POST'])
+def allocate_seats():
+    """Pick the best contiguous free seats for a party and hold them for its holder"""
+    try:
+        showtime_id, booking_date, size, holder, rows, blocks = parse_allocation(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    watch_allocations()
+    for _ in range(ALLOCATE_ATTEMPTS):
+        seats = seat_allocator.pick(showtime_id, booking_date, size, rows, blocks)
+        if seats is None:
+            return jsonify({'error': f'No {size} adjacent seats available'}), 409
+        row, block = seat_segment(seats[0])
+        conflicts = place_holds(showtime_id, booking_date, seats, holder)
+        if not conflicts:
+            return jsonify({'showtime_id': showtime_id, 'date': booking_date, 'seats': seats, 'row': row,
+                            'block': block, 'held': True, 'holder': holder, 'expires_in': HOLD_TTL_SECONDS})
+        # Lost a race for these seats; the index learns it before their event arrives
+        seat_allocator.taken(showtime_id, booking_date, conflicts)
+    return jsonify({'error': 'Seats are selling fast, please try again'}), 409
+
+@app.route('/waitlist', methods=['POST'])
+def join_waitlist():
+    """Queue a party for a sold-out show; it is promoted at once if seats are free"""
+    try:
+        showtime_id, booking_date, party, holder, user = parse_waitlist(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    entry = store.join_waitlist(showtime_id, booking_date, party, holder, user)
+    promote_waitlist(showtime_id, booking_date)
+    return jsonify(store.waitlist_entry(entry['entry_id']))
+
+@app.route('/waitlist/<entry_id>')
+def get_waitlist_entry(entry_id):
+    """Get a waitlist entry: its place in line, or the seats held for it once promoted"""
+    entry = store.waitlist_entry(entry_id)
+    if entry is None:
+        return jsonify({'error': 'Waitlist entry not found'}), 404
+    return jsonify(entry)
+
+@app.route('/waitlist/<entry_id>', methods=['DELETE'])
+def leave_waitlist(entry_id):
+    """Leave the waitlist, giving up any seats held for the party"""
+    entry, left = store.leave_waitlist(entry_id)
+    if entry is None:
+        return jsonify({'error': 'Waitlist entry not found'}), 404
+    if not left:
+        return jsonify({'error': 'Already left the waitlist'}), 409
+    if entry['seats'] and release_holds(entry['showtime_id'], entry['date'], entry['holder'], entry['seats']):
+        promote_waitlist(entry['showtime_id'], entry['date'])
+    return jsonify(entry)
+
+@app.route('/waitlist/<entry_id>/events')
+def waitlist_events(entry_id):
+    """Stream a waitlist entry as server-sent events: its position while waiting, then its promotion"""
+    entry = store.waitlist_entry(entry_id)
+    if entry is None:
+        return jsonify({'error': 'Waitlist entry not found'}), 404
+    channel = seat_events_channel(entry['showtime_id'], entry['date'])
+    # Promotions hold seats, so every change to the entry follows a seat event on its show
+    events = seat_events.subscribe(channel)
+    
+    def stream():
+        try:
+            current = store.waitlist_entry(entry_id)
+            yield f"event: {current['status']}\ndata: {json_bytes(current).decode('utf-8')}\n\n"
+            while current['status'] == 'waiting':
+                try:
+                    events.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                latest = store.waitlist_entry(entry_id)
+                if latest != current:
+                    current = latest
+                    yield f"event: {current['status']}\ndata: {json_bytes(current).decode('utf-8')}\n\n"
+        finally:
+            seat_events.unsubscribe(channel, events)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/availability')
+def get_availability():
+    """Get free seats for every showtime of a theatre (optionally one movie) over the next few days"""
+    theatre_id = request.args.get('theatre_id')
+    movie_id = request.args.get('movie_id') or None
+    if not theatre_id:
+        return jsonify({'error': 'Missing theatre_id'}), 400
+    try:
+        days = min(max(int(request.args.get('days', 5)), 1), MAX_AVAILABILITY_DAYS)
+    except ValueError:
+        return jsonify({'error': 'days must be a number'}), 400
     
-    # Date-specific booking key
-    seat_set_name = f"showtime:{showtime_id}:booked:{booking_date}"
+    today = datetime.now()
+    dates = [(today + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    key = (theatre_id, movie_id, days, dates[0])
     
-    # Check if seat is already booked
-    if r.sismember(seat_set_name, seat):
-        return jsonify({'error': 'Seat already booked'}), 409
+    with availability_lock:
+        cached = availability_cache.get(key)
+    if cached and cached[0] > time.time():
+        return cached_json_response(cached[1], cached[2])
     
-    # Book the seat
-    r.sadd(seat_set_name, seat)
-    return jsonify({'message': f'Seat {seat} successfully booked for showtime {showtime_id} on {booking_date}.'})
+    watch_availability()
+    body, etag = json_body(build_availability(theatre_id, movie_id, dates))
+    with availability_lock:
+        availability_cache[key] = (time.time() + AVAILABILITY_TTL_SECONDS, body, etag)
+    return cached_json_response(body, etag)
+
+# Analytics views folded from the booking log. `flask consume-bookings` keeps the
+# Redis views current; reads fold in whatever it has not applied yet.
+booking_views = RedisBookingViews(store.r) if isinstance(store, RedisSeatStore) else LocalBookingViews()
+VIEW_CATALOG = {st["id"]: (st["theatre_id"], st["movie_id"], BASE_PRICES[st["id"]]) for st in SHOWTIMES}
+SHOWS_PER_MOVIE = {mid: sum(1 for st in SHOWTIMES if st["movie_id"] == mid) for mid in MOVIES}
+MAX_VIEW_CATCH_UP = 10000  # log entries a read folds in before answering from the views as they are
+MAX_POPULAR_SEATS = 100
+
+@app.cli.command('consume-bookings')
+@click.option('--from', 'start', default=None, help='Continue after this event id instead of the stored offset')
+@click.option('--rebuild', is_flag=True, help='Drop the views and replay the booking log from the start')
+@click.option('--batch', default=1000, show_default=True, help='Log entries applied per transaction')
+@click.option('--once', is_flag=True, help='Catch up and exit instead of following the log')
+def consume_bookings_command(start, rebuild, batch, once):
+    """Fold booking, hold and cancel events into the analytics views"""
+    if not isinstance(store, RedisSeatStore):
+        raise click.ClickException(f"consume-bookings needs SEAT_BACKEND=redis, not {SEAT_BACKEND}")
+    if rebuild:
+        booking_views.reset()
+    if start is not None:
+        booking_views.seek(start)
+    print(f"Consuming the booking log after {booking_views.offset()}")
+    while True:
+        applied = booking_views.advance(store, VIEW_CATALOG, batch, block=None if once else 5.0)
+        if applied:
+            print(f"Applied {applied} events, now at {booking_views.offset()}")
+        elif once:
+            break
+
+def current_views():
+    """Fold pending log entries into the views; returns the offset they are current to"""
+    catch_up(booking_views, store, VIEW_CATALOG, limit=MAX_VIEW_CATCH_UP)
+    return booking_views.offset()
+
+@app.route('/analytics/revenue')
+def get_revenue():
+    """Get revenue, seats sold and seats held per theatre for a show date"""
+    booking_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    as_of = current_views()
+    view = booking_views.view(theatre_view_key(booking_date))
+    theatres = [{
+        "theatre_id": tid,
+        "name": THEATRES[tid]["name"],
+        "revenue": view.get(f"{tid}:revenue", 0),
+        "seats_sold": view.get(f"{tid}:sold", 0),
+        "seats_held": view.get(f"{tid}:held", 0)
+    } for tid in THEATRES]
+    return jsonify({"date": booking_date, "as_of": as_of, "theatres": theatres,
+                    "total_revenue": sum(theatre["revenue"] for theatre in theatres)})
+
+@app.route('/analytics/fill-rate')
+def get_fill_rate():
+    """Get the share of seats sold through bookings per movie for a show date, fullest first"""
+    booking_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    as_of = current_views()
+    view = booking_views.view(movie_view_key(booking_date))
+    movies = []
+    for mid, movie in MOVIES.items():
+        offered = SHOWS_PER_MOVIE[mid] * len(SEAT_LABELS)
+        sold = view.get(mid, 0)
+        movies.append({"movie_id": mid, "name": movie["name"], "seats_sold": sold, "seats_offered": offered,
+                       "fill_rate": round(sold / offered, 4) if offered else 0.0})
+    movies.sort(key=lambda movie: -movie["fill_rate"])
+    return jsonify({"date": booking_date, "as_of": as_of, "movies": movies})
+
+@app.route('/analytics/popular-seats')
+def get_popular_seats():
+    """Get the seats booked most often across every show"""
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), MAX_POPULAR_SEATS)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    as_of = current_views()
+    return jsonify({"as_of": as_of, "seats": [{"seat": seat, "bookings": count}
+                                              for seat, count in booking_views.popular_seats(limit)]})
 
 @app.route('/static/<path:filename>')
 def static_files(filename):
@@ -0,0 +1,302 @@
+"""ASGI edition of the CineBook catalog, seat map and booking routes.
+
+Catalog data and route logic come from cinebook, as in the Flask edition, so
+both editions answer the same way; seat reads and bookings go through redis.asyncio (or worker
+threads for in-process stores), so one process can keep thousands of
+requests in flight. Serve it with any ASGI server:
+
+    uvicorn asgi_app:app --port 5001
+"""
+import asyncio
+import json
+import os
+import re
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import cinebook
+from cinebook import (
+    SEAT_BACKEND, LOCATIONS_RESPONSE, MOVIES_RESPONSE, SHOWTIME_RESPONSES, EMPTY_LIST_RESPONSE, LAYOUT_RESPONSE,
+    json_bytes, json_body, negotiate_encoding, compress_body, seed_on_boot, rate_limit_wait,
+    theatres_in, seatmap_payload, quote_prices, shows_to_quote, shows_to_price, record_occupancy, priced_showtimes_response, parse_booking, idempotency_key_from, booking_outcome,
+    split_cancellable, cancellation_outcome, parse_cancellation, bulk_cancel_payload
+)
+from seat_store import BookingInProgress, async_store_for
+
+# In-flight requests share this many Redis connections, queueing for a free one
+store = async_store_for(cinebook.store, max_connections=int(os.environ.get('ASYNC_REDIS_CONNECTIONS', '100')))
+
+class Request:
+    """The parts of an ASGI HTTP request the routes use"""
+
+    def __init__(self, scope, receive, params):
+        self.scope = scope
+        self.receive = receive
+        self.params = params
+        self.args = {k: v[0] for k, v in parse_qs(scope['query_string'].decode('latin-1'), keep_blank_values=True).items()}
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.body = None
+
+    async def json(self):
+        if self.body is None:
+            chunks = []
+            while True:
+                message = await self.receive()
+                chunks.append(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            self.body = b''.join(chunks)
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            return None
+
+class Response:
+    """Status, headers and body of a reply"""
+
+    def __init__(self, body, status=200, content_type='application/json', headers=()):
+        self.body = body
+        self.status = status
+        self.headers = [(b'content-type', content_type.encode('latin-1'))] + list(headers)
+
+    def has_header(self, name):
+        return any(key == name for key, _ in self.headers)
+
+def json_response(payload, status=200):
+    """Serialize a payload into a JSON reply"""
+    return Response(json_bytes(payload), status)
+
+def cached_json_response(request, body, etag, cache_control='no-cache', static=False):
+    """Pre-serialized JSON with an ETag, compressed when the client allows, answering matching If-None-Match with 304"""
+    encoding = negotiate_encoding(request.headers.get('accept-encoding'), len(body))
+    quoted = f'"{etag}-{encoding}"' if encoding else f'"{etag}"'
+    headers = [(b'etag', quoted.encode('latin-1')), (b'cache-control', cache_control.encode('latin-1')),
+               (b'vary', b'Accept-Encoding')]
+    tags = [tag.strip().removeprefix('W/') for tag in request.headers.get('if-none-match', '').split(',')]
+    if quoted in tags or '*' in tags:
+        return Response(b'', 304, headers=headers)
+    if encoding:
+        body = compress_body(body, encoding, etag if static else None)
+        headers.append((b'content-encoding', encoding.encode('latin-1')))
+    return Response(body, headers=headers)
+
+async def get_locations(request):
+    """Get all available locations"""
+    return cached_json_response(request, *LOCATIONS_RESPONSE, static=True)
+
+async def get_theatres(request):
+    """Get theatres for a specific location"""
+    return json_response(theatres_in(request.params['location']))
+
+async def get_movies(request):
+    """Get all available movies"""
+    return cached_json_response(request, *MOVIES_RESPONSE, static=True)
+
+async def get_showtimes(request):
+    """Get showtimes for a specific theatre and optionally movie; with ?date= at that date's occupancy prices"""
+    mid = request.args.get('movie_id') or None
+    booking_date = request.args.get('date')
+    if booking_date:
+        pairs = shows_to_price(request.params['theatre_id'], mid, booking_date)
+        if pairs:
+            record_occupancy(pairs, await store.counts(pairs))
+        return cached_json_response(request, *priced_showtimes_response(request.params['theatre_id'], mid, booking_date))
+    body, etag = SHOWTIME_RESPONSES.get((request.params['theatre_id'], mid), EMPTY_LIST_RESPONSE)
+    return cached_json_response(request, body, etag, static=True)
+
+async def get_seatmap_layout(request):
+    """Get the fixed hall layout used to expand compact seat maps"""
+    body, etag = LAYOUT_RESPONSE
+    return cached_json_response(request, body, etag, cache_control='public, max-age=86400, immutable', static=True)
+
+async def seatmap_for_showtime(request):
+    """Get seat map for a showtime and date (?format=compact for per-row strings)"""
+    showtime_id = request.params['showtime_id']
+    try:
+        booking_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+        holder = request.args.get('holder')
+        bits, version, prebooked = await store.seat_state(showtime_id, booking_date, holder)
+        if not prebooked:
+            await store.prebook(showtime_id, booking_date)
+            bits, version, prebooked = await store.seat_state(showtime_id, booking_date, holder)
+        compact = request.args.get('format') == 'compact'
+        payload = seatmap_payload(showtime_id, booking_date, bits, version, compact, holder)
+        if compact:
+            return cached_json_response(request, *json_body(payload))
+        return json_response(payload)
+    except Exception as e:
+        print(f"Error in seatmap_for_showtime: {e}")
+        return json_response([])
+
+async def book(request, batch):
+    """Shared body of the /book and /book/batch routes"""
+    data = await request.json()
+    try:
+        showtime_id, booking_date, seats, holder, user = parse_booking(data, batch)
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    # Count an unpriced show here so quote_prices does not block the loop counting it
+    unpriced = shows_to_quote(showtime_id, booking_date)
+    if unpriced and showtime_id in cinebook.BASE_PRICES:
+        record_occupancy(unpriced, await store.counts(unpriced))
+    try:
+        booking, conflicts, replayed = await store.create_booking(
+            showtime_id, booking_date, seats, holder, user, idempotency_key_from(request.headers.get('idempotency-key'), data),
+            prices=quote_prices(showtime_id, booking_date, seats))
+    except (ValueError, BookingInProgress) as e:
+        status, payload = booking_outcome(showtime_id, booking_date, seats, batch, error=e)
+        replayed = False
+    else:
+        status, payload = booking_outcome(showtime_id, booking_date, seats, batch, conflicts, booking=booking,
+                                          replayed=replayed)
+        if booking and not replayed:
+            cinebook.forget_availability(showtime_id)
+            cinebook.price_book.touch(showtime_id, booking_date)
+    response = json_response(payload, status)
+    if replayed and status == 200:
+        response.headers.append((b'idempotent-replayed', b'true'))
+    if 'retry_after' in payload:
+        response.headers.append((b'retry-after', str(payload['retry_after']).encode('latin-1')))
+    return response
+
+async def get_booking(request):
+    """Get one booking record by its id"""
+    booking = await store.get_booking(request.params['booking_id'])
+    if booking is None:
+        return json_response({'error': 'Booking not found'}, 404)
+    return json_response(booking)
+
+async def get_user_bookings(request):
+    """Get a user's bookings, oldest first"""
+    user = request.args.get('user')
+    if not user:
+        return json_response({'error': 'Missing user'}, 400)
+    return json_response(await store.user_bookings(user))
+
+async def cancel_bookings(booking_ids):
+    """Cancel every booking that may be cancelled, each one atomically; returns (cancelled, refused)"""
+    allowed, refused = split_cancellable(booking_ids, await store.get_bookings(booking_ids))
+    cancelled, refused = cancellation_outcome(allowed, await store.cancel_bookings(allowed), refused)
+    # Waitlist promotion runs on the blocking store, off the event loop
+    await asyncio.to_thread(cinebook.promote_after_cancellations, cancelled)
+    return cancelled, refused
+
+async def cancel_booking(request):
+    """Cancel a booking, freeing its seats, and report the refund"""
+    booking_id = request.params['booking_id']
+    cancelled, refused = await cancel_bookings([booking_id])
+    if refused:
+        status, error = refused[booking_id]
+        return json_response({'error': error}, status)
+    booking = cancelled[0]
+    return json_response({'message': f'Booking {booking_id} cancelled.', 'booking': booking, 'refund': booking['refund']})
+
+async def cancel_bookings_bulk(request):
+    """Cancel several bookings; each is cancelled or refused on its own"""
+    try:
+        booking_ids = parse_cancellation(await request.json())
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    return json_response(bulk_cancel_payload(*await cancel_bookings(booking_ids)))
+
+async def book_seat(request):
+    """Book a specific seat for a showtime and date"""
+    return await book(request, batch=False)
+
+async def book_seats_batch(request):
+    """Atomically book several seats for a showtime and date"""
+    return await book(request, batch=True)
+
+def rule_pattern(rule):
+    """Regex for a Flask-style rule such as /seatmap/<showtime_id>"""
+    return re.compile(re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', rule))
+
+# (method, rule, path pattern, handler); the first match wins. Rules are the
+# Flask edition's, so RATE_LIMITS entries apply to both editions alike.
+ROUTES = [(method, rule, rule_pattern(rule), handler) for method, rule, handler in [
+    ('GET', '/locations', get_locations),
+    ('GET', '/theatres/<location>', get_theatres),
+    ('GET', '/movies', get_movies),
+    ('GET', '/showtimes/<theatre_id>', get_showtimes),
+    ('GET', '/seatmap/layout', get_seatmap_layout),
+    ('GET', '/seatmap/<showtime_id>', seatmap_for_showtime),
+    ('POST', '/book', book_seat),
+    ('POST', '/book/batch', book_seats_batch),
+    ('POST', '/bookings/cancel', cancel_bookings_bulk),
+    ('GET', '/bookings/<booking_id>', get_booking),
+    ('DELETE', '/bookings/<booking_id>', cancel_booking),
+    ('GET', '/bookings', get_user_bookings),
+]]
+
+async def rate_limited(rule, request):
+    """A 429 reply with Retry-After when one of the request's token buckets ran dry, otherwise None"""
+    if not cinebook.RATE_LIMITS.get(rule):
+        return None
+    data = await request.json() if request.scope['method'] == 'POST' else None
+    client = request.scope.get('client')
+
+    def subject_of(scope):
+        if scope == 'client':
+            return request.headers.get('x-session-id') or (client[0] if client else None)
+        if scope == 'showtime':
+            return (request.params.get('showtime_id') or request.args.get('showtime_id')
+                    or (data.get('showtime_id') if isinstance(data, dict) else None))
+        return None
+
+    # The Redis limiter blocks, so it runs off the event loop
+    shed = await asyncio.to_thread(rate_limit_wait, rule, subject_of)
+    if shed is None:
+        return None
+    retry_after, _ = shed
+    return Response(json_bytes({'error': 'Too many requests, please retry shortly', 'retry_after': retry_after}),
+                    429, headers=[(b'retry-after', str(retry_after).encode('latin-1'))])
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'content-type, if-none-match, idempotency-key, x-session-id'),
+    (b'access-control-allow-methods', b'GET, POST, DELETE, OPTIONS'),
+]
+
+async def dispatch(scope, receive):
+    """Route an HTTP request to its handler"""
+    path, method = scope['path'], scope['method']
+    allowed = False
+    for route_method, rule, pattern, handler in ROUTES:
+        match = pattern.fullmatch(path)
+        if not match:
+            continue
+        allowed = True
+        if method == route_method:
+            request = Request(scope, receive, match.groupdict())
+            return await rate_limited(rule, request) or await handler(request)
+    if allowed and method == 'OPTIONS':
+        return Response(b'', 204)
+    if allowed:
+        return json_response({'error': 'Method not allowed'}, 405)
+    return json_response({'error': 'Not found'}, 404)
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.to_thread(seed_on_boot)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await store.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    response = await dispatch(scope, receive)
+    if response.status == 200 and not response.has_header(b'vary'):
+        # Large replies built per request, e.g. full seat maps; cached replies negotiated already
+        accept = dict(scope['headers']).get(b'accept-encoding', b'').decode('latin-1')
+        encoding = negotiate_encoding(accept, len(response.body))
+        if encoding:
+            response.body = compress_body(response.body, encoding)
+            response.headers.append((b'content-encoding', encoding.encode('latin-1')))
+        response.headers.append((b'vary', b'Accept-Encoding'))
+    await send({'type': 'http.response.start', 'status': response.status, 'headers': response.headers + CORS_HEADERS})
+    await send({'type': 'http.response.body', 'body': response.body})
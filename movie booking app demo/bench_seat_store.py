@@ -0,0 +1,83 @@
+"""Compare seat store throughput with concurrent bookers racing over a few shows.
+
+    python bench_seat_store.py --stores memory,sqlite,redis --threads 16 --ops 2000
+
+Set REDIS_SHARDS to a comma-separated list of Redis URLs to spread the shows
+over several redis-server processes (e.g. ports 6379-6381).
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+import redis
+
+from seat_store import SEAT_LABELS, MemorySeatStore, SqliteSeatStore, RedisSeatStore
+
+def make_store(name, workdir):
+    if name == 'memory':
+        return MemorySeatStore()
+    if name == 'sqlite':
+        return SqliteSeatStore(os.path.join(workdir, 'bench.db'))
+    shards = [url for url in os.environ.get('REDIS_SHARDS', '').split(',') if url]
+    return RedisSeatStore(os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+                          storage=os.environ.get('SEAT_STORAGE', 'set'), shards=shards or None)
+
+def run(store, threads, ops, shows):
+    """Each thread mixes seat map reads, holds and bookings; returns (ops/s, bookings, oversold seats)"""
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    show_ids = [f"{prefix}-{n}" for n in range(shows)]
+    booking_date = "2030-01-01"
+    won = []
+    lock = threading.Lock()
+
+    def worker(n):
+        rng = random.Random(n)
+        mine = []
+        for i in range(ops):
+            showtime_id = rng.choice(show_ids)
+            seat = rng.choice(SEAT_LABELS)
+            roll = rng.random()
+            if roll < 0.5:
+                store.seat_state(showtime_id, booking_date)
+            elif roll < 0.7:
+                holder = f"h{n}"
+                if not store.hold(showtime_id, booking_date, [seat], holder, 30):
+                    store.release(showtime_id, booking_date, holder, [seat])
+            elif not store.book(showtime_id, booking_date, [seat], f"u{n}"):
+                mine.append((showtime_id, seat))
+        with lock:
+            won.extend(mine)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return threads * ops / elapsed, len(won), len(won) - len(set(won))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stores', default='memory,sqlite,redis')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=2000, help='operations per thread')
+    parser.add_argument('--shows', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.stores.split(','):
+            try:
+                store = make_store(name, workdir)
+                rate, bookings, oversold = run(store, args.threads, args.ops, args.shows)
+            except redis.ConnectionError as e:
+                print(f"{name:>7}: skipped ({e})")
+                continue
+            print(f"{name:>7}: {rate:10.0f} ops/s  {bookings} bookings  {oversold} oversold")
+
+if __name__ == '__main__':
+    main()
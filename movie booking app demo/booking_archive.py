@@ -0,0 +1,105 @@
+"""Columnar archive of past show dates' bookings.
+
+Redis keys for a show date expire shortly after the date ends (see
+show_expiry_ms); before that, the archiver copies the date's bookings into
+one compressed column-oriented file per date and purges them from the store.
+Files are Parquet (zstd) when pyarrow is installed, otherwise gzipped JSON
+holding one list per column.
+
+    flask --app app_flask archive-bookings --once
+"""
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional; gzipped JSON columns instead
+    pyarrow = None
+
+ARCHIVE_COLUMNS = ['booking_id', 'showtime_id', 'date', 'seats', 'seat_count', 'holder', 'user',
+                   'created_ms', 'status', 'cancelled_ms', 'prices']
+ARCHIVE_FORMATS = ['parquet', 'json.gz']
+
+def archive_path(directory, booking_date, fmt=None):
+    """File holding one show date's bookings"""
+    fmt = fmt or ('parquet' if pyarrow is not None else 'json.gz')
+    return os.path.join(directory, f"bookings-{booking_date}.{fmt}")
+
+def existing_archive(directory, booking_date):
+    """Path of a show date's archive in any format, or None"""
+    for fmt in ARCHIVE_FORMATS:
+        path = archive_path(directory, booking_date, fmt)
+        if os.path.exists(path):
+            return path
+    return None
+
+def columns_from(bookings):
+    """Booking records turned into one list per archive column; seats and prices as comma-separated strings"""
+    columns = {name: [] for name in ARCHIVE_COLUMNS}
+    for booking in bookings:
+        for name in ARCHIVE_COLUMNS:
+            if name == 'seats':
+                columns[name].append(','.join(booking['seats']))
+            elif name == 'seat_count':
+                columns[name].append(len(booking['seats']))
+            elif name == 'prices':
+                columns[name].append(','.join(str(price) for price in booking.get('prices') or []))
+            else:
+                columns[name].append(booking[name])
+    return columns
+
+def write_archive(directory, booking_date, bookings):
+    """Write a show date's bookings, replacing the file atomically; returns its path"""
+    os.makedirs(directory, exist_ok=True)
+    path = archive_path(directory, booking_date)
+    tmp = path + '.tmp'
+    columns = columns_from(bookings)
+    if pyarrow is not None:
+        pyarrow.parquet.write_table(pyarrow.table(columns), tmp, compression='zstd')
+    else:
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            json.dump({'date': booking_date, 'columns': columns}, f, separators=(',', ':'))
+    os.replace(tmp, path)
+    return path
+
+def read_archive(directory, booking_date):
+    """A show date's archived bookings as records, or None if the date was never archived"""
+    path = existing_archive(directory, booking_date)
+    if path is None:
+        return None
+    if path.endswith('.parquet'):
+        if pyarrow is None:
+            raise RuntimeError(f"Reading {path} needs pyarrow")
+        columns = pyarrow.parquet.read_table(path).to_pydict()
+    else:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            columns = json.load(f)['columns']
+    records = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    for record in records:
+        record['seats'] = record['seats'].split(',') if record['seats'] else []
+        # Archives written before prices were recorded have no prices column
+        prices = record.get('prices')
+        record['prices'] = [int(price) for price in prices.split(',')] if prices else None
+    return records
+
+def archive_past_dates(store, directory, days=7, today=None):
+    """Archive and purge each of the `days` show dates before today that has no archive yet;
+    returns [(date, bookings archived)]. A date with no bookings left is only archived when the
+    store can tell it never had any, since an empty archive would hide bookings lost to expiry."""
+    today = today or datetime.now()
+    archived = []
+    for back in range(days, 0, -1):
+        booking_date = (today - timedelta(days=back)).strftime('%Y-%m-%d')
+        if existing_archive(directory, booking_date):
+            continue
+        bookings = store.bookings_on(booking_date)
+        if not bookings and not store.keeps_date(booking_date):
+            print(f"Warning: not archiving {booking_date}, its bookings may have expired before the archiver ran")
+            continue
+        write_archive(directory, booking_date, bookings)
+        store.purge_date(booking_date)
+        archived.append((booking_date, len(bookings)))
+    return archived
@@ -0,0 +1,165 @@
+"""Materialized analytics views over the booking log.
+
+Every booking, cancellation and hold change is appended to the store's booking log
+(see SeatStore.booking_events). A consumer folds new entries into small
+aggregate views: revenue and seats per theatre and day, seats sold per movie
+and day, and how often each seat gets booked. It records the id of the last
+entry it applied together with the increments, so a restarted consumer
+carries on from that offset and every entry is counted exactly once.
+Analytics reads only touch the views, never the seat keys.
+
+    flask --app app_flask consume-bookings
+"""
+import threading
+
+import redis
+
+VIEW_OFFSET_KEY = "views:offset"  # id of the last log entry folded into the views
+SEAT_VIEW_KEY = "views:seats"  # sorted set of seat label -> times booked
+HOLD_EVENTS = {'held': 1, 'released': -1, 'expired': -1, 'converted': -1}  # log events that move the held count
+
+def theatre_view_key(booking_date):
+    """Hash of "<theatre_id>:revenue", ":sold" and ":held" -> amount for one show date"""
+    return f"views:theatres:{booking_date}"
+
+def movie_view_key(booking_date):
+    """Hash of movie id -> seats sold for one show date"""
+    return f"views:movies:{booking_date}"
+
+def fold_events(events, catalog):
+    """Increments a batch of log entries makes to the views: {view key: {field: amount}}.
+    `catalog` maps showtime id -> (theatre_id, movie_id, seat price), the price used for
+    entries logged before charged seat prices were recorded; cancellations
+    take back their booking's revenue and seats sold but not its seat popularity, and
+    seats stop counting as held once released, expired or converted into a booking."""
+    changes = {}
+
+    def add(key, field, amount):
+        fields = changes.setdefault(key, {})
+        fields[field] = fields.get(field, 0) + amount
+
+    for event in events:
+        show = catalog.get(event['showtime_id'])
+        if show is None:
+            continue
+        theatre_id, movie_id, price = show
+        seats = len(event['seats'])
+        theatres = theatre_view_key(event['date'])
+        if event['event'] in HOLD_EVENTS:
+            add(theatres, f"{theatre_id}:held", HOLD_EVENTS[event['event']] * seats)
+            continue
+        if event['event'] not in ('booked', 'cancelled'):
+            continue
+        sign = 1 if event['event'] == 'booked' else -1
+        charged = sum(event['prices']) if event.get('prices') else price * seats
+        add(theatres, f"{theatre_id}:revenue", sign * charged)
+        add(theatres, f"{theatre_id}:sold", sign * seats)
+        add(movie_view_key(event['date']), movie_id, sign * seats)
+        if event['event'] == 'booked':
+            for seat in event['seats']:
+                add(SEAT_VIEW_KEY, seat, 1)
+    return changes
+
+class RedisBookingViews:
+    """Views in Redis hashes and a sorted set, shared by every API process and consumer"""
+
+    def __init__(self, client):
+        self.r = client
+
+    def offset(self):
+        return self.r.get(VIEW_OFFSET_KEY) or '0'
+
+    def advance(self, store, catalog, count=1000, block=None):
+        """Fold the next batch of log entries into the views; returns how many were applied.
+        The offset is watched, so consumers racing on the same batch apply it once."""
+        while True:
+            with self.r.pipeline(transaction=True) as pipe:
+                try:
+                    pipe.watch(VIEW_OFFSET_KEY)
+                    events = store.booking_events(pipe.get(VIEW_OFFSET_KEY) or '0', count, block)
+                    if not events:
+                        return 0
+                    pipe.multi()
+                    for key, fields in fold_events(events, catalog).items():
+                        for field, amount in fields.items():
+                            if key == SEAT_VIEW_KEY:
+                                pipe.zincrby(key, amount, field)
+                            else:
+                                pipe.hincrby(key, field, amount)
+                    pipe.set(VIEW_OFFSET_KEY, events[-1]['id'])
+                    pipe.execute()
+                    return len(events)
+                except redis.WatchError:
+                    continue
+
+    def seek(self, offset):
+        """Carry on after log entry `offset` instead of the stored offset"""
+        self.r.set(VIEW_OFFSET_KEY, offset)
+
+    def reset(self):
+        """Drop every view so the log can be replayed from the start"""
+        keys = list(self.r.scan_iter(match='views:*', count=500))
+        if keys:
+            self.r.delete(*keys)
+
+    def view(self, key):
+        return {field: int(amount) for field, amount in self.r.hgetall(key).items()}
+
+    def popular_seats(self, limit):
+        return [(seat, int(count)) for seat, count in self.r.zrevrange(SEAT_VIEW_KEY, 0, limit - 1, withscores=True)]
+
+class LocalBookingViews:
+    """The same views kept in this process, for the memory and sqlite stores"""
+
+    def __init__(self):
+        self.views = {}  # view key -> {field: amount}
+        self.last = '0'
+        self.lock = threading.Lock()
+
+    def offset(self):
+        with self.lock:
+            return self.last
+
+    def advance(self, store, catalog, count=1000, block=None):
+        while True:
+            offset = self.offset()
+            events = store.booking_events(offset, count, block)
+            if not events:
+                return 0
+            with self.lock:
+                if self.last != offset:
+                    continue
+                for key, fields in fold_events(events, catalog).items():
+                    view = self.views.setdefault(key, {})
+                    for field, amount in fields.items():
+                        view[field] = view.get(field, 0) + amount
+                self.last = events[-1]['id']
+                return len(events)
+
+    def seek(self, offset):
+        with self.lock:
+            self.last = offset
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.last = '0'
+
+    def view(self, key):
+        with self.lock:
+            return dict(self.views.get(key, {}))
+
+    def popular_seats(self, limit):
+        seats = sorted(self.view(SEAT_VIEW_KEY).items(), key=lambda item: (-item[1], item[0]))
+        return seats[:limit]
+
+def catch_up(views, store, catalog, batch=1000, limit=None):
+    """Fold log entries into the views until they are current or `limit` entries were applied;
+    returns how many were applied"""
+    applied = 0
+    while limit is None or applied < limit:
+        count = views.advance(store, catalog, batch)
+        if not count:
+            break
+        applied += count
+    return applied
@@ -0,0 +1,798 @@
+"""Catalog, seat store and booking logic shared by the Flask and ASGI editions.
+
+Nothing here depends on a web framework: the editions parse requests, call
+these helpers and turn their (status, payload) results into responses.
+Importing this module builds the store and the catalog indexes but does not
+touch the store; each edition seeds the catalog when it boots (see
+seed_on_boot).
+"""
+import gzip
+import hashlib
+import json
+import math
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import redis
+
+from seat_store import (
+    SEAT_ROWS, SEAT_BLOCKS, SEAT_LABELS, SEAT_INDEX, SEATS_PER_ROW,
+    BookingInProgress, RedisSeatStore, create_store
+)
+from seat_allocator import BLOCK_NAMES, SeatAllocator
+from pricing import PRICE_TIERS, PriceBook, price_table, tier_rows
+from rate_limit import LocalRateLimiter, RedisRateLimiter, bucket_key
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Seat store backend: "redis" (shared by every worker), "memory" (this
+# process only) or "sqlite" (a local file). In redis mode SEAT_STORAGE picks
+# "set" (seat labels in a Redis set) or "bitmap" (one bit per seat of the
+# fixed hall layout). REDIS_SHARDS (comma-separated URLs) spreads seats over
+# several Redis nodes by theatre; REDIS_URL keeps the catalog, locks, rate
+# limits and analytics.
+SEAT_BACKEND = os.environ.get('SEAT_BACKEND', 'redis').lower()
+REDIS_SHARDS = [url.strip() for url in os.environ.get('REDIS_SHARDS', '').split(',') if url.strip()]
+
+def theatre_of(showtime_id):
+    """Shard key of a showtime: its theatre, so a theatre's shows share a node"""
+    st = SHOWTIME_BY_ID.get(showtime_id)
+    return st["theatre_id"] if st else None
+
+store = create_store(
+    SEAT_BACKEND,
+    redis_url=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+    storage=os.environ.get('SEAT_STORAGE', 'set').lower(),
+    sqlite_path=os.environ.get('SEAT_DB', os.path.join(BASE_DIR, 'seats.db')),
+    shards=REDIS_SHARDS or None,
+    shard_key=theatre_of
+)
+
+# How long a seat stays held while the customer finishes checkout
+HOLD_TTL_SECONDS = int(os.environ.get('HOLD_TTL_SECONDS', '180'))
+
+# Past show dates' bookings are archived here before their keys expire
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
+LOCATIONS = ["Kolkata", "Delhi", "Mumbai", "Bangalore"]
+
+THEATRES = {
+    "1": {"name": "INOX: South City", "location": "Kolkata"},
+    "2": {"name": "PVR: Diamond Plaza", "location": "Kolkata"},
+    "3": {"name": "Cinepolis: Lake Mall", "location": "Kolkata"},
+    "4": {"name": "INOX: Quest Mall", "location": "Kolkata"},
+    "5": {"name": "Cinepolis: Acropolis Mall", "location": "Kolkata"},
+    "6": {"name": "INOX: Nehru Place", "location": "Delhi"},
+    "7": {"name": "PVR: DLF Promenade", "location": "Delhi"},
+    "8": {"name": "Cinepolis: Select Citywalk", "location": "Delhi"},
+    "9": {"name": "INOX: R City Mall", "location": "Mumbai"},
+    "10": {"name": "PVR: Phoenix Marketcity", "location": "Mumbai"},
+    "11": {"name": "Cinepolis: Andheri West", "location": "Mumbai"},
+    "12": {"name": "INOX: Orion Mall", "location": "Bangalore"},
+    "13": {"name": "PVR: Forum Mall", "location": "Bangalore"},
+    "14": {"name": "Cinepolis: ETA Mall", "location": "Bangalore"}
+}
+
+MOVIES = {
+    "201": {"name": "Param Sundari", "genres": "Comedy/Drama/Romantic", "rating": "164.8K Likes", "poster_url": "static/param_sundari.jpg"},
+    "202": {"name": "Vash Level 2", "genres": "Supernatural/Thriller", "rating": "8.7/10 936 Votes", "poster_url": "static/vash_level_2.jpg"},
+    "203": {"name": "Dhumketu", "genres": "Drama/Family", "rating": "7.3/10 15.3K Votes", "poster_url": "static/dhumketu.jpg"},
+    "204": {"name": "War 2", "genres": "Action/Thriller", "rating": "7.8/10 160.9K Votes", "poster_url": "static/war2.jpg"},
+    "205": {"name": "Mahavatar Narsimha", "genres": "Action/Animation/Drama", "rating": "9.6/10 289.6K Votes", "poster_url": "static/mahavatar_narsimha.jpg"}
+}
+
+TECH_TYPES = ['ATMOS', 'LASER', 'INSIGNIA', 'DOLBY 7.1']
+SHOWTIME_SLOTS = [
+    "09:10 AM", "10:00 AM", "11:00 AM", "12:05 PM", "01:50 PM", "03:10 PM", "04:45 PM",
+    "05:45 PM", "07:40 PM", "08:40 PM", "10:35 PM", "11:35 PM"
+]
+
+# Seat map skeleton (row -> blocks -> (label, offset)) reused by every seat map response
+SEAT_MAP_TEMPLATE = [
+    (row, [[(f"{row}{n:02d}", SEAT_INDEX[f"{row}{n:02d}"]) for n in block] for block in SEAT_BLOCKS])
+    for row in SEAT_ROWS
+]
+
+# Generate showtimes
+SHOWTIMES = []
+showtime_id = 1
+for tid in THEATRES:
+    for mid in MOVIES:
+        for idx, slot in enumerate(SHOWTIME_SLOTS):
+            SHOWTIMES.append({
+                "id": str(showtime_id),
+                "theatre_id": tid,
+                "movie_id": mid,
+                "time": slot,
+                "technology": TECH_TYPES[idx % len(TECH_TYPES)],
+                "cancellable": ((idx % 4) < 3),
+            })
+            showtime_id += 1
+
+# Fingerprint of the static catalog; seeding is skipped when the store already holds it
+CATALOG_VERSION = hashlib.md5(json.dumps([THEATRES, MOVIES, SHOWTIMES], sort_keys=True).encode('utf-8')).hexdigest()
+
+def initialize_data(force=False):
+    """Seed the catalog into the seat store once per catalog version (a no-op for in-process stores)"""
+    return store.seed_catalog(THEATRES, MOVIES, SHOWTIMES, CATALOG_VERSION, force=force)
+
+def seed_on_boot():
+    """Make sure the catalog is seeded before serving, unless SEED_ON_BOOT=0. Workers booting
+    together elect one seeder through a Redis lock; the rest wait until it is done."""
+    if os.environ.get('SEED_ON_BOOT', '1') == '0':
+        return
+    try:
+        initialize_data()
+    except (redis.ConnectionError, TimeoutError) as e:
+        print(f"Catalog not seeded on boot: {e}")
+
+def theatres_in(location):
+    """Theatre id -> name for a location, case-insensitively"""
+    return {tid: t["name"] for tid, t in THEATRES.items() if t["location"].lower() == location.lower()}
+
+def get_pricing(show_time):
+    """Calculate pricing based on show timing"""
+    try:
+        # Extract hour from time string (e.g., "09:10 AM" -> 9)
+        time_part = show_time.split()[0]  # "09:10"
+        hour = int(time_part.split(':')[0])  # 9
+        is_pm = 'PM' in show_time
+        
+        if is_pm and hour != 12:
+            hour += 12
+        elif not is_pm and hour == 12:
+            hour = 0
+            
+        # Pricing logic
+        if 6 <= hour < 12:  # Morning (6 AM - 12 PM)
+            return 200  # Average price
+        elif 12 <= hour < 18:  # Afternoon (12 PM - 6 PM) 
+            return 300  # High price
+        else:  # Night (6 PM - 6 AM)
+            return 150  # Low price
+            
+    except:
+        return 200  # Default price
+
+def json_bytes(payload):
+    """Compact UTF-8 JSON for a payload"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def json_body(payload):
+    """Serialize a payload once into (JSON bytes, ETag) for repeated serving"""
+    body = json_bytes(payload)
+    return body, hashlib.md5(body).hexdigest()
+
+# Bodies smaller than this go out as-is; compressing them saves too little
+COMPRESS_MIN_BYTES = 1024
+COMPRESSORS = {'gzip': lambda body: gzip.compress(body, compresslevel=6, mtime=0)}
+if brotli is not None:
+    COMPRESSORS = {'br': lambda body: brotli.compress(body, quality=5), **COMPRESSORS}
+
+# Compressed bytes of static responses, keyed by (ETag, encoding); the set of
+# static bodies is fixed, so this never grows past a few hundred entries
+compressed_bodies = {}
+
+def accepted_encodings(accept_encoding):
+    """Content coding -> quality from an Accept-Encoding header"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding.strip():
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+def negotiate_encoding(accept_encoding, size):
+    """Best encoding (br, then gzip) for a `size`-byte body under an Accept-Encoding header, or None"""
+    if size < COMPRESS_MIN_BYTES or not accept_encoding:
+        return None
+    accepted = accepted_encodings(accept_encoding)
+    best, best_quality = None, 0.0
+    for encoding in COMPRESSORS:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress_body(body, encoding, etag=None):
+    """Compress a body; bodies of static responses (pass their ETag) are compressed only once"""
+    if etag is None:
+        return COMPRESSORS[encoding](body)
+    packed = compressed_bodies.get((etag, encoding))
+    if packed is None:
+        packed = compressed_bodies[(etag, encoding)] = COMPRESSORS[encoding](body)
+    return packed
+
+# Token buckets per route rule: scope -> (tokens per second, burst). "client"
+# is the caller's X-Session-Id header (the Streamlit frontend sends one per
+# browser session; other callers fall back to their address), "showtime" the show
+# the request is about, so one scripted client cannot starve a release and a
+# hot show cannot starve the others. RATE_LIMITS (JSON) replaces this; {} turns limiting off.
+DEFAULT_RATE_LIMITS = {
+    '/book': {'client': (5, 20), 'showtime': (200, 400)},
+    '/book/batch': {'client': (5, 20), 'showtime': (200, 400)},
+    '/hold': {'client': (10, 40), 'showtime': (200, 400)},
+    '/allocate': {'client': (5, 20), 'showtime': (100, 200)},
+    '/seatmap/<showtime_id>': {'client': (20, 60), 'showtime': (1000, 2000)},
+}
+
+def load_rate_limits(text):
+    """Parse a RATE_LIMITS JSON value; raises ValueError unless every bucket refills and admits a request"""
+    limits = json.loads(text)
+    if not isinstance(limits, dict):
+        raise ValueError('RATE_LIMITS must map routes to {scope: [rate, burst]}')
+    for route, scopes in limits.items():
+        for scope, bucket in (scopes or {}).items():
+            try:
+                rate, burst = bucket
+                valid = float(rate) > 0 and float(burst) >= 1
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                raise ValueError(f'RATE_LIMITS {route} {scope}: need [rate > 0, burst >= 1], got {bucket!r}')
+    return limits
+
+RATE_LIMITS = load_rate_limits(os.environ['RATE_LIMITS']) if 'RATE_LIMITS' in os.environ else DEFAULT_RATE_LIMITS
+rate_limiter = RedisRateLimiter(store.r) if isinstance(store, RedisSeatStore) else LocalRateLimiter()
+
+def rate_limit_wait(route, subject_of):
+    """(seconds to Retry-After, scope of the bucket that ran dry) when a request to `route` must be
+    refused, otherwise None. `subject_of(scope)` names whose bucket it is, or None when it does not apply."""
+    limits = RATE_LIMITS.get(route)
+    if not limits:
+        return None
+    buckets, scopes = [], []
+    for scope, (rate, burst) in limits.items():
+        subject = subject_of(scope)
+        if subject is not None:
+            buckets.append((bucket_key(route, scope, subject), rate, burst))
+            scopes.append(scope)
+    if not buckets:
+        return None
+    try:
+        wait, dry = rate_limiter.take(buckets)
+    except redis.RedisError as e:
+        # Failing open: a limiter outage must not become an API outage
+        print(f"Rate limiter unavailable: {e}")
+        return None
+    if not wait:
+        return None
+    return max(1, math.ceil(wait)), scopes[dry]
+
+def build_showtime_index():
+    """Build theatre -> movie -> showtimes with movie details and prices joined in"""
+    index = {tid: {} for tid in THEATRES}
+    for st in SHOWTIMES:
+        m = MOVIES[st["movie_id"]]
+        index[st["theatre_id"]].setdefault(st["movie_id"], []).append({
+            "showtime_id": st["id"],
+            "movie_id": st["movie_id"],
+            "movie_name": m["name"],
+            "genres": m["genres"],
+            "rating": m["rating"],
+            "time": st["time"],
+            "technology": st["technology"],
+            "cancellable": st["cancellable"],
+            "price": BASE_PRICES[st["id"]],
+            "prices": price_table(BASE_PRICES[st["id"]], 0).by_tier()
+        })
+    return index
+
+def build_showtime_responses(index):
+    """Pre-serialize every /showtimes response, keyed by (theatre_id, movie_id or None)"""
+    responses = {}
+    for tid, by_movie in index.items():
+        responses[(tid, None)] = json_body([show for shows in by_movie.values() for show in shows])
+        for mid, shows in by_movie.items():
+            responses[(tid, mid)] = json_body(shows)
+    return responses
+
+# Catalog is static after startup, so showtime lookups and their JSON are built once
+SHOWTIME_BY_ID = {st["id"]: st for st in SHOWTIMES}
+BASE_PRICES = {st["id"]: get_pricing(st["time"]) for st in SHOWTIMES}
+SHOWTIME_INDEX = build_showtime_index()
+SHOWTIME_RESPONSES = build_showtime_responses(SHOWTIME_INDEX)
+EMPTY_LIST_RESPONSE = json_body([])
+LOCATIONS_RESPONSE = json_body(LOCATIONS)
+MOVIES_RESPONSE = json_body(MOVIES)
+
+# The hall layout never changes while the server runs, so clients can cache it for good
+LAYOUT_RESPONSE = json_body({
+    "rows": list(SEAT_ROWS),
+    "blocks": SEAT_BLOCKS,
+    "seats_per_row": SEATS_PER_ROW,
+    "tiers": PRICE_TIERS,
+    "tier_rows": tier_rows()
+})
+LAYOUT_VERSION = LAYOUT_RESPONSE[1]
+
+# Current price table per show and date, plus /showtimes?date= responses
+# rebuilt only when one of their shows changes occupancy band
+price_book = PriceBook()
+price_lock = threading.Lock()
+prices_watched = False
+MAX_PRICED_RESPONSES = 1024
+priced_responses = OrderedDict()  # (theatre_id, movie_id, date) -> (bands, body, etag)
+
+def watch_prices():
+    """Subscribe the price book to seat events the first time it is used"""
+    global prices_watched
+    with price_lock:
+        if prices_watched:
+            return
+        prices_watched = True
+    seat_events.add_callback(price_book.on_seat_event)
+
+def seat_prices(showtime_id, booking_date, bits, holder=None):
+    """Price table for a show from its seat map; a holder's view (own holds shown free) is not cached"""
+    watch_prices()
+    return price_book.observe(showtime_id, booking_date, BASE_PRICES.get(showtime_id, get_pricing(None)),
+                              bits.count('1'), remember=not holder)
+
+def shows_to_quote(showtime_id, booking_date):
+    """[(showtime_id, date)] when this process has not priced the show since its last seat change, else []"""
+    watch_prices()
+    return price_book.unchecked([(showtime_id, booking_date)])
+
+def quote_prices(showtime_id, booking_date, seats):
+    """Each seat's price at the show's current prices, as its seat map quotes them. A show this
+    process has not priced (another worker served its seat map) or whose band may be stale is
+    counted first, so it is never quoted at the lowest band by default."""
+    unpriced = shows_to_quote(showtime_id, booking_date)
+    if unpriced and showtime_id in BASE_PRICES:
+        record_occupancy(unpriced, store.counts(unpriced))
+    table = price_book.current(showtime_id, booking_date, BASE_PRICES.get(showtime_id, get_pricing(None)))
+    return [table.seat_prices[SEAT_INDEX[seat]] if seat in SEAT_INDEX else table.standard for seat in seats]
+
+def shows_to_price(theatre_id, movie_id, booking_date):
+    """(showtime_id, date) pairs of a /showtimes?date= response whose occupancy must be counted first"""
+    watch_prices()
+    shows = SHOWTIME_INDEX.get(theatre_id, {})
+    return price_book.unchecked([(show["showtime_id"], booking_date) for mid, by_movie in shows.items()
+                                 if not movie_id or mid == movie_id for show in by_movie])
+
+def record_occupancy(pairs, counts):
+    """Feed counted (booked, held) seats of shows into the price book"""
+    for (showtime_id, booking_date), (booked, held) in zip(pairs, counts):
+        price_book.observe(showtime_id, booking_date, BASE_PRICES[showtime_id], booked + held)
+
+def priced_showtimes_response(theatre_id, movie_id, booking_date):
+    """Serialized showtimes at each show's current prices for a date, reused until a band changes"""
+    by_movie = SHOWTIME_INDEX.get(theatre_id)
+    if by_movie is None:
+        return EMPTY_LIST_RESPONSE
+    shows = [show for mid, shows in by_movie.items() if not movie_id or mid == movie_id for show in shows]
+    tables = [price_book.current(show["showtime_id"], booking_date, BASE_PRICES[show["showtime_id"]])
+              for show in shows]
+    bands = tuple(table.band for table in tables)
+    key = (theatre_id, movie_id, booking_date)
+    with price_lock:
+        cached = priced_responses.get(key)
+        if cached and cached[0] == bands:
+            priced_responses.move_to_end(key)
+            return cached[1], cached[2]
+    body, etag = json_body([dict(show, date=booking_date, band=table.band, price=table.standard,
+                                 prices=table.by_tier()) for show, table in zip(shows, tables)])
+    with price_lock:
+        priced_responses[key] = (bands, body, etag)
+        priced_responses.move_to_end(key)
+        while len(priced_responses) > MAX_PRICED_RESPONSES:
+            priced_responses.popitem(last=False)
+    return body, etag
+
+def seatmap_payload(showtime_id, booking_date, bits, version, compact, holder=None):
+    """Seat map response for occupancy bits: per-row strings (compact) or the full nested seat list"""
+    prices = seat_prices(showtime_id, booking_date, bits, holder)
+    if compact:
+        # One '0'/'1' string per row in layout order, prices per tier; see /seatmap/layout
+        return {
+            "showtime_id": showtime_id,
+            "date": booking_date,
+            "version": version,
+            "layout": LAYOUT_VERSION,
+            "rows": [bits[i:i + SEATS_PER_ROW] for i in range(0, len(bits), SEATS_PER_ROW)],
+            "band": prices.band,
+            "prices": prices.tier_prices
+        }
+    seat_price = prices.seat_prices
+    return [
+        {"row": row, "blocks": [[{"label": label, "booked": bits[idx] == '1', "price": seat_price[idx]}
+                                 for label, idx in block] for block in blocks]}
+        for row, blocks in SEAT_MAP_TEMPLATE
+    ]
+
+def book_seats(showtime_id, booking_date, seats, holder=None, user=None, idempotency_key=None):
+    """Atomically book seats, converting the holder's holds, and record the booking at the quoted prices;
+    returns (booking, conflicts, replayed)"""
+    booking, conflicts, replayed = store.create_booking(showtime_id, booking_date, seats, holder, user, idempotency_key,
+                                                        prices=quote_prices(showtime_id, booking_date, seats))
+    if booking and not replayed:
+        forget_availability(showtime_id)
+        price_book.touch(showtime_id, booking_date)
+    return booking, conflicts, replayed
+
+def place_holds(showtime_id, booking_date, seats, holder, ttl=HOLD_TTL_SECONDS):
+    """Atomically hold seats for `ttl` seconds; returns the conflicting labels (empty on success)"""
+    conflicts = store.hold(showtime_id, booking_date, seats, holder, ttl)
+    if not conflicts:
+        forget_availability(showtime_id)
+        price_book.touch(showtime_id, booking_date)
+    return conflicts
+
+def release_holds(showtime_id, booking_date, holder, seats=None):
+    """Release the holder's holds on `seats` (or all of them); returns the released labels"""
+    released = store.release(showtime_id, booking_date, holder, seats)
+    if released:
+        forget_availability(showtime_id)
+        price_book.touch(showtime_id, booking_date)
+    return released
+
+def warm_prebookings(days):
+    """Prebook every showtime for the next `days` days in one batch"""
+    dates = [(datetime.now() + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    shows = [(st["id"], booking_date) for booking_date in dates for st in SHOWTIMES]
+    return store.warm(shows), len(shows)
+
+def parse_booking(data, batch):
+    """Validate a /book or /book/batch body into (showtime_id, date, seats, holder, user); raises ValueError"""
+    data = data or {}
+    showtime_id = data.get('showtime_id')
+    booking_date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
+    if batch:
+        seats = data.get('seats')
+        if not showtime_id or not seats or not isinstance(seats, list):
+            raise ValueError('Missing showtime_id or seats')
+        # Drop duplicate labels while keeping the requested order
+        seats = list(dict.fromkeys(str(seat) for seat in seats))
+    else:
+        seat = data.get('seat')
+        if not showtime_id or not seat:
+            raise ValueError('Missing showtime_id or seat')
+        seats = [seat]
+    return showtime_id, booking_date, seats, data.get('holder'), data.get('user')
+
+def idempotency_key_from(header, data):
+    """The client's idempotency key: the Idempotency-Key header or an idempotency_key body field"""
+    key = header or (data or {}).get('idempotency_key')
+    return str(key) if key else None
+
+def booking_outcome(showtime_id, booking_date, seats, batch, conflicts=None, error=None, booking=None, replayed=False):
+    """(status, payload) for a booking the store rejected (`error`), found taken (`conflicts`) or made (`booking`).
+    A replayed idempotency key answers with the original booking, or 422 if it was made for other seats;
+    one whose first request is still booking answers 409 with a `retry_after`."""
+    if isinstance(error, BookingInProgress):
+        return 409, {'error': str(error), 'retry_after': error.retry_after}
+    if error is not None:
+        return 400, {'error': str(error) if batch else f'Unknown seat {seats[0]}'}
+    if conflicts:
+        if batch:
+            return 409, {'error': 'Some seats are already booked', 'conflicts': conflicts}
+        return 409, {'error': 'Seat already booked'}
+    if replayed:
+        if booking is None:
+            return 410, {'error': 'The booking for this idempotency key no longer exists'}
+        if (booking['showtime_id'], booking['date'], sorted(booking['seats'])) != (showtime_id, booking_date, sorted(seats)):
+            return 422, {'error': 'Idempotency key was already used for a different booking'}
+        showtime_id, booking_date, seats = booking['showtime_id'], booking['date'], booking['seats']
+    if batch:
+        return 200, {
+            'message': f'Seats {", ".join(seats)} successfully booked for showtime {showtime_id} on {booking_date}.',
+            'seats': seats,
+            'booking_id': booking['booking_id'],
+            'booking': booking
+        }
+    return 200, {
+        'message': f'Seat {seats[0]} successfully booked for showtime {showtime_id} on {booking_date}.',
+        'booking_id': booking['booking_id'],
+        'booking': booking
+    }
+
+def cancellation_refusal(booking, today):
+    """(status, error) when a booking may not be cancelled, otherwise None"""
+    if booking is None:
+        return 404, 'Booking not found'
+    st = SHOWTIME_BY_ID.get(booking['showtime_id'])
+    if st is not None and not st['cancellable']:
+        return 403, 'Bookings for this showtime cannot be cancelled'
+    if booking['status'] == 'cancelled':
+        return 409, 'Booking is already cancelled'
+    if booking['date'] < today:
+        return 409, 'The show has already taken place'
+    return None
+
+def refund_for(booking):
+    """Refund for a cancelled booking: what its seats were booked at (the base price for older bookings)"""
+    if booking.get('prices'):
+        return sum(booking['prices'])
+    st = SHOWTIME_BY_ID.get(booking['showtime_id'])
+    return BASE_PRICES[st['id']] * len(booking['seats']) if st else 0
+
+def split_cancellable(booking_ids, bookings):
+    """(ids that may be cancelled, {id: (status, error)} for the rest)"""
+    today = datetime.now().strftime('%Y-%m-%d')
+    allowed, refused = [], {}
+    for booking_id, booking in zip(booking_ids, bookings):
+        refusal = cancellation_refusal(booking, today)
+        if refusal:
+            refused[booking_id] = refusal
+        else:
+            allowed.append(booking_id)
+    return allowed, refused
+
+def cancellation_outcome(allowed, results, refused):
+    """Cancelled bookings with their refunds, plus refusals for any a concurrent request cancelled first"""
+    today = datetime.now().strftime('%Y-%m-%d')
+    cancelled = []
+    for booking_id, (booking, applied) in zip(allowed, results):
+        if applied:
+            cancelled.append(dict(booking, refund=refund_for(booking)))
+            forget_availability(booking['showtime_id'])
+            price_book.touch(booking['showtime_id'], booking['date'])
+        else:
+            refused[booking_id] = cancellation_refusal(booking, today)
+    return cancelled, refused
+
+def parse_cancellation(data):
+    """Validate a /bookings/cancel body into a list of booking ids; raises ValueError"""
+    booking_ids = (data or {}).get('booking_ids')
+    if not booking_ids or not isinstance(booking_ids, list):
+        raise ValueError('Missing booking_ids')
+    return list(dict.fromkeys(str(booking_id) for booking_id in booking_ids))
+
+def bulk_cancel_payload(cancelled, refused):
+    return {
+        'cancelled': cancelled,
+        'refund_total': sum(booking['refund'] for booking in cancelled),
+        'failed': {booking_id: error for booking_id, (_, error) in refused.items()}
+    }
+
+def cancel_bookings(booking_ids):
+    """Cancel every booking that may be cancelled, each one atomically; returns (cancelled, refused)"""
+    allowed, refused = split_cancellable(booking_ids, store.get_bookings(booking_ids))
+    cancelled, refused = cancellation_outcome(allowed, store.cancel_bookings(allowed), refused)
+    promote_after_cancellations(cancelled)
+    return cancelled, refused
+
+class SeatEventHub:
+    """Fans seat change events out to streaming clients from one store event feed per process"""
+    
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.listeners = {}  # channel -> set of subscriber queues
+        self.callbacks = []  # called with (channel, message) for every event
+        self.thread = None
+    
+    def _ensure_running(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="seat-events", daemon=True)
+            self.thread.start()
+    
+    def subscribe(self, channel):
+        """Register a queue that receives raw event messages for a channel"""
+        events = queue.Queue(maxsize=256)
+        with self.lock:
+            self.listeners.setdefault(channel, set()).add(events)
+            self._ensure_running()
+        return events
+    
+    def add_callback(self, callback):
+        """Call `callback(channel, message)` for every seat event; channel is None after a reconnect"""
+        with self.lock:
+            self.callbacks.append(callback)
+            self._ensure_running()
+    
+    def unsubscribe(self, channel, events):
+        with self.lock:
+            subscribers = self.listeners.get(channel)
+            if subscribers:
+                subscribers.discard(events)
+                if not subscribers:
+                    del self.listeners[channel]
+    
+    def _run(self):
+        while True:
+            try:
+                for channel, message in self.store.events():
+                    with self.lock:
+                        targets = list(self.listeners.get(channel, ()))
+                        callbacks = list(self.callbacks)
+                    for callback in callbacks:
+                        callback(channel, message)
+                    for events in targets:
+                        try:
+                            events.put_nowait(message)
+                        except queue.Full:
+                            pass  # slow client; it will see a version gap and refetch
+            except ConnectionError as e:
+                print(f"Seat event listener lost its store connection: {e}")
+                with self.lock:
+                    callbacks = list(self.callbacks)
+                for callback in callbacks:
+                    callback(None, None)  # events may have been missed
+                time.sleep(1)
+
+seat_events = SeatEventHub(store)
+
+def format_seat_event(message):
+    """Turn a published "<version> <event> <seats>" message into a server-sent event"""
+    version, event, seats = (message.split(' ', 2) + [''])[:3]
+    data = json_bytes({"version": int(version), "seats": seats.split(',') if seats else []}).decode('utf-8')
+    return f"id: {version}\nevent: {event}\ndata: {data}\n\n"
+
+# Best-available allocation works on per-show free-run indexes that seat
+# events keep current, so picking seats never rescans the hall
+seat_allocator = SeatAllocator(store)
+allocator_lock = threading.Lock()
+allocator_watched = False
+ALLOCATE_ATTEMPTS = 5
+MAX_PARTY_SIZE = max(len(seats) for seats in SEAT_BLOCKS)
+
+def watch_allocations():
+    """Subscribe the allocator to seat events the first time it is used"""
+    global allocator_watched
+    with allocator_lock:
+        if allocator_watched:
+            return
+        allocator_watched = True
+    seat_events.add_callback(seat_allocator.on_seat_event)
+
+def parse_allocation(data):
+    """Validate an /allocate body into (showtime_id, date, size, holder, rows, blocks); raises ValueError"""
+    data = data or {}
+    showtime_id = data.get('showtime_id')
+    booking_date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
+    try:
+        size = int(data.get('size') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('size must be a number')
+    # Seats are only picked to be held; an unheld pick from the index could already be gone
+    holder = data.get('holder')
+    if not showtime_id or not holder or not 1 <= size <= MAX_PARTY_SIZE:
+        raise ValueError(f'Missing showtime_id, holder or size (1-{MAX_PARTY_SIZE})')
+    # Optional preferences: rows as letters ("DEF" or ["D", "E"]), blocks by name or number
+    rows = data.get('rows') or []
+    if not isinstance(rows, (list, str)):
+        raise ValueError('rows must be row letters')
+    rows = {str(row).upper() for row in rows}
+    if rows - set(SEAT_ROWS):
+        raise ValueError(f'Unknown rows {", ".join(sorted(rows - set(SEAT_ROWS)))}')
+    blocks = data.get('blocks') or []
+    if not isinstance(blocks, list):
+        blocks = [blocks]
+    try:
+        blocks = {BLOCK_NAMES.index(block) if block in BLOCK_NAMES else int(block) for block in blocks}
+    except (TypeError, ValueError):
+        raise ValueError(f'blocks must be numbers or names ({", ".join(BLOCK_NAMES)})')
+    if any(not 0 <= block < len(BLOCK_NAMES) for block in blocks):
+        raise ValueError(f'blocks must be between 0 and {len(BLOCK_NAMES) - 1}')
+    return showtime_id, booking_date, size, str(holder), rows or None, blocks or None
+
+# Parties wait for sold-out shows in a FIFO waitlist per showtime and date.
+# Whenever seats come free here (cancellations, released holds) the parties
+# first in line get seats held for them; their SSE streams tell them so.
+WAITLIST_HOLD_TTL_SECONDS = int(os.environ.get('WAITLIST_HOLD_TTL_SECONDS', '600'))
+
+def promote_waitlist(showtime_id, booking_date):
+    """Hold seats for waitlisted parties in order while the one first in line fits; returns the promoted entries"""
+    watch_allocations()
+    # Seats freed a moment ago may not have reached the index through seat events yet
+    seat_allocator.refresh(showtime_id, booking_date)
+    promoted = []
+    for _ in range(ALLOCATE_ATTEMPTS):
+        entry = store.waitlist_head(showtime_id, booking_date)
+        if entry is None:
+            break
+        seats = seat_allocator.pick_any(showtime_id, booking_date, entry['party'])
+        if seats is None:
+            break
+        conflicts = place_holds(showtime_id, booking_date, seats, entry['holder'], WAITLIST_HOLD_TTL_SECONDS)
+        if conflicts:
+            seat_allocator.taken(showtime_id, booking_date, conflicts)
+            continue
+        seat_allocator.taken(showtime_id, booking_date, seats)
+        promoted_entry = store.promote_waitlist_entry(entry['entry_id'], seats, WAITLIST_HOLD_TTL_SECONDS)
+        if promoted_entry is None:
+            # Another worker promoted this party (or it left) in the meantime
+            release_holds(showtime_id, booking_date, entry['holder'], seats)
+            continue
+        promoted.append(promoted_entry)
+    return promoted
+
+def promote_after_cancellations(cancelled):
+    """Offer the seats of cancelled bookings to each show's waitlist"""
+    for showtime_id, booking_date in dict.fromkeys((booking['showtime_id'], booking['date']) for booking in cancelled):
+        promote_waitlist(showtime_id, booking_date)
+
+def parse_waitlist(data):
+    """Validate a /waitlist body into (showtime_id, date, party, holder, user); raises ValueError"""
+    data = data or {}
+    showtime_id = data.get('showtime_id')
+    holder = data.get('holder')
+    try:
+        party = int(data.get('party') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('party must be a number')
+    if not showtime_id or not holder or not 1 <= party <= MAX_PARTY_SIZE:
+        raise ValueError(f'Missing showtime_id, holder or party (1-{MAX_PARTY_SIZE})')
+    booking_date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
+    return str(showtime_id), booking_date, party, str(holder), data.get('user')
+
+# Short-lived cache of serialized /availability responses, keyed by
+# (theatre_id, movie_id, days, first date). Entries for a theatre are dropped
+# as soon as a seat event for one of its shows arrives, in every process.
+AVAILABILITY_TTL_SECONDS = 10
+MAX_AVAILABILITY_DAYS = 14
+availability_cache = {}
+availability_lock = threading.Lock()
+availability_watched = False
+
+def forget_availability(showtime_id):
+    """Drop cached availability for the theatre a showtime belongs to"""
+    st = SHOWTIME_BY_ID.get(showtime_id)
+    if st is None:
+        return
+    with availability_lock:
+        for key in [key for key in availability_cache if key[0] == st["theatre_id"]]:
+            del availability_cache[key]
+
+def invalidate_availability(channel, message):
+    """Seat event callback, so changes made by other workers also invalidate this process's cache"""
+    if channel is None:
+        with availability_lock:
+            availability_cache.clear()
+        return
+    forget_availability(channel.split(':')[1])
+
+def watch_availability():
+    """Subscribe the availability cache to seat events the first time it is used"""
+    global availability_watched
+    with availability_lock:
+        if availability_watched:
+            return
+        availability_watched = True
+    seat_events.add_callback(invalidate_availability)
+
+def build_availability(theatre_id, movie_id, dates):
+    """Free-seat counts for every matching showtime x date from one batched store read"""
+    by_movie = SHOWTIME_INDEX.get(theatre_id, {})
+    shows = [show for mid, shows in by_movie.items() if not movie_id or mid == movie_id for show in shows]
+    counts = iter(store.counts([(show["showtime_id"], booking_date) for show in shows for booking_date in dates]))
+    
+    out = []
+    for show in shows:
+        free = {}
+        for booking_date in dates:
+            booked, held = next(counts)
+            free[booking_date] = max(len(SEAT_LABELS) - booked - held, 0)
+        out.append({
+            "showtime_id": show["showtime_id"],
+            "movie_id": show["movie_id"],
+            "time": show["time"],
+            "free": free
+        })
+    return {"theatre_id": theatre_id, "movie_id": movie_id, "dates": dates, "total": len(SEAT_LABELS), "showtimes": out}
@@ -0,0 +1,142 @@
+"""In-process request metrics in the Prometheus text exposition format.
+
+Counters and histograms live in this process only; with several workers,
+scrape each one (or aggregate in Prometheus). Redis work is attributed to
+the request that caused it through InstrumentedConnection, which counts every
+round trip and reply on the connections of an instrumented pool.
+"""
+import contextvars
+import threading
+import time
+
+import redis
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}  # label values -> count
+        self.lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}" for key, value in values]
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [per-bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * len(self.buckets) + [0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, list(series)) for key, series in self.values.items())
+        lines = []
+        for key, series in values:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(series[-2])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+class Registry:
+    """The metrics one /metrics endpoint exposes"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines += metric.samples()
+        return '\n'.join(lines) + '\n'
+
+class RedisUsage:
+    """Redis round trips, replies and time spent waiting on them during one request"""
+    __slots__ = ('roundtrips', 'commands', 'seconds')
+
+    def __init__(self):
+        self.roundtrips = 0
+        self.commands = 0
+        self.seconds = 0.0
+
+# The usage of the request running in this thread, if any
+current_redis_usage = contextvars.ContextVar('current_redis_usage', default=None)
+
+class InstrumentedConnection(redis.Connection):
+    """Connection that charges each send (one per command or pipeline) and each reply to the current request"""
+
+    def send_packed_command(self, command, check_health=True):
+        usage = current_redis_usage.get()
+        if usage is None:
+            return super().send_packed_command(command, check_health)
+        started = time.perf_counter()
+        try:
+            return super().send_packed_command(command, check_health)
+        finally:
+            usage.roundtrips += 1
+            usage.seconds += time.perf_counter() - started
+
+    def read_response(self, *args, **kwargs):
+        usage = current_redis_usage.get()
+        if usage is None:
+            return super().read_response(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().read_response(*args, **kwargs)
+        finally:
+            usage.commands += 1
+            usage.seconds += time.perf_counter() - started
+
+def instrument_pool(pool):
+    """Make connections the pool opens from now on report to the current request"""
+    if pool.connection_class is redis.Connection:
+        pool.connection_class = InstrumentedConnection
@@ -0,0 +1,133 @@
+"""Occupancy-aware seat pricing for the CineBook API.
+
+A seat's price is the show's time-of-day base price times its seat tier's
+multiplier (from the row and block it sits in) times the multiplier of the
+show's occupancy band. Every seat of a tier costs the same, so a show only
+ever has one price table per band: tables are built once per (base, band)
+and PriceBook keeps each show's current one until its band changes.
+"""
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from seat_store import SEAT_ROWS, SEAT_BLOCKS, SEAT_LABELS
+
+# Tier rules, first match wins: (tier, rows, block numbers or None for all, multiplier)
+TIER_RULES = [
+    ('recliner', SEAT_ROWS[-2:], None, 1.5),
+    ('front', SEAT_ROWS[:3], None, 0.8),
+    ('prime', SEAT_ROWS[5:11], (1, 2), 1.25),
+    ('classic', SEAT_ROWS, None, 1.0),
+]
+PRICE_TIERS = [tier for tier, _, _, _ in TIER_RULES]
+TIER_MULTIPLIERS = [multiplier for _, _, _, multiplier in TIER_RULES]
+
+# Occupancy bands by the share of seats booked or held: (band, lower bound, multiplier)
+OCCUPANCY_BANDS = [
+    ('low', 0.0, 1.0),
+    ('filling', 0.5, 1.1),
+    ('high', 0.8, 1.25),
+    ('last_seats', 0.95, 1.4),
+]
+
+# Prices are rounded to this many rupees
+PRICE_STEP = 10
+
+def seat_tiers():
+    """PRICE_TIERS index per seat in SEAT_LABELS order"""
+    tiers = []
+    for row in SEAT_ROWS:
+        for block, seats in enumerate(SEAT_BLOCKS):
+            tier = next(i for i, (_, rows, blocks, _) in enumerate(TIER_RULES)
+                        if row in rows and (blocks is None or block in blocks))
+            tiers += [tier] * len(seats)
+    return tiers
+
+SEAT_TIERS = seat_tiers()
+
+def tier_rows():
+    """One string of PRICE_TIERS indexes per row, in the seat-map layout order"""
+    per_row = len(SEAT_LABELS) // len(SEAT_ROWS)
+    digits = ''.join(str(tier) for tier in SEAT_TIERS)
+    return [digits[i:i + per_row] for i in range(0, len(digits), per_row)]
+
+def occupancy_band(occupied, total=len(SEAT_LABELS)):
+    """Index into OCCUPANCY_BANDS for a number of booked or held seats"""
+    share = occupied / total
+    return max(i for i, (_, lower, _) in enumerate(OCCUPANCY_BANDS) if share >= lower)
+
+class PriceTable:
+    """Seat prices of a show with a given base price in a given occupancy band"""
+    __slots__ = ('base', 'band', 'tier_prices', 'seat_prices', 'standard')
+
+    def __init__(self, base, band):
+        self.base = base
+        self.band = OCCUPANCY_BANDS[band][0]
+        factor = base * OCCUPANCY_BANDS[band][2]
+        self.tier_prices = [int(round(factor * multiplier / PRICE_STEP)) * PRICE_STEP
+                            for multiplier in TIER_MULTIPLIERS]
+        self.seat_prices = [self.tier_prices[tier] for tier in SEAT_TIERS]
+        self.standard = self.tier_prices[PRICE_TIERS.index('classic')]
+
+    def by_tier(self):
+        return dict(zip(PRICE_TIERS, self.tier_prices))
+
+@lru_cache(maxsize=None)
+def price_table(base, band):
+    """The shared table for a base price and occupancy band index"""
+    return PriceTable(base, band)
+
+class PriceBook:
+    """Current price table per showtime and date; seat events only mark a show for a band re-check"""
+
+    def __init__(self, max_shows=4096):
+        self.max_shows = max_shows
+        self.shows = OrderedDict()  # (showtime_id, date) -> [band index, PriceTable, checked since last event]
+        self.lock = threading.Lock()
+
+    def on_seat_event(self, channel, message):
+        """Seat event callback; the show's band is re-checked on its next priced read"""
+        if channel is None:
+            with self.lock:
+                for entry in self.shows.values():
+                    entry[2] = False
+            return
+        _, showtime_id, _, booking_date = channel.split(':', 3)
+        self.touch(showtime_id, booking_date)
+
+    def touch(self, showtime_id, booking_date):
+        """Note that a show's occupancy changed"""
+        with self.lock:
+            entry = self.shows.get((showtime_id, booking_date))
+            if entry is not None:
+                entry[2] = False
+
+    def unchecked(self, shows):
+        """The (showtime_id, date) pairs whose occupancy must be counted before pricing them"""
+        with self.lock:
+            return [key for key in shows if key not in self.shows or not self.shows[key][2]]
+
+    def observe(self, showtime_id, booking_date, base, occupied, remember=True):
+        """Price table for a show at a known occupancy; the cached one is kept unless the band changed"""
+        key = (showtime_id, booking_date)
+        band = occupancy_band(occupied)
+        with self.lock:
+            entry = self.shows.get(key)
+            if entry is not None and entry[0] == band:
+                if remember:
+                    entry[2] = True
+                    self.shows.move_to_end(key)
+                return entry[1]
+            table = price_table(base, band)
+            if remember:
+                self.shows[key] = [band, table, True]
+                self.shows.move_to_end(key)
+                while len(self.shows) > self.max_shows:
+                    self.shows.popitem(last=False)
+        return table
+
+    def current(self, showtime_id, booking_date, base):
+        """A show's cached table, or the lowest band's when it has not been priced yet"""
+        with self.lock:
+            entry = self.shows.get((showtime_id, booking_date))
+        return entry[1] if entry is not None else price_table(base, 0)
@@ -0,0 +1,90 @@
+"""Token-bucket rate limiting for the CineBook API.
+
+A limited request takes one token from every bucket that applies to it (say
+one for the client and one for the showtime) or, if any of them is dry, from
+none. Buckets refill continuously at `rate` tokens per second up to `burst`.
+In Redis one script call checks and takes from all of a request's buckets
+atomically, so every worker shares them; in-process stores use LocalRateLimiter.
+"""
+import math
+import threading
+import time
+
+# Check and take one token from every bucket, or from none.
+# KEYS: buckets (hashes of token level and last update ms).
+# ARGV: now (ms), then rate (tokens per second) and burst per bucket.
+# Returns {0, 0} when allowed, else {ms until a token is back, 1-based index of the driest bucket}.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local levels, wait, dry = {}, 0, 0
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ms')
+    local level = tonumber(state[1]) or burst
+    local last = tonumber(state[2]) or now
+    level = math.min(burst, level + math.max(0, now - last) * rate / 1000)
+    levels[i] = level
+    if level < 1 then
+        local needed = math.ceil((1 - level) * 1000 / rate)
+        if needed > wait then
+            wait, dry = needed, i
+        end
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    local level = levels[i]
+    if wait == 0 then
+        level = level - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(level), 'ms', now)
+    -- A bucket left alone this long is full again, which is the same as no key
+    redis.call('PEXPIRE', key, math.ceil(burst * 1000 / rate) + 1000)
+end
+return {wait, dry}
+"""
+
+def bucket_key(route, scope, ident):
+    """Redis hash holding one token bucket"""
+    return f"ratelimit:{route}:{scope}:{ident}"
+
+class RedisRateLimiter:
+    """Token buckets shared by every worker through one Redis script call per request"""
+
+    def __init__(self, client):
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, buckets):
+        """Take a token from every (key, rate, burst) bucket or from none; returns (0, None) when
+        allowed, else (seconds until a token is back, index of the bucket that ran dry)"""
+        args = [int(time.time() * 1000)]
+        for _, rate, burst in buckets:
+            args += [rate, burst]
+        wait_ms, dry = self.script(keys=[key for key, _, _ in buckets], args=args)
+        return (0, None) if not wait_ms else (wait_ms / 1000, dry - 1)
+
+class LocalRateLimiter:
+    """The same buckets kept in this process, for the memory and sqlite stores"""
+
+    def __init__(self, max_buckets=100000):
+        self.max_buckets = max_buckets
+        self.buckets = {}  # key -> (tokens, last update, when full again), in monotonic seconds
+        self.lock = threading.Lock()
+
+    def take(self, buckets):
+        now = time.monotonic()
+        with self.lock:
+            levels, wait, dry = [], 0, None
+            for i, (key, rate, burst) in enumerate(buckets):
+                level, last, _ = self.buckets.get(key, (burst, now, now))
+                level = min(burst, level + (now - last) * rate)
+                levels.append(level)
+                if level < 1 and (1 - level) / rate > wait:
+                    wait, dry = (1 - level) / rate, i
+            if len(self.buckets) > self.max_buckets:
+                # A bucket that has refilled is the same as no bucket
+                self.buckets = {key: state for key, state in self.buckets.items() if state[2] > now}
+            for (key, rate, burst), level in zip(buckets, levels):
+                level -= 0 if wait else 1
+                self.buckets[key] = (level, now, now + (burst - level) / rate)
+        return (math.ceil(wait * 1000) / 1000, dry) if wait else (0, None)
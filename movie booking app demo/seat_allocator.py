@@ -0,0 +1,194 @@
+"""Best-available contiguous seat allocation for the CineBook API.
+
+Each showtime and date gets a FreeRunIndex: the free seats of every
+(row, block) segment of the hall kept as maximal runs, plus the longest run
+per segment. Seat events patch only the segments they touch, so picking
+seats skips full segments outright instead of scanning all 392 seats.
+"""
+import heapq
+import threading
+from collections import OrderedDict
+
+from seat_store import SEAT_ROWS, SEAT_BLOCKS, SEAT_LABELS, SEAT_INDEX
+
+BLOCK_NAMES = ['left', 'center_left', 'center_right', 'right']
+
+def hall_segments():
+    """(row, block number, first SEAT_LABELS index, seat count) for every segment;
+    seats of a segment are adjacent in SEAT_LABELS and contiguous in the hall"""
+    segments, first = [], 0
+    for row in SEAT_ROWS:
+        for block, seats in enumerate(SEAT_BLOCKS):
+            segments.append((row, block, first, len(seats)))
+            first += len(seats)
+    return segments
+
+SEGMENTS = hall_segments()
+SEGMENT_OF = [seg for seg, (_, _, _, size) in enumerate(SEGMENTS) for _ in range(size)]
+
+# Row about two thirds back from the screen (row A) and the middle of the row
+# (aisles count as one seat) are the best seats; a row away weighs like two seats across
+IDEAL_ROW = (len(SEAT_ROWS) - 1) * 2 / 3
+ROW_WEIGHT = 2.0
+
+def seat_scores():
+    """Preference score per seat in SEAT_LABELS order; lower is better"""
+    width = sum(len(seats) for seats in SEAT_BLOCKS) + len(SEAT_BLOCKS) - 1
+    scores = []
+    for row_idx, _ in enumerate(SEAT_ROWS):
+        x = 0
+        for seats in SEAT_BLOCKS:
+            for _ in seats:
+                scores.append(ROW_WEIGHT * abs(row_idx - IDEAL_ROW) + abs(x - (width - 1) / 2))
+                x += 1
+            x += 1  # aisle
+    return scores
+
+SEAT_SCORES = seat_scores()
+
+def seat_segment(label):
+    """(row, block name) of the segment a seat sits in"""
+    row, block, _, _ = SEGMENTS[SEGMENT_OF[SEAT_INDEX[label]]]
+    return row, BLOCK_NAMES[block]
+
+class FreeRunIndex:
+    """Free seats of one showtime and date as runs per (row, block) segment"""
+
+    def __init__(self, bits, version):
+        self.version = version
+        self.free = bytearray(1 if bit == '0' else 0 for bit in bits)
+        self.runs = [[] for _ in SEGMENTS]  # segment -> [(first seat index, length)]
+        self.longest = [0] * len(SEGMENTS)
+        self.stale = False
+        for seg in range(len(SEGMENTS)):
+            self._reindex(seg)
+
+    def _reindex(self, seg):
+        """Recompute the runs of one segment from its seats"""
+        _, _, first, size = SEGMENTS[seg]
+        runs, start = [], None
+        for idx in range(first, first + size + 1):
+            if idx < first + size and self.free[idx]:
+                if start is None:
+                    start = idx
+            elif start is not None:
+                runs.append((start, idx - start))
+                start = None
+        self.runs[seg] = runs
+        self.longest[seg] = max((length for _, length in runs), default=0)
+
+    def mark(self, labels, free):
+        """Mark seats free or taken, re-indexing only the segments they sit in"""
+        touched = set()
+        for label in labels:
+            idx = SEAT_INDEX.get(label)
+            if idx is not None and self.free[idx] != free:
+                self.free[idx] = free
+                touched.add(SEGMENT_OF[idx])
+        for seg in touched:
+            self._reindex(seg)
+
+    def best(self, size, rows=None, blocks=None):
+        """Lowest-scoring window of `size` adjacent free seats, as SEAT_LABELS indexes, or None"""
+        best_score, best_start = None, None
+        for seg, (row, block, _, _) in enumerate(SEGMENTS):
+            if self.longest[seg] < size or (rows and row not in rows) or (blocks and block not in blocks):
+                continue
+            for start, length in self.runs[seg]:
+                if length < size:
+                    continue
+                window = sum(SEAT_SCORES[start:start + size])
+                for first in range(start, start + length - size + 1):
+                    if first > start:
+                        window += SEAT_SCORES[first + size - 1] - SEAT_SCORES[first - 1]
+                    if best_score is None or window < best_score:
+                        best_score, best_start = window, first
+        if best_start is None:
+            return None
+        return list(range(best_start, best_start + size))
+
+    def scattered(self, size):
+        """The `size` best-scoring free seats anywhere, as SEAT_LABELS indexes, or None if fewer are free"""
+        free = [idx for idx, is_free in enumerate(self.free) if is_free]
+        if len(free) < size:
+            return None
+        return sorted(heapq.nsmallest(size, free, key=SEAT_SCORES.__getitem__))
+
+class SeatAllocator:
+    """Free-run indexes for recently allocated shows, kept current from seat events"""
+
+    def __init__(self, store, max_shows=2048):
+        self.store = store
+        self.max_shows = max_shows
+        self.indexes = OrderedDict()  # (showtime_id, date) -> FreeRunIndex, least recently used first
+        self.lock = threading.Lock()
+
+    def on_seat_event(self, channel, message):
+        """Seat event callback; patches the show's index or marks it for a rebuild"""
+        if channel is None:
+            with self.lock:
+                for index in self.indexes.values():
+                    index.stale = True
+            return
+        _, showtime_id, _, booking_date = channel.split(':', 3)
+        version, event, seats = (message.split(' ', 2) + [''])[:3]
+        with self.lock:
+            index = self.indexes.get((showtime_id, booking_date))
+            if index is None or int(version) <= index.version:
+                return
+            if event == 'reset' or int(version) != index.version + 1:
+                index.stale = True
+                return
+            index.version = int(version)
+            index.mark(seats.split(',') if seats else [], 1 if event in ('released', 'cancelled') else 0)
+
+    def index_for(self, showtime_id, booking_date):
+        """The show's index, built from one seat-map read when missing or stale"""
+        key = (showtime_id, booking_date)
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is not None and not index.stale:
+                self.indexes.move_to_end(key)
+                return index
+        bits, version, prebooked = self.store.seat_state(showtime_id, booking_date)
+        if not prebooked:
+            self.store.prebook(showtime_id, booking_date)
+            bits, version, _ = self.store.seat_state(showtime_id, booking_date)
+        index = FreeRunIndex(bits, version)
+        with self.lock:
+            current = self.indexes.get(key)
+            if current is not None and not current.stale and current.version >= version:
+                return current
+            self.indexes[key] = index
+            self.indexes.move_to_end(key)
+            while len(self.indexes) > self.max_shows:
+                self.indexes.popitem(last=False)
+        return index
+
+    def pick(self, showtime_id, booking_date, size, rows=None, blocks=None):
+        """Best contiguous free seat labels for a party, or None when no segment has room"""
+        index = self.index_for(showtime_id, booking_date)
+        with self.lock:
+            picked = index.best(size, rows, blocks)
+        return [SEAT_LABELS[idx] for idx in picked] if picked else None
+
+    def pick_any(self, showtime_id, booking_date, size):
+        """Best contiguous seats for a party, else its best free seats anywhere; None when too few are free"""
+        index = self.index_for(showtime_id, booking_date)
+        with self.lock:
+            picked = index.best(size) or index.scattered(size)
+        return [SEAT_LABELS[idx] for idx in picked] if picked else None
+
+    def refresh(self, showtime_id, booking_date):
+        """Rebuild the show's index on its next use, for callers that cannot wait for seat events"""
+        with self.lock:
+            index = self.indexes.get((showtime_id, booking_date))
+            if index is not None:
+                index.stale = True
+
+    def taken(self, showtime_id, booking_date, labels):
+        """Record seats found taken (e.g. a lost hold race) before their event arrives"""
+        with self.lock:
+            index = self.indexes.get((showtime_id, booking_date))
+            if index is not None:
+                index.mark(labels, 0)
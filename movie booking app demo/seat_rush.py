@@ -0,0 +1,190 @@
+"""Seat-rush load generator and double-booking auditor.
+
+Fires concurrent booking attempts at one showtime and date, then reports
+throughput, per-route latency percentiles and every seat sold more than once.
+
+    python seat_rush.py --attempts 2000 --concurrency 100
+    SEAT_BACKEND=memory python seat_rush.py --in-process   # Flask test client, no server
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from seat_store import SEAT_LABELS
+
+class HttpClient:
+    """Pooled requests sessions (one per worker thread) against a running server"""
+
+    def __init__(self, base_url, pool_size):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.local = threading.local()
+
+    def request(self, method, path, params=None, json=None, headers=None):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+        resp = session.request(method, self.base_url + path, params=params, json=json, headers=headers, timeout=30)
+        try:
+            return resp.status_code, resp.json()
+        except ValueError:
+            return resp.status_code, None
+
+class InProcessClient:
+    """Flask test client calling app_flask inside this process"""
+
+    def __init__(self):
+        from app_flask import app
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, params=None, json=None, headers=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        resp = client.open(path, method=method, query_string=params, json=json, headers=headers)
+        return resp.status_code, resp.get_json(silent=True)
+
+def free_seats(seatmap):
+    """Free seat labels from a compact seat map, in layout order"""
+    bits = ''.join(seatmap["rows"])
+    return [label for label, bit in zip(SEAT_LABELS, bits) if bit == '0']
+
+def percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+async def rush(client, showtime_id, booking_date, attempts, concurrency, max_group, hotspot):
+    """Run `attempts` customers (read seat map, pick seats, book them) with `concurrency` in flight"""
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    latencies = defaultdict(list)  # route -> seconds
+    statuses = defaultdict(Counter)  # route -> status code -> count
+    sold = Counter()  # seat -> successful bookings
+    outcome = Counter()
+    remaining = iter(range(attempts))
+
+    async def call(route, method, path, **kwargs):
+        started = time.perf_counter()
+        status, body = await loop.run_in_executor(executor, partial(client.request, method, path, **kwargs))
+        latencies[route].append(time.perf_counter() - started)
+        statuses[route][status] += 1
+        return status, body
+
+    async def customer(rng):
+        for n in remaining:
+            # Every attempt is a different customer as far as per-client rate limits go
+            headers = {"X-Session-Id": f"rush-{n}"}
+            status, seatmap = await call("GET /seatmap", "GET", f"/seatmap/{showtime_id}",
+                                         params={"date": booking_date, "format": "compact"}, headers=headers)
+            if status == 429:
+                outcome["shed"] += 1
+                continue
+            if status != 200:
+                outcome["error"] += 1
+                continue
+            free = free_seats(seatmap)
+            if not free:
+                outcome["sold_out"] += 1
+                continue
+            # Everybody wants the same few seats, which is what makes a rush
+            group = min(rng.randint(1, max_group), len(free))
+            seats = rng.sample(free[:max(hotspot, group)], group)
+            if group == 1:
+                status, _ = await call("POST /book", "POST", "/book", headers=headers,
+                                       json={"showtime_id": showtime_id, "date": booking_date, "seat": seats[0]})
+            else:
+                status, _ = await call("POST /book/batch", "POST", "/book/batch", headers=headers,
+                                       json={"showtime_id": showtime_id, "date": booking_date, "seats": seats})
+            if status == 200:
+                outcome["booked"] += 1
+                sold.update(seats)
+            elif status == 409:
+                outcome["conflict"] += 1
+            elif status == 429:
+                outcome["shed"] += 1
+            else:
+                outcome["error"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(customer(random.Random(n)) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    # Audit: no seat may be sold twice, and every sale must show up as taken
+    _, final = await loop.run_in_executor(executor, partial(
+        client.request, "GET", f"/seatmap/{showtime_id}", params={"date": booking_date, "format": "compact"},
+        headers={"X-Session-Id": "rush-audit"}))
+    executor.shutdown()
+    still_free = set(free_seats(final)) if final else set()
+    requests_made = sum(len(samples) for samples in latencies.values())
+    return {
+        "elapsed": elapsed,
+        "requests": requests_made,
+        "throughput": requests_made / elapsed if elapsed else 0.0,
+        "outcome": dict(outcome),
+        "routes": {
+            route: {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "statuses": dict(statuses[route])
+            }
+            for route, samples in sorted(latencies.items())
+        },
+        "seats_sold": len(sold),
+        "oversold": sorted(seat for seat, n in sold.items() if n > 1),
+        "lost": sorted(seat for seat in sold if seat in still_free)
+    }
+
+def run_rush(client, showtime_id="1", booking_date=None, attempts=1000, concurrency=50, max_group=4, hotspot=24):
+    """Synchronous entry point; a fresh far-future date is used unless one is given"""
+    if booking_date is None:
+        booking_date = (datetime.now() + timedelta(days=random.randint(365, 3650))).strftime('%Y-%m-%d')
+    return asyncio.run(rush(client, showtime_id, booking_date, attempts, concurrency, max_group, hotspot))
+
+def print_report(report):
+    print(f"{report['requests']} requests in {report['elapsed']:.2f}s ({report['throughput']:.0f} req/s)")
+    print("outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(report["outcome"].items())))
+    print(f"{'route':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for route, stats in report["routes"].items():
+        print(f"{route:<18}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}  {stats['statuses']}")
+    print(f"seats sold: {report['seats_sold']}, sold more than once: {len(report['oversold'])}"
+          f"{' ' + ', '.join(report['oversold']) if report['oversold'] else ''}")
+    if report["lost"]:
+        print(f"sold but shown as free: {', '.join(report['lost'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Seat-rush load generator and double-booking auditor")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--in-process', action='store_true', help='use the Flask test client instead of HTTP')
+    parser.add_argument('--showtime', default='1')
+    parser.add_argument('--date', help='show date (default: a fresh far-future date)')
+    parser.add_argument('--attempts', type=int, default=2000, help='booking attempts in total')
+    parser.add_argument('--concurrency', type=int, default=100, help='attempts in flight at once')
+    parser.add_argument('--max-group', type=int, default=4, help='largest party size per booking')
+    parser.add_argument('--hotspot', type=int, default=24, help='customers pick among the first N free seats')
+    args = parser.parse_args()
+
+    client = InProcessClient() if args.in_process else HttpClient(args.url, args.concurrency)
+    report = run_rush(client, args.showtime, args.date, args.attempts, args.concurrency, args.max_group, args.hotspot)
+    print_report(report)
+    # Non-zero exit so CI can fail the build on a double booking
+    sys.exit(1 if report["oversold"] or report["lost"] else 0)
+
+if __name__ == '__main__':
+    main()
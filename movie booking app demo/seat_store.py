@@ -0,0 +1,2139 @@
+"""Seat occupancy stores for the CineBook API.
+
+Every store offers the same operations on the fixed hall layout: seat maps,
+atomic (batch) booking, timed holds, seat counts, one-time prebooking and a
+feed of seat change events, plus booking records that are looked up by id
+or user and replayed for retried idempotency keys, and an append-only log of
+booking, hold and cancel events. RedisSeatStore is the production store;
+MemorySeatStore and SqliteSeatStore run without a Redis server.
+"""
+import asyncio
+import queue
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+
+import redis
+import redis.asyncio
+
+from shard_ring import HashRing, ring_hash
+
+# Fixed hall layout shared by every showtime
+SEAT_ROWS = "ABCDEFGHIJKLMN"
+SEAT_BLOCKS = [
+    list(range(20, 24)),     # left block: 20-23
+    list(range(12, 20)),     # center_left: 12-19
+    list(range(2, 12)),      # center_right: 2-11
+    list(range(0, 2)) + list(range(24, 28))  # right: 0-1, 24-27
+]
+
+# Seat label <-> bit offset mapping, in seat map order (row by row, block by block)
+SEAT_LABELS = [f"{row}{n:02d}" for row in SEAT_ROWS for block in SEAT_BLOCKS for n in block]
+SEAT_INDEX = {label: idx for idx, label in enumerate(SEAT_LABELS)}
+SEATS_PER_ROW = sum(len(block) for block in SEAT_BLOCKS)
+SEAT_BITMAP_BYTES = (len(SEAT_LABELS) + 7) // 8
+PREBOOK_COUNT = int(0.15 * len(SEAT_LABELS))  # seats taken before the first customer arrives
+
+CATALOG_VERSION_KEY = "catalog:version"  # written last when seeding, so it doubles as the readiness key
+CATALOG_SEED_LOCK_KEY = "catalog:seed_lock"
+SEED_LOCK_TTL_SECONDS = 30  # a seeder that dies mid-seed blocks the others at most this long
+SEED_WAIT_SECONDS = 60  # how long a booting process waits for another one's seed
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600  # how long a retried request replays its first booking
+IDEMPOTENCY_PENDING_SECONDS = 30  # how long a claimed key waits for its booking before a retry may book again
+ARCHIVE_GRACE_SECONDS = 6 * 3600  # show-date keys outlive their date this long so the archiver can copy them
+BOOKING_STREAM_KEY = "stream:bookings"  # append-only log of booking, hold and cancel events
+BOOKING_STREAM_MAXLEN = 1000000  # roughly how many events the log keeps before trimming the oldest
+SEAT_EVENT_BUFFER = 10000  # seat events an in-process store buffers for its consumer before dropping the oldest
+
+class BookingInProgress(Exception):
+    """An earlier request with the same idempotency key is still booking; retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after=1):
+        super().__init__('A booking with this idempotency key is still in progress')
+        self.retry_after = retry_after
+
+def now_ms():
+    """Current time in milliseconds, the unit of hold expiry scores"""
+    return int(time.time() * 1000)
+
+def prebook_sample(showtime_id, booking_date):
+    """Deterministic 15% sample of seats for a showtime and date"""
+    rng = random.Random(f"{showtime_id}:{booking_date}")
+    return rng.sample(SEAT_LABELS, PREBOOK_COUNT)
+
+def seat_events_channel(showtime_id, booking_date):
+    """Channel carrying seat changes for a showtime and date"""
+    return f"showtime:{showtime_id}:events:{booking_date}"
+
+def seat_offsets(seats):
+    """Map seat labels to bitmap offsets, raising ValueError for unknown seats"""
+    unknown = [seat for seat in seats if seat not in SEAT_INDEX]
+    if unknown:
+        raise ValueError(f"Unknown seats: {', '.join(unknown)}")
+    return [SEAT_INDEX[seat] for seat in seats]
+
+def bits_from_labels(taken):
+    """One '0'/'1' char per seat in SEAT_LABELS order, '1' for every label in `taken`"""
+    return ''.join('1' if label in taken else '0' for label in SEAT_LABELS)
+
+def show_expiry_ms(booking_date):
+    """When a show date's Redis keys expire: the end of that date plus ARCHIVE_GRACE_SECONDS (0 if it does not parse)"""
+    try:
+        day = datetime.strptime(booking_date, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return 0
+    return int((day + timedelta(days=1)).timestamp() * 1000) + ARCHIVE_GRACE_SECONDS * 1000
+
+def new_booking_id(shard=None):
+    """Server-issued booking id; sharded stores put the tag of the node keeping it in front (see shard_tag)"""
+    return f"BK{shard}-{uuid.uuid4().hex[:16].upper()}" if shard else f"BK{uuid.uuid4().hex[:16].upper()}"
+
+def booking_record(booking_id, showtime_id, booking_date, seats, holder, user, created_ms,
+                   status='confirmed', cancelled_ms=None, prices=None):
+    """The booking record every store returns; `prices` are the quoted seat prices in `seats` order,
+    None for bookings made before prices were recorded"""
+    return {
+        'booking_id': booking_id,
+        'showtime_id': showtime_id,
+        'date': booking_date,
+        'seats': list(seats),
+        'holder': holder or None,
+        'user': user or None,
+        'created_ms': int(created_ms),
+        'status': status,
+        'cancelled_ms': int(cancelled_ms) if cancelled_ms else None,
+        'prices': [int(price) for price in prices] if prices else None
+    }
+
+def prices_csv(prices):
+    """Seat prices as stored next to the seat labels; '' for none"""
+    return ','.join(str(int(price)) for price in prices) if prices else ''
+
+def prices_from_csv(value):
+    return [int(price) for price in value.split(',')] if value else None
+
+def booking_event(event_id, event, showtime_id, booking_date, seats, ms, booking_id=None, holder=None, user=None,
+                  prices=None):
+    """The booking log entry every store returns; `event` is "booked", "cancelled", "held",
+    "released", "expired" or "converted" (a hold that became a booking) and `id` is the offset to read on from.
+    Bookings and cancellations carry the booking's charged seat `prices` when it has them"""
+    return {
+        'id': str(event_id),
+        'event': event,
+        'showtime_id': showtime_id,
+        'date': booking_date,
+        'seats': list(seats),
+        'ms': int(ms),
+        'booking_id': booking_id or None,
+        'holder': holder or None,
+        'user': user or None,
+        'prices': [int(price) for price in prices] if prices else None
+    }
+
+def new_waitlist_id(shard=None):
+    """Server-issued waitlist entry id, tagged with its node like new_booking_id"""
+    return f"WL{shard}-{uuid.uuid4().hex[:16].upper()}" if shard else f"WL{uuid.uuid4().hex[:16].upper()}"
+
+def waitlist_record(entry_id, showtime_id, booking_date, party, holder, user, joined_ms,
+                    status='waiting', seats=(), hold_expires_ms=None, position=None):
+    """The waitlist entry every store returns; `position` counts from 1 while the party waits.
+    Status goes from "waiting" to "promoted" (seats held for the party) or "left"."""
+    return {
+        'entry_id': entry_id,
+        'showtime_id': showtime_id,
+        'date': booking_date,
+        'party': int(party),
+        'holder': holder,
+        'user': user or None,
+        'joined_ms': int(joined_ms),
+        'status': status,
+        'seats': list(seats),
+        'hold_expires_ms': int(hold_expires_ms) if hold_expires_ms else None,
+        'position': position if status == 'waiting' else None
+    }
+
+def seat_counts_from(booked, held, prebooked):
+    """Booked and held counts, counting the prebook a never-viewed show is about to get"""
+    if not prebooked and not booked:
+        booked = PREBOOK_COUNT
+    return booked, held
+
+class SeatStore:
+    """Operations every seat store provides. Seats are plain labels; stores
+    that only know the hall layout raise ValueError for anything else."""
+
+    name = None
+
+    def __init__(self):
+        self._events = queue.Queue(maxsize=SEAT_EVENT_BUFFER)
+
+    def seat_state(self, showtime_id, booking_date, holder=None):
+        """(bits, version, prebooked): occupancy bits in SEAT_LABELS order with seats
+        held by anyone but `holder` marked taken, seat-map version and prebook flag"""
+        raise NotImplementedError
+
+    def version(self, showtime_id, booking_date):
+        """Current seat-map version for a showtime and date"""
+        raise NotImplementedError
+
+    def prebook(self, showtime_id, booking_date):
+        """Apply the prebooked sample once per showtime and date; True if it was applied now"""
+        raise NotImplementedError
+
+    def warm(self, shows):
+        """Prebook many (showtime_id, date) pairs; returns how many were applied now"""
+        return sum(1 for showtime_id, booking_date in shows if self.prebook(showtime_id, booking_date))
+
+    def book(self, showtime_id, booking_date, seats, holder=None):
+        """Book every seat or none, converting the holder's holds; returns the conflicting labels"""
+        raise NotImplementedError
+
+    def create_booking(self, showtime_id, booking_date, seats, holder=None, user=None,
+                       idempotency_key=None, idempotency_ttl=IDEMPOTENCY_TTL_SECONDS, prices=None):
+        """Book like `book` and keep a booking record with the quoted seat `prices`; returns
+        (booking, conflicts, replayed). A key seen in the last `idempotency_ttl` seconds replays
+        its booking without booking again; stores that claim the key before booking raise
+        BookingInProgress while the first request is still running."""
+        raise NotImplementedError
+
+    def get_booking(self, booking_id):
+        """The booking record for an id, or None"""
+        raise NotImplementedError
+
+    def user_bookings(self, user):
+        """A user's booking records, oldest first"""
+        raise NotImplementedError
+
+    def get_bookings(self, booking_ids):
+        """Booking records (or None) for several ids, in order"""
+        return [self.get_booking(booking_id) for booking_id in booking_ids]
+
+    def cancel_bookings(self, booking_ids):
+        """Cancel each booking atomically, freeing its seats; returns (booking, cancelled) per id,
+        where booking is the record after the call (None if unknown) and cancelled is False if it
+        was already cancelled"""
+        raise NotImplementedError
+
+    def cancel_booking(self, booking_id):
+        return self.cancel_bookings([booking_id])[0]
+
+    def bookings_on(self, booking_date):
+        """Every booking record for a show date, for the archiver"""
+        raise NotImplementedError
+
+    def purge_date(self, booking_date):
+        """Drop a past show date's seats and bookings once they are archived; returns how many bookings went"""
+        raise NotImplementedError
+
+    def keeps_date(self, booking_date):
+        """Whether the store still holds everything it had for a show date, so finding no bookings
+        proves there were none; stores whose dates never lapse always do"""
+        return True
+
+    def join_waitlist(self, showtime_id, booking_date, party, holder, user=None):
+        """Queue a party of `party` seats at the back of a show's waitlist; returns its entry"""
+        raise NotImplementedError
+
+    def waitlist_entry(self, entry_id):
+        """A waitlist entry with its current position, or None"""
+        raise NotImplementedError
+
+    def waitlist_head(self, showtime_id, booking_date):
+        """The entry first in line for a show, or None when nobody waits"""
+        raise NotImplementedError
+
+    def promote_waitlist_entry(self, entry_id, seats, hold_ttl):
+        """Take an entry off the front of its queue, recording the seats held for it for
+        `hold_ttl` seconds; returns the promoted entry, or None if it is no longer first in line"""
+        raise NotImplementedError
+
+    def leave_waitlist(self, entry_id):
+        """Take a waiting or promoted party off the waitlist; returns (entry, left), where left
+        is False if the entry was unknown or had already left"""
+        raise NotImplementedError
+
+    def hold(self, showtime_id, booking_date, seats, holder, ttl):
+        """Hold every seat for `ttl` seconds or none; returns the conflicting labels"""
+        raise NotImplementedError
+
+    def release(self, showtime_id, booking_date, holder, seats=None):
+        """Release the holder's holds on `seats` (or all of them); returns the released labels"""
+        raise NotImplementedError
+
+    def sweep_holds(self):
+        """Drop lapsed holds across every showtime and date; returns how many were dropped"""
+        raise NotImplementedError
+
+    def counts(self, shows):
+        """(booked, held) for each (showtime_id, date) pair, including pending prebooks"""
+        raise NotImplementedError
+
+    def count(self, showtime_id, booking_date):
+        """Booked and currently held seat counts for one showtime and date"""
+        return self.counts([(showtime_id, booking_date)])[0]
+
+    def seed_catalog(self, theatres, movies, showtimes, version, force=False):
+        """Publish the static catalog to shared storage; in-process stores have nothing to seed"""
+        return False
+
+    def booking_events(self, after='0', count=1000, block=None):
+        """Up to `count` booking log entries after event id `after` ('0' for the start of the log),
+        oldest first; waits up to `block` seconds for one when there are none yet"""
+        deadline = time.monotonic() + (block or 0)
+        while True:
+            events = self._events_after(after, count)
+            if events or time.monotonic() >= deadline:
+                return events
+            time.sleep(0.05)
+
+    def _events_after(self, after, count):
+        raise NotImplementedError
+
+    def events(self):
+        """Yield (channel, message) for every seat change, blocking between events.
+        Messages read "<version> <event> <seats csv>"."""
+        while True:
+            yield self._events.get()
+
+    def _publish(self, showtime_id, booking_date, version, event, seats):
+        # Buffered until consumed; past the bound the oldest event goes and its
+        # subscribers see a version gap and refetch
+        item = (seat_events_channel(showtime_id, booking_date), f"{version} {event} {','.join(seats)}")
+        while True:
+            try:
+                self._events.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._events.get_nowait()
+                except queue.Empty:
+                    pass
+
+# Shared Lua helpers for the seat scripts.
+# KEYS: booked seats (set or bitmap), seat-map version, holds (zset of seat ->
+# expiry in ms), holders (hash of seat -> holder id), the booking log stream.
+# ARGV: storage mode, current time in ms, when the show date's keys expire
+# (ms since the epoch, 0 for never), then script-specific arguments.
+# Seats are passed as (label, bitmap offset) pairs.
+# Every change bumps the version, keeps the seat and version keys expiring
+# with the show date and publishes "<version> <event> <seats>" on the show's
+# events channel (see seat_events_channel). Bookings, cancellations and every
+# hold that is placed, released, expires or is converted into a booking are
+# also appended to the booking log stream (see booking_event).
+SEAT_LUA_PRELUDE = f"local stream_maxlen = {BOOKING_STREAM_MAXLEN}" + """
+local mode, now, expire_at = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local function expire_with_show(key)
+    if expire_at > 0 then
+        redis.call('PEXPIREAT', key, expire_at)
+    end
+end
+local function publish_change(event, seats)
+    local version = redis.call('INCR', KEYS[2])
+    expire_with_show(KEYS[1])
+    expire_with_show(KEYS[2])
+    local channel = (string.gsub(KEYS[2], ':version:', ':events:'))
+    redis.call('PUBLISH', channel, version .. ' ' .. event .. ' ' .. table.concat(seats, ','))
+end
+local function log_event(event, seats, ...)
+    local showtime_id, booking_date = string.match(KEYS[2], '^showtime:(.-):version:(.*)$')
+    redis.call('XADD', KEYS[5], 'MAXLEN', '~', stream_maxlen, '*', 'event', event, 'showtime_id', showtime_id,
+               'date', booking_date, 'seats', table.concat(seats, ','), 'ms', now, ...)
+end
+local function sweep()
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)
+    if #expired > 0 then
+        redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+        redis.call('HDEL', KEYS[4], unpack(expired))
+        publish_change('released', expired)
+        log_event('expired', expired)
+    end
+    return #expired
+end
+local function is_booked(label, offset)
+    if mode == 'bitmap' then
+        return redis.call('GETBIT', KEYS[1], offset) == 1
+    end
+    return redis.call('SISMEMBER', KEYS[1], label) == 1
+end
+local function mark_booked(label, offset)
+    if mode == 'bitmap' then
+        redis.call('SETBIT', KEYS[1], offset, 1)
+    else
+        redis.call('SADD', KEYS[1], label)
+    end
+end
+local function mark_free(label, offset)
+    if mode == 'bitmap' then
+        redis.call('SETBIT', KEYS[1], offset, 0)
+    else
+        redis.call('SREM', KEYS[1], label)
+    end
+end
+local function held_by_other(label, holder)
+    if not redis.call('ZSCORE', KEYS[3], label) then
+        return false
+    end
+    return redis.call('HGET', KEYS[4], label) ~= holder
+end
+local function drop_hold(label)
+    redis.call('ZREM', KEYS[3], label)
+    redis.call('HDEL', KEYS[4], label)
+end
+local function conflicts_from(first, holder)
+    local conflicts = {}
+    for i = first, #ARGV, 2 do
+        if is_booked(ARGV[i], ARGV[i + 1]) or held_by_other(ARGV[i], holder) then
+            table.insert(conflicts, ARGV[i])
+        end
+    end
+    return conflicts
+end
+local function book_from(first, holder)
+    local booked, converted = {}, {}
+    for i = first, #ARGV, 2 do
+        mark_booked(ARGV[i], ARGV[i + 1])
+        if redis.call('ZSCORE', KEYS[3], ARGV[i]) then
+            drop_hold(ARGV[i])
+            table.insert(converted, ARGV[i])
+        end
+        table.insert(booked, ARGV[i])
+    end
+    publish_change('booked', booked)
+    if #converted > 0 then
+        log_event('converted', converted, 'holder', holder)
+    end
+    return booked
+end
+"""
+
+# Reserve a group of seats in one round trip: either every seat is booked or
+# none are, and the seats that were already taken (booked, or held by someone
+# else) are returned instead. The caller's own holds on those seats are
+# converted into bookings. ARGV[4] is the holder id ('' for none).
+BOOK_SCRIPT = SEAT_LUA_PRELUDE + """
+sweep()
+local conflicts = conflicts_from(5, ARGV[4])
+if #conflicts == 0 then
+    book_from(5, ARGV[4])
+end
+return conflicts
+"""
+
+# BOOK_SCRIPT plus the booking record, in the same atomic step. Extra KEYS:
+# booking hash (6), the user's booking index (7, zset of id -> created ms) and
+# the date's booking ids (8). ARGV: holder (4), booking id (5), showtime id (6),
+# date (7), user (8, '' for none), quoted seat prices (9, comma-separated in
+# seat order, '' for none), then seat pairs. Returns {'booked', id} or
+# {'conflict', seats...}. The booking expires with its show date. Idempotency
+# keys live on their own node and are claimed before the script runs (see
+# RedisSeatStore.create_booking).
+BOOKING_SCRIPT = SEAT_LUA_PRELUDE + """
+local holder, booking_id, user = ARGV[4], ARGV[5], ARGV[8]
+sweep()
+local conflicts = conflicts_from(10, holder)
+if #conflicts > 0 then
+    return {'conflict', unpack(conflicts)}
+end
+local booked = book_from(10, holder)
+redis.call('HSET', KEYS[6], 'booking_id', booking_id, 'showtime_id', ARGV[6], 'date', ARGV[7],
+           'seats', table.concat(booked, ','), 'holder', holder, 'user', user, 'created_ms', now,
+           'status', 'confirmed', 'prices', ARGV[9])
+redis.call('SADD', KEYS[8], booking_id)
+expire_with_show(KEYS[6])
+expire_with_show(KEYS[8])
+if user ~= '' then
+    redis.call('ZADD', KEYS[7], now, booking_id)
+end
+log_event('booked', booked, 'booking_id', booking_id, 'holder', holder, 'user', user, 'prices', ARGV[9])
+return {'booked', booking_id}
+"""
+
+# Cancel the booking whose hash is KEYS[6], freeing its seats (pairs from
+# ARGV[4]) and marking it cancelled. Returns 0 when the booking is unknown or
+# already cancelled, so a cancellation is applied exactly once. Listeners get
+# a "cancelled" event for the freed seats.
+CANCEL_SCRIPT = SEAT_LUA_PRELUDE + """
+if redis.call('EXISTS', KEYS[6]) == 0 or redis.call('HGET', KEYS[6], 'status') == 'cancelled' then
+    return 0
+end
+local freed = {}
+for i = 4, #ARGV, 2 do
+    mark_free(ARGV[i], ARGV[i + 1])
+    table.insert(freed, ARGV[i])
+end
+redis.call('HSET', KEYS[6], 'status', 'cancelled', 'cancelled_ms', now)
+publish_change('cancelled', freed)
+local booking = redis.call('HMGET', KEYS[6], 'booking_id', 'holder', 'user', 'prices')
+log_event('cancelled', freed, 'booking_id', booking[1], 'holder', booking[2], 'user', booking[3],
+          'prices', booking[4] or '')
+return 1
+"""
+
+# Hold seats for ARGV[5] ms on behalf of holder ARGV[4], all or nothing.
+# Re-holding your own seats extends them; only newly held seats are logged.
+# The hold keys live as long as the show date rather than the latest hold,
+# so a lapsed hold is still there for sweep() to log as expired.
+HOLD_SCRIPT = SEAT_LUA_PRELUDE + """
+sweep()
+local holder, ttl = ARGV[4], tonumber(ARGV[5])
+local conflicts = conflicts_from(6, holder)
+if #conflicts == 0 then
+    local held, fresh = {}, {}
+    for i = 6, #ARGV, 2 do
+        if not redis.call('ZSCORE', KEYS[3], ARGV[i]) then
+            table.insert(fresh, ARGV[i])
+        end
+        redis.call('ZADD', KEYS[3], now + ttl, ARGV[i])
+        redis.call('HSET', KEYS[4], ARGV[i], holder)
+        table.insert(held, ARGV[i])
+    end
+    expire_with_show(KEYS[3])
+    expire_with_show(KEYS[4])
+    publish_change('held', held)
+    if #fresh > 0 then
+        log_event('held', fresh, 'holder', holder)
+    end
+end
+return conflicts
+"""
+
+# Release holder ARGV[4]'s holds on the given seat labels, or on every seat
+# they hold when none are given. Returns the released labels.
+RELEASE_SCRIPT = SEAT_LUA_PRELUDE + """
+sweep()
+local holder = ARGV[4]
+local seats = {}
+if #ARGV > 4 then
+    for i = 5, #ARGV do
+        table.insert(seats, ARGV[i])
+    end
+else
+    local holders = redis.call('HGETALL', KEYS[4])
+    for i = 1, #holders, 2 do
+        table.insert(seats, holders[i])
+    end
+end
+local released = {}
+for _, label in ipairs(seats) do
+    if redis.call('HGET', KEYS[4], label) == holder then
+        drop_hold(label)
+        table.insert(released, label)
+    end
+end
+if #released > 0 then
+    publish_change('released', released)
+    log_event('released', released, 'holder', holder)
+end
+return released
+"""
+
+# Drop expired holds for one showtime and date; used by the background sweeper
+SWEEP_SCRIPT = SEAT_LUA_PRELUDE + """
+return sweep()
+"""
+
+# Promote the party first in a show's waitlist: pop it and record the seats
+# held for it, unless another process promoted it (or it left) first.
+# KEYS: waitlist, entry hash. ARGV: entry id, seats csv, hold expiry (ms).
+PROMOTE_SCRIPT = """
+if redis.call('LINDEX', KEYS[1], 0) ~= ARGV[1] or redis.call('HGET', KEYS[2], 'status') ~= 'waiting' then
+    return 0
+end
+redis.call('LPOP', KEYS[1])
+redis.call('HSET', KEYS[2], 'status', 'promoted', 'seats', ARGV[2], 'hold_expires_ms', ARGV[3])
+return 1
+"""
+
+# Take a waiting or promoted party off its show's waitlist.
+# KEYS: waitlist, entry hash. ARGV: entry id.
+LEAVE_SCRIPT = """
+local status = redis.call('HGET', KEYS[2], 'status')
+if status ~= 'waiting' and status ~= 'promoted' then
+    return 0
+end
+redis.call('LREM', KEYS[1], 1, ARGV[1])
+redis.call('HSET', KEYS[2], 'status', 'left')
+return 1
+"""
+
+# Delete a lock only while it still holds our token, so a seeder whose lock
+# expired cannot release the next seeder's lock.
+# KEYS: lock. ARGV: token.
+UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Apply the prebooked sample exactly once per showtime and date. The sentinel
+# (KEYS[3]) is claimed with SET NX, so concurrent first readers cannot both
+# prebook, and a show whose seats were all cancelled is never refilled. Shows
+# that already hold bookings only get the sentinel. ARGV[1] is the storage
+# mode, ARGV[2] when the show date's keys expire (0 for never); the rest are
+# seat labels (set) or offsets (bitmap). Listeners get a "reset" event telling
+# them to refetch the whole seat map.
+PREBOOK_SCRIPT = """
+local expire_at = tonumber(ARGV[2])
+if not redis.call('SET', KEYS[3], '1', 'NX') then
+    return 0
+end
+if expire_at > 0 then
+    redis.call('PEXPIREAT', KEYS[3], expire_at)
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if ARGV[1] == 'bitmap' then
+    for i = 3, #ARGV do
+        redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+    end
+else
+    redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+end
+local version = redis.call('INCR', KEYS[2])
+if expire_at > 0 then
+    redis.call('PEXPIREAT', KEYS[1], expire_at)
+    redis.call('PEXPIREAT', KEYS[2], expire_at)
+end
+redis.call('PUBLISH', (string.gsub(KEYS[2], ':version:', ':events:')), version .. ' reset ')
+return 1
+"""
+
+def seat_set_key(showtime_id, booking_date):
+    """Redis set of booked seat labels for a showtime and date"""
+    return f"showtime:{showtime_id}:booked:{booking_date}"
+
+def seat_bitmap_key(showtime_id, booking_date):
+    """Redis bitmap of booked seat offsets for a showtime and date"""
+    return f"showtime:{showtime_id}:seats:{booking_date}"
+
+def seat_version_key(showtime_id, booking_date):
+    """Counter bumped whenever the seat map for a showtime and date changes"""
+    return f"showtime:{showtime_id}:version:{booking_date}"
+
+def seat_holds_key(showtime_id, booking_date):
+    """Sorted set of held seat labels scored by hold expiry (ms) for a showtime and date"""
+    return f"showtime:{showtime_id}:holds:{booking_date}"
+
+def seat_holders_key(showtime_id, booking_date):
+    """Hash of held seat label -> holder id for a showtime and date"""
+    return f"showtime:{showtime_id}:holders:{booking_date}"
+
+def prebook_sentinel_key(showtime_id, booking_date):
+    """One-time marker that a showtime and date has had its prebooking applied"""
+    return f"showtime:{showtime_id}:prebooked:{booking_date}"
+
+def booking_key(booking_id):
+    """Redis hash holding one booking record"""
+    return f"booking:{booking_id}"
+
+def user_bookings_key(user):
+    """Sorted set of a user's booking ids scored by booking time (ms)"""
+    return f"user:{user}:bookings"
+
+def date_bookings_key(booking_date):
+    """Set of the booking ids made for a show date"""
+    return f"bookings:{booking_date}"
+
+def waitlist_key(showtime_id, booking_date):
+    """List of waitlist entry ids for a showtime and date, first in line first"""
+    return f"showtime:{showtime_id}:waitlist:{booking_date}"
+
+def waitlist_entry_key(entry_id):
+    """Redis hash holding one waitlist entry"""
+    return f"waitlist:{entry_id}"
+
+def idempotency_key_for(key):
+    """Booking id made by the first request carrying an idempotency key, or its pending marker
+    (see pending_marker) while that request is still booking"""
+    return f"idempotency:{key}"
+
+def pending_marker(booking_id):
+    """Value of an idempotency key claimed for a booking that is not made yet"""
+    return f"pending:{booking_id}"
+
+def replayed_id(previous):
+    """Booking id a claimed idempotency key replays; raises BookingInProgress while it is pending"""
+    if previous.startswith('pending:'):
+        raise BookingInProgress()
+    return previous
+
+def bits_from_bitmap(bitmap):
+    """Expand a Redis bitmap (most significant bit first) into one '0'/'1' char per seat"""
+    padded = (bitmap or b"").ljust(SEAT_BITMAP_BYTES, b"\0")[:SEAT_BITMAP_BYTES]
+    return format(int.from_bytes(padded, 'big'), f'0{SEAT_BITMAP_BYTES * 8}b')[:len(SEAT_LABELS)]
+
+def shard_tag(url):
+    """Short stable name of a node, written into the ids of the records it keeps"""
+    return format(ring_hash(url), '016x')[:6].upper()
+
+def group_by_node(items, node_of):
+    """{node: [(position, item)]} for items spread over nodes"""
+    groups = defaultdict(list)
+    for position, item in enumerate(items):
+        groups[node_of(item)].append((position, item))
+    return groups
+
+def as_text(value):
+    """Decode a reply from the raw-bytes client"""
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+class RedisSeatKeys:
+    """Key and script-argument layout shared by the blocking and asyncio Redis stores"""
+
+    storage = 'set'
+
+    def use_nodes(self, url, shards, shard_key, connect):
+        """Connect the primary (`url`: catalog, locks, rate limits, analytics) and the seat nodes,
+        reusing the primary's clients when it is one of them. `connect(url)` returns a
+        (text, raw-bytes) client pair; `shard_key(showtime_id)` names the show's shard (its theatre)."""
+        self.url = url
+        self.r, self.rb = connect(url)
+        self.shard_urls = list(shards or [url])
+        self.shard_key = shard_key
+        self.ring = HashRing(self.shard_urls)
+        self.shard_tags = [shard_tag(shard_url) for shard_url in self.shard_urls]
+        self.tag_nodes = {tag: node for node, tag in enumerate(self.shard_tags)}
+        if len(self.tag_nodes) < len(self.shard_tags):
+            raise ValueError("Shard URLs must be distinct")
+        clients = [(self.r, self.rb) if shard_url == url else connect(shard_url) for shard_url in self.shard_urls]
+        self.nodes = [client for client, _ in clients]
+        self.nodes_raw = [client for _, client in clients]
+
+    def node_for_show(self, showtime_id):
+        """Index of the node holding a show's keys: its theatre's, so per-show scripts stay on one node.
+        Showtimes the shard key does not know are placed by their own id."""
+        key = self.shard_key(showtime_id) if self.shard_key else None
+        return self.ring.node_for(showtime_id if key is None else key)
+
+    def node_for_id(self, record_id):
+        """Index of the node holding a booking or waitlist entry, named by the tag in its id.
+        Untagged ids (issued before ids carried their node) are placed by hashing the id."""
+        tag, tagged, _ = record_id[2:].partition('-')
+        node = self.tag_nodes.get(tag) if tagged else None
+        return self.ring.node_for(record_id) if node is None else node
+
+    def node_for_key(self, idempotency_key):
+        """Index of the node keeping an idempotency key, placed by the key itself so a retry
+        finds it whichever show it names"""
+        return self.ring.node_for(idempotency_key_for(idempotency_key))
+
+    def issue_id(self, new_id, node):
+        """A fresh id from `new_id` tagged with `node`, so records live with their show"""
+        return new_id(self.shard_tags[node])
+
+    def show_client(self, showtime_id, raw=False):
+        """Client of a show's node; the raw-bytes one for bitmap reads"""
+        return (self.nodes_raw if raw else self.nodes)[self.node_for_show(showtime_id)]
+
+    def seat_key(self, showtime_id, booking_date):
+        """Booked-seat key for the configured storage mode"""
+        if self.storage == 'bitmap':
+            return seat_bitmap_key(showtime_id, booking_date)
+        return seat_set_key(showtime_id, booking_date)
+
+    def script_keys(self, showtime_id, booking_date):
+        """KEYS shared by the seat scripts, in SEAT_LUA_PRELUDE order"""
+        return [
+            self.seat_key(showtime_id, booking_date),
+            seat_version_key(showtime_id, booking_date),
+            seat_holds_key(showtime_id, booking_date),
+            seat_holders_key(showtime_id, booking_date),
+            BOOKING_STREAM_KEY
+        ]
+
+    def script_head(self, booking_date, now=None):
+        """ARGV every seat script starts with, in SEAT_LUA_PRELUDE order"""
+        return [self.storage, now or now_ms(), show_expiry_ms(booking_date)]
+
+    def script_args(self, seats):
+        """Flatten seats into (label, offset) pairs; seats outside the layout are only allowed in set mode"""
+        if self.storage == 'bitmap':
+            seat_offsets(seats)  # raises ValueError for unknown seats
+        args = []
+        for seat in seats:
+            args += [seat, SEAT_INDEX.get(seat, -1)]
+        return args
+
+    def prebook_call(self, showtime_id, booking_date):
+        """(keys, args) for PREBOOK_SCRIPT"""
+        sample = prebook_sample(showtime_id, booking_date)
+        if self.storage == 'bitmap':
+            args = ['bitmap', show_expiry_ms(booking_date)] + [SEAT_INDEX[seat] for seat in sample]
+        else:
+            args = ['set', show_expiry_ms(booking_date)] + sample
+        keys = [
+            self.seat_key(showtime_id, booking_date),
+            seat_version_key(showtime_id, booking_date),
+            prebook_sentinel_key(showtime_id, booking_date)
+        ]
+        return keys, args
+
+    def booking_call(self, showtime_id, booking_date, seats, holder, user, prices=None):
+        """(keys, args, booking) for BOOKING_SCRIPT; `booking` is the record it creates on success"""
+        booking_id = self.issue_id(new_booking_id, self.node_for_show(showtime_id))
+        booking = booking_record(booking_id, showtime_id, booking_date, seats, holder, user, now_ms(),
+                                 prices=prices)
+        keys = self.script_keys(showtime_id, booking_date) + [
+            booking_key(booking['booking_id']),
+            user_bookings_key(user or ''),
+            date_bookings_key(booking_date)
+        ]
+        args = self.script_head(booking_date, booking['created_ms']) + [
+            holder or '', booking['booking_id'], showtime_id, booking_date,
+            user or '', prices_csv(prices)
+        ] + self.script_args(seats)
+        return keys, args, booking
+
+    def booking_from(self, fields):
+        """Booking record from its Redis hash, or None when there is none"""
+        if not fields:
+            return None
+        return booking_record(fields['booking_id'], fields['showtime_id'], fields['date'], fields['seats'].split(','),
+                              fields['holder'], fields['user'], fields['created_ms'],
+                              fields.get('status', 'confirmed'), fields.get('cancelled_ms'),
+                              prices_from_csv(fields.get('prices')))
+
+    def cancel_call(self, booking, now):
+        """(keys, args) for CANCEL_SCRIPT on a booking record"""
+        keys = self.script_keys(booking['showtime_id'], booking['date']) + [booking_key(booking['booking_id'])]
+        return keys, self.script_head(booking['date'], now) + self.script_args(booking['seats'])
+
+    def hold_call(self, showtime_id, booking_date, seats, holder, ttl):
+        """(keys, args) for HOLD_SCRIPT"""
+        keys = self.script_keys(showtime_id, booking_date)
+        return keys, self.script_head(booking_date) + [holder, ttl * 1000] + self.script_args(seats)
+
+    def cancellations_from(self, bookings, replies, now):
+        """(booking, cancelled) per booking from the CANCEL_SCRIPT replies of the known ones"""
+        replies = iter(replies)
+        out = []
+        for booking in bookings:
+            if booking is None:
+                out.append((None, False))
+            elif next(replies):
+                out.append((dict(booking, status='cancelled', cancelled_ms=now), True))
+            else:
+                out.append((dict(booking, status='cancelled'), False))
+        return out
+
+    def waitlist_from(self, fields, position=None):
+        """Waitlist entry from its Redis hash, or None when there is none"""
+        if not fields:
+            return None
+        return waitlist_record(fields['entry_id'], fields['showtime_id'], fields['date'], fields['party'],
+                               fields['holder'], fields['user'], fields['joined_ms'], fields['status'],
+                               fields['seats'].split(',') if fields['seats'] else [],
+                               fields['hold_expires_ms'] or None, position)
+
+    def booking_event_from(self, event_id, fields):
+        """Booking log entry from a stream entry"""
+        return booking_event(event_id, fields['event'], fields['showtime_id'], fields['date'],
+                             fields['seats'].split(',') if fields['seats'] else [], fields['ms'],
+                             fields.get('booking_id'), fields.get('holder'), fields.get('user'),
+                             prices_from_csv(fields.get('prices')))
+
+    def queue_seat_state(self, pipe, showtime_id, booking_date):
+        """Queue the reads behind seat_state; decode the replies with seat_state_from"""
+        if self.storage == 'bitmap':
+            pipe.get(seat_bitmap_key(showtime_id, booking_date))
+        else:
+            pipe.smembers(seat_set_key(showtime_id, booking_date))
+        pipe.mget([seat_version_key(showtime_id, booking_date), prebook_sentinel_key(showtime_id, booking_date)])
+        pipe.zrangebyscore(seat_holds_key(showtime_id, booking_date), now_ms(), '+inf')
+        pipe.hgetall(seat_holders_key(showtime_id, booking_date))
+
+    def seat_state_from(self, replies, holder):
+        booked, (version, prebooked), held, holders = replies
+        if self.storage == 'bitmap':
+            bits = bits_from_bitmap(booked)
+            held = [as_text(label) for label in held]
+            holders = {as_text(k): as_text(v) for k, v in holders.items()}
+        else:
+            bits = bits_from_labels(booked)
+
+        held_by_others = [SEAT_INDEX[label] for label in held if label in SEAT_INDEX and holders.get(label) != holder]
+        if held_by_others:
+            chars = list(bits)
+            for idx in held_by_others:
+                chars[idx] = '1'
+            bits = ''.join(chars)
+        return bits, int(as_text(version) or 0), prebooked is not None
+
+    def queue_counts(self, pipe, shows):
+        """Queue three count reads per (showtime_id, date); decode the replies with counts_from"""
+        now = now_ms()
+        for showtime_id, booking_date in shows:
+            if self.storage == 'bitmap':
+                pipe.bitcount(seat_bitmap_key(showtime_id, booking_date))
+            else:
+                pipe.scard(seat_set_key(showtime_id, booking_date))
+            pipe.zcount(seat_holds_key(showtime_id, booking_date), now, '+inf')
+            pipe.exists(prebook_sentinel_key(showtime_id, booking_date))
+
+    def counts_from(self, replies):
+        replies = iter(replies)
+        return [seat_counts_from(booked, held, prebooked) for booked, held, prebooked in zip(replies, replies, replies)]
+
+class RedisSeatStore(RedisSeatKeys, SeatStore):
+    """Seats in Redis, changed by Lua scripts and announced over pub/sub, so any
+    number of API processes can share them. `storage` is "set" (seat labels in
+    a set) or "bitmap" (one bit per seat of the hall layout). With `shards`,
+    shows are spread over those nodes by consistent hashing of `shard_key`;
+    each show's seats, holds and bookings stay together on one node, and booking
+    and waitlist ids name it. Idempotency keys are placed by the key itself."""
+
+    name = 'redis'
+
+    def __init__(self, url='redis://localhost:6379/0', storage='set', max_connections=20, shards=None, shard_key=None):
+        super().__init__()
+        self.storage = storage
+
+        def connect(node_url):
+            # Raw-bytes client for bitmap keys (bitmaps are not valid UTF-8)
+            return tuple(redis.Redis(connection_pool=redis.ConnectionPool.from_url(
+                node_url, decode_responses=decode, max_connections=max_connections)) for decode in (True, False))
+        self.use_nodes(url, shards, shard_key, connect)
+        # Scripts run on whichever node a show lives on
+        self.book_script = self.r.register_script(BOOK_SCRIPT)
+        self.booking_script = self.r.register_script(BOOKING_SCRIPT)
+        self.cancel_script = self.r.register_script(CANCEL_SCRIPT)
+        self.hold_script = self.r.register_script(HOLD_SCRIPT)
+        self.release_script = self.r.register_script(RELEASE_SCRIPT)
+        self.sweep_script = self.r.register_script(SWEEP_SCRIPT)
+        self.prebook_script = self.r.register_script(PREBOOK_SCRIPT)
+        self.unlock_script = self.r.register_script(UNLOCK_SCRIPT)
+        self.promote_script = self.r.register_script(PROMOTE_SCRIPT)
+        self.leave_script = self.r.register_script(LEAVE_SCRIPT)
+
+    def seat_state(self, showtime_id, booking_date, holder=None):
+        # Single round trip for occupancy, holds, seat-map version and prebook sentinel
+        pipe = self.show_client(showtime_id, self.storage == 'bitmap').pipeline(transaction=False)
+        self.queue_seat_state(pipe, showtime_id, booking_date)
+        return self.seat_state_from(pipe.execute(), holder)
+
+    def version(self, showtime_id, booking_date):
+        return int(self.show_client(showtime_id).get(seat_version_key(showtime_id, booking_date)) or 0)
+
+    def _prebook(self, showtime_id, booking_date, client=None):
+        keys, args = self.prebook_call(showtime_id, booking_date)
+        return self.prebook_script(keys=keys, args=args, client=client or self.show_client(showtime_id))
+
+    def prebook(self, showtime_id, booking_date):
+        return bool(self._prebook(showtime_id, booking_date))
+
+    def warm(self, shows, batch_size=500):
+        # Pipelined script calls per node, flushed every batch_size shows
+        applied = 0
+        for node, group in group_by_node(shows, lambda show: self.node_for_show(show[0])).items():
+            pipe = self.nodes[node].pipeline(transaction=False)
+            for queued, (_, (showtime_id, booking_date)) in enumerate(group, 1):
+                self._prebook(showtime_id, booking_date, client=pipe)
+                if queued % batch_size == 0:
+                    applied += sum(pipe.execute())
+            applied += sum(pipe.execute())
+        return applied
+
+    def book(self, showtime_id, booking_date, seats, holder=None):
+        args = self.script_head(booking_date) + [holder or ''] + self.script_args(seats)
+        return self.book_script(keys=self.script_keys(showtime_id, booking_date), args=args,
+                                client=self.show_client(showtime_id))
+
+    def create_booking(self, showtime_id, booking_date, seats, holder=None, user=None,
+                       idempotency_key=None, idempotency_ttl=IDEMPOTENCY_TTL_SECONDS, prices=None):
+        keys, args, booking = self.booking_call(showtime_id, booking_date, seats, holder, user, prices)
+        claimed, marker = None, pending_marker(booking['booking_id'])
+        if idempotency_key:
+            # Claim the key on its own node before booking on the show's, so a retry naming any show is caught.
+            # The pending marker lapses on its own if this process dies before the booking is made.
+            client, key = self.nodes[self.node_for_key(idempotency_key)], idempotency_key_for(idempotency_key)
+            if client.set(key, marker, nx=True, px=IDEMPOTENCY_PENDING_SECONDS * 1000):
+                claimed = client, key
+            else:
+                previous = client.get(key)
+                if previous:
+                    return self.get_booking(replayed_id(previous)), [], True
+        outcome = 'failed'
+        try:
+            outcome, *rest = self.booking_script(keys=keys, args=args, client=self.show_client(showtime_id))
+        finally:
+            if claimed and outcome != 'booked':
+                # Let a retry try again when the seats were taken or the show's node failed
+                self.unlock_script(keys=[claimed[1]], args=[marker], client=claimed[0])
+        if outcome == 'conflict':
+            return None, rest, False
+        if claimed:
+            claimed[0].set(claimed[1], booking['booking_id'], px=idempotency_ttl * 1000)
+        return booking, [], False
+
+    def get_booking(self, booking_id):
+        return self.booking_from(self.nodes[self.node_for_id(booking_id)].hgetall(booking_key(booking_id)))
+
+    def user_bookings(self, user):
+        # Each node indexes the user's bookings for its own shows
+        bookings = []
+        for client in self.nodes:
+            pipe = client.pipeline(transaction=False)
+            for booking_id in client.zrange(user_bookings_key(user), 0, -1):
+                pipe.hgetall(booking_key(booking_id))
+            bookings += [booking for booking in map(self.booking_from, pipe.execute()) if booking]
+        return sorted(bookings, key=lambda booking: booking['created_ms'])
+
+    def get_bookings(self, booking_ids):
+        # One pipelined round trip per node
+        out = [None] * len(booking_ids)
+        for node, group in group_by_node(booking_ids, self.node_for_id).items():
+            pipe = self.nodes[node].pipeline(transaction=False)
+            for _, booking_id in group:
+                pipe.hgetall(booking_key(booking_id))
+            for (position, _), fields in zip(group, pipe.execute()):
+                out[position] = self.booking_from(fields)
+        return out
+
+    def cancel_bookings(self, booking_ids):
+        # One round trip per node to read the bookings, one for their cancellation scripts
+        bookings = self.get_bookings(booking_ids)
+        known = [booking for booking in bookings if booking]
+        now = now_ms()
+        replies = [None] * len(known)
+        for node, group in group_by_node(known, lambda booking: self.node_for_id(booking['booking_id'])).items():
+            pipe = self.nodes[node].pipeline(transaction=False)
+            for _, booking in group:
+                keys, args = self.cancel_call(booking, now)
+                self.cancel_script(keys=keys, args=args, client=pipe)
+            for (position, _), reply in zip(group, pipe.execute()):
+                replies[position] = reply
+        return self.cancellations_from(bookings, replies, now)
+
+    def bookings_on(self, booking_date):
+        bookings = []
+        for client in self.nodes:
+            pipe = client.pipeline(transaction=False)
+            for booking_id in client.smembers(date_bookings_key(booking_date)):
+                pipe.hgetall(booking_key(booking_id))
+            bookings += [booking for booking in map(self.booking_from, pipe.execute()) if booking]
+        return sorted(bookings, key=lambda booking: booking['created_ms'])
+
+    def keeps_date(self, booking_date):
+        # The date's keys lapse ARCHIVE_GRACE_SECONDS after it ends
+        expiry = show_expiry_ms(booking_date)
+        return not expiry or now_ms() < expiry
+
+    def purge_date(self, booking_date):
+        # The keys would expire on their own; deleting them frees the memory now
+        bookings = self.bookings_on(booking_date)
+        for node, client in enumerate(self.nodes):
+            pipe = client.pipeline(transaction=False)
+            for booking in bookings:
+                if self.node_for_id(booking['booking_id']) != node:
+                    continue
+                pipe.delete(booking_key(booking['booking_id']))
+                if booking['user']:
+                    pipe.zrem(user_bookings_key(booking['user']), booking['booking_id'])
+            pipe.delete(date_bookings_key(booking_date))
+            for key in client.scan_iter(match=f'showtime:*:*:{booking_date}', count=500):
+                pipe.delete(key)
+            pipe.execute()
+        return len(bookings)
+
+    def join_waitlist(self, showtime_id, booking_date, party, holder, user=None):
+        entry_id = self.issue_id(new_waitlist_id, self.node_for_show(showtime_id))
+        entry = waitlist_record(entry_id, showtime_id, booking_date, party, holder, user, now_ms())
+        expire_at = show_expiry_ms(booking_date)
+        pipe = self.show_client(showtime_id).pipeline(transaction=True)
+        fields = {name: entry[name] for name in ('entry_id', 'showtime_id', 'date', 'party', 'holder', 'joined_ms', 'status')}
+        pipe.hset(waitlist_entry_key(entry['entry_id']), mapping=dict(fields, user=user or '', seats='', hold_expires_ms=''))
+        pipe.rpush(waitlist_key(showtime_id, booking_date), entry['entry_id'])
+        if expire_at:
+            pipe.pexpireat(waitlist_entry_key(entry['entry_id']), expire_at)
+            pipe.pexpireat(waitlist_key(showtime_id, booking_date), expire_at)
+        return dict(entry, position=pipe.execute()[1])
+
+    def waitlist_entry(self, entry_id):
+        client = self.nodes[self.node_for_id(entry_id)]
+        entry = self.waitlist_from(client.hgetall(waitlist_entry_key(entry_id)))
+        if entry is None or entry['status'] != 'waiting':
+            return entry
+        index = client.lpos(waitlist_key(entry['showtime_id'], entry['date']), entry_id)
+        return dict(entry, position=index + 1 if index is not None else None)
+
+    def waitlist_head(self, showtime_id, booking_date):
+        client = self.show_client(showtime_id)
+        entry_id = client.lindex(waitlist_key(showtime_id, booking_date), 0)
+        if entry_id is None:
+            return None
+        return self.waitlist_from(client.hgetall(waitlist_entry_key(entry_id)), 1)
+
+    def promote_waitlist_entry(self, entry_id, seats, hold_ttl):
+        client = self.nodes[self.node_for_id(entry_id)]
+        entry = self.waitlist_from(client.hgetall(waitlist_entry_key(entry_id)))
+        if entry is None:
+            return None
+        expires = now_ms() + hold_ttl * 1000
+        if not self.promote_script(keys=[waitlist_key(entry['showtime_id'], entry['date']), waitlist_entry_key(entry_id)],
+                                   args=[entry_id, ','.join(seats), expires], client=client):
+            return None
+        return dict(entry, status='promoted', seats=list(seats), hold_expires_ms=expires, position=None)
+
+    def leave_waitlist(self, entry_id):
+        client = self.nodes[self.node_for_id(entry_id)]
+        entry = self.waitlist_from(client.hgetall(waitlist_entry_key(entry_id)))
+        if entry is None:
+            return None, False
+        left = self.leave_script(keys=[waitlist_key(entry['showtime_id'], entry['date']), waitlist_entry_key(entry_id)],
+                                 args=[entry_id], client=client)
+        return dict(entry, status='left', position=None), bool(left)
+
+    def hold(self, showtime_id, booking_date, seats, holder, ttl):
+        keys, args = self.hold_call(showtime_id, booking_date, seats, holder, ttl)
+        return self.hold_script(keys=keys, args=args, client=self.show_client(showtime_id))
+
+    def release(self, showtime_id, booking_date, holder, seats=None):
+        args = self.script_head(booking_date) + [holder] + list(seats or [])
+        return self.release_script(keys=self.script_keys(showtime_id, booking_date), args=args,
+                                   client=self.show_client(showtime_id))
+
+    def sweep_holds(self):
+        swept = 0
+        for client in self.nodes:
+            pipe = client.pipeline(transaction=False)
+            for key in client.scan_iter(match='showtime:*:holds:*', count=500):
+                _, showtime_id, _, booking_date = key.split(':', 3)
+                self.sweep_script(keys=self.script_keys(showtime_id, booking_date),
+                                  args=self.script_head(booking_date), client=pipe)
+            swept += sum(pipe.execute())
+        return swept
+
+    def counts(self, shows):
+        # Three reads per show, in one pipelined round trip per node
+        shows = list(shows)
+        out = [None] * len(shows)
+        for node, group in group_by_node(shows, lambda show: self.node_for_show(show[0])).items():
+            pipe = self.nodes[node].pipeline(transaction=False)
+            self.queue_counts(pipe, [show for _, show in group])
+            for (position, _), count in zip(group, self.counts_from(pipe.execute())):
+                out[position] = count
+        return out
+
+    def seed_catalog(self, theatres, movies, showtimes, version, force=False,
+                     lock_ttl=SEED_LOCK_TTL_SECONDS, wait=SEED_WAIT_SECONDS):
+        """Seed catalog hashes once per catalog version, however many processes boot at once:
+        the one holding the seed lock seeds, the others wait for the version key to show it done"""
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        delay = 0.02
+        while True:
+            if not force and self.r.get(CATALOG_VERSION_KEY) == version:
+                return False
+            if self.r.set(CATALOG_SEED_LOCK_KEY, token, nx=True, px=int(lock_ttl * 1000)):
+                break
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Catalog version {version} was not seeded within {wait}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        try:
+            # The previous lock holder may have seeded this version while we waited
+            if not force and self.r.get(CATALOG_VERSION_KEY) == version:
+                return False
+            self._seed(theatres, movies, showtimes, version)
+            return True
+        finally:
+            self.unlock_script(keys=[CATALOG_SEED_LOCK_KEY], args=[token])
+
+    def _seed(self, theatres, movies, showtimes, version):
+        """Write the catalog hashes and, last, the version key in one transaction"""
+        pipe = self.r.pipeline(transaction=True)
+        for tid, tdat in theatres.items():
+            pipe.hset(f"theatre:{tid}", mapping=tdat)
+        for mid, mdat in movies.items():
+            pipe.hset(f"movie:{mid}", mapping=mdat)
+        for st in showtimes:
+            pipe.hset(f"showtime:{st['id']}", mapping={
+                "movie_id": st["movie_id"],
+                "theatre_id": st["theatre_id"],
+                "time": st["time"],
+                "technology": st["technology"],
+                "cancellable": "yes" if st["cancellable"] else "no"
+            })
+            # Legacy undated booking sets are no longer used
+            pipe.delete(f"showtime:{st['id']}:booked")
+        pipe.set(CATALOG_VERSION_KEY, version)
+        pipe.execute()
+
+    def booking_events(self, after='0', count=1000, block=None):
+        if len(self.nodes) > 1:
+            return super().booking_events(after, count, block)
+        # Blocking XREAD; every process appends to the same stream
+        reply = self.nodes[0].xread({BOOKING_STREAM_KEY: after}, count=count, block=int(block * 1000) if block else None)
+        return [self.booking_event_from(event_id, fields) for _, entries in reply for event_id, fields in entries]
+
+    def _events_after(self, after, count):
+        # Each node logs its own shows, so an offset is one stream id per node, comma-separated;
+        # entries are merged by time and each one's id is the offset right after it
+        offsets = after.split(',') if after != '0' else ['0'] * len(self.nodes)
+        if len(offsets) != len(self.nodes):
+            raise ValueError(f"Offset {after!r} is for {len(offsets)} nodes, not {len(self.nodes)}")
+        pending = []
+        for node, client in enumerate(self.nodes):
+            for _, entries in client.xread({BOOKING_STREAM_KEY: offsets[node]}, count=count):
+                pending += [(tuple(map(int, event_id.split('-'))), node, event_id, fields)
+                            for event_id, fields in entries]
+        events = []
+        for _, node, event_id, fields in sorted(pending, key=lambda entry: entry[:2])[:count]:
+            offsets[node] = event_id
+            events.append(self.booking_event_from(','.join(offsets), fields))
+        return events
+
+    def migrate_sets_to_bitmaps(self):
+        """Convert every date-partitioned seat set into a bitmap key"""
+        migrated, skipped = 0, 0
+        for client, raw in zip(self.nodes, self.nodes_raw):
+            for key in client.scan_iter(match='showtime:*:booked:*', count=500):
+                _, showtime_id, _, booking_date = key.split(':', 3)
+                labels = client.smembers(key)
+                pipe = raw.pipeline(transaction=True)
+                for label in labels:
+                    if label in SEAT_INDEX:
+                        pipe.setbit(seat_bitmap_key(showtime_id, booking_date), SEAT_INDEX[label], 1)
+                    else:
+                        skipped += 1
+                pipe.delete(key)
+                pipe.execute()
+                migrated += 1
+        return migrated, skipped
+
+    def events(self):
+        # Changes made by every process sharing these nodes, one subscriber thread per node
+        if len(self.nodes) == 1:
+            yield from self._node_events(self.nodes[0])
+            return
+        merged, stopped = queue.Queue(), threading.Event()
+
+        def forward(client):
+            try:
+                for event in self._node_events(client, stopped):
+                    merged.put(event)
+            except ConnectionError as e:
+                merged.put(e)
+
+        for client in self.nodes:
+            threading.Thread(target=forward, args=(client,), daemon=True).start()
+        try:
+            while True:
+                event = merged.get()
+                if isinstance(event, ConnectionError):
+                    raise event
+                yield event
+        finally:
+            stopped.set()
+
+    def _node_events(self, client, stopped=None):
+        """Seat changes published on one node, until `stopped` is set"""
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.psubscribe('showtime:*:events:*')
+            while stopped is None or not stopped.is_set():
+                message = pubsub.get_message(timeout=1.0)
+                if message:
+                    yield message['channel'], message['data']
+        except redis.ConnectionError as e:
+            raise ConnectionError(str(e)) from e
+        finally:
+            pubsub.close()
+
+class AsyncRedisSeatStore(RedisSeatKeys):
+    """asyncio twin of RedisSeatStore on redis.asyncio, running the same Lua
+    scripts against the same keys and shards. Requests beyond `max_connections`
+    wait for a free connection instead of failing."""
+
+    def __init__(self, url='redis://localhost:6379/0', storage='set', max_connections=100, shards=None, shard_key=None):
+        self.storage = storage
+
+        def connect(node_url):
+            return tuple(redis.asyncio.Redis(connection_pool=redis.asyncio.BlockingConnectionPool.from_url(
+                node_url, decode_responses=decode, max_connections=max_connections)) for decode in (True, False))
+        self.use_nodes(url, shards, shard_key, connect)
+        self.book_script = self.r.register_script(BOOK_SCRIPT)
+        self.booking_script = self.r.register_script(BOOKING_SCRIPT)
+        self.cancel_script = self.r.register_script(CANCEL_SCRIPT)
+        self.hold_script = self.r.register_script(HOLD_SCRIPT)
+        self.release_script = self.r.register_script(RELEASE_SCRIPT)
+        self.prebook_script = self.r.register_script(PREBOOK_SCRIPT)
+        self.unlock_script = self.r.register_script(UNLOCK_SCRIPT)
+
+    async def seat_state(self, showtime_id, booking_date, holder=None):
+        pipe = self.show_client(showtime_id, self.storage == 'bitmap').pipeline(transaction=False)
+        self.queue_seat_state(pipe, showtime_id, booking_date)
+        return self.seat_state_from(await pipe.execute(), holder)
+
+    async def version(self, showtime_id, booking_date):
+        return int(await self.show_client(showtime_id).get(seat_version_key(showtime_id, booking_date)) or 0)
+
+    async def prebook(self, showtime_id, booking_date):
+        keys, args = self.prebook_call(showtime_id, booking_date)
+        return bool(await self.prebook_script(keys=keys, args=args, client=self.show_client(showtime_id)))
+
+    async def book(self, showtime_id, booking_date, seats, holder=None):
+        args = self.script_head(booking_date) + [holder or ''] + self.script_args(seats)
+        return await self.book_script(keys=self.script_keys(showtime_id, booking_date), args=args,
+                                      client=self.show_client(showtime_id))
+
+    async def create_booking(self, showtime_id, booking_date, seats, holder=None, user=None,
+                             idempotency_key=None, idempotency_ttl=IDEMPOTENCY_TTL_SECONDS, prices=None):
+        keys, args, booking = self.booking_call(showtime_id, booking_date, seats, holder, user, prices)
+        claimed, marker = None, pending_marker(booking['booking_id'])
+        if idempotency_key:
+            client, key = self.nodes[self.node_for_key(idempotency_key)], idempotency_key_for(idempotency_key)
+            if await client.set(key, marker, nx=True, px=IDEMPOTENCY_PENDING_SECONDS * 1000):
+                claimed = client, key
+            else:
+                previous = await client.get(key)
+                if previous:
+                    return await self.get_booking(replayed_id(previous)), [], True
+        outcome = 'failed'
+        try:
+            outcome, *rest = await self.booking_script(keys=keys, args=args, client=self.show_client(showtime_id))
+        finally:
+            if claimed and outcome != 'booked':
+                await self.unlock_script(keys=[claimed[1]], args=[marker], client=claimed[0])
+        if outcome == 'conflict':
+            return None, rest, False
+        if claimed:
+            await claimed[0].set(claimed[1], booking['booking_id'], px=idempotency_ttl * 1000)
+        return booking, [], False
+
+    async def get_booking(self, booking_id):
+        return self.booking_from(await self.nodes[self.node_for_id(booking_id)].hgetall(booking_key(booking_id)))
+
+    async def user_bookings(self, user):
+        bookings = []
+        for client in self.nodes:
+            pipe = client.pipeline(transaction=False)
+            for booking_id in await client.zrange(user_bookings_key(user), 0, -1):
+                pipe.hgetall(booking_key(booking_id))
+            bookings += [booking for booking in map(self.booking_from, await pipe.execute()) if booking]
+        return sorted(bookings, key=lambda booking: booking['created_ms'])
+
+    async def get_bookings(self, booking_ids):
+        out = [None] * len(booking_ids)
+        for node, group in group_by_node(booking_ids, self.node_for_id).items():
+            pipe = self.nodes[node].pipeline(transaction=False)
+            for _, booking_id in group:
+                pipe.hgetall(booking_key(booking_id))
+            for (position, _), fields in zip(group, await pipe.execute()):
+                out[position] = self.booking_from(fields)
+        return out
+
+    async def cancel_bookings(self, booking_ids):
+        bookings = await self.get_bookings(booking_ids)
+        known = [booking for booking in bookings if booking]
+        now = now_ms()
+        replies = [None] * len(known)
+        for node, group in group_by_node(known, lambda booking: self.node_for_id(booking['booking_id'])).items():
+            pipe = self.nodes[node].pipeline(transaction=False)
+            for _, booking in group:
+                keys, args = self.cancel_call(booking, now)
+                await self.cancel_script(keys=keys, args=args, client=pipe)
+            for (position, _), reply in zip(group, await pipe.execute()):
+                replies[position] = reply
+        return self.cancellations_from(bookings, replies, now)
+
+    async def cancel_booking(self, booking_id):
+        return (await self.cancel_bookings([booking_id]))[0]
+
+    async def hold(self, showtime_id, booking_date, seats, holder, ttl):
+        keys, args = self.hold_call(showtime_id, booking_date, seats, holder, ttl)
+        return await self.hold_script(keys=keys, args=args, client=self.show_client(showtime_id))
+
+    async def release(self, showtime_id, booking_date, holder, seats=None):
+        args = self.script_head(booking_date) + [holder] + list(seats or [])
+        return await self.release_script(keys=self.script_keys(showtime_id, booking_date), args=args,
+                                         client=self.show_client(showtime_id))
+
+    async def counts(self, shows):
+        shows = list(shows)
+        out = [None] * len(shows)
+        for node, group in group_by_node(shows, lambda show: self.node_for_show(show[0])).items():
+            pipe = self.nodes[node].pipeline(transaction=False)
+            self.queue_counts(pipe, [show for _, show in group])
+            for (position, _), count in zip(group, self.counts_from(await pipe.execute())):
+                out[position] = count
+        return out
+
+    async def count(self, showtime_id, booking_date):
+        return (await self.counts([(showtime_id, booking_date)]))[0]
+
+    async def aclose(self):
+        await self.r.aclose()
+        await self.rb.aclose()
+        for client in self.nodes + self.nodes_raw:
+            if client is not self.r and client is not self.rb:
+                await client.aclose()
+
+class _Show:
+    """Seat state of one showtime and date inside MemorySeatStore"""
+    __slots__ = ('booked', 'holds', 'version', 'prebooked')
+
+    def __init__(self):
+        self.booked = set()
+        self.holds = {}  # seat label -> (holder, expiry ms)
+        self.version = 0
+        self.prebooked = False
+
+class MemorySeatStore(SeatStore):
+    """Seats in this process's memory, for single-node deployments, tests and
+    benchmarks. Each showtime and date is guarded by one of `stripes` locks, so
+    bookings for different shows rarely wait on each other."""
+
+    name = 'memory'
+
+    def __init__(self, stripes=64):
+        super().__init__()
+        self.shows = {}  # (showtime_id, date) -> _Show
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.bookings = {}  # booking id -> record
+        self.bookings_by_user = defaultdict(list)  # user -> booking ids, oldest first
+        self.idempotency = {}  # idempotency key -> (booking id, expiry ms)
+        self.waitlists = defaultdict(list)  # (showtime_id, date) -> waiting entry ids, first in line first
+        self.waitlist_entries = {}  # entry id -> entry
+        self.event_log = deque(maxlen=BOOKING_STREAM_MAXLEN)  # booking log entries, ids counting up from 1
+        self.event_seq = 0
+        self.records_lock = threading.Lock()
+
+    @contextmanager
+    def _show(self, showtime_id, booking_date):
+        """Lock a show's stripe and yield its state, creating it on first use"""
+        key = (showtime_id, booking_date)
+        with self.locks[hash(key) % len(self.locks)]:
+            show = self.shows.get(key)
+            if show is None:
+                show = self.shows[key] = _Show()
+            yield show
+
+    def _changed(self, show, showtime_id, booking_date, event, seats):
+        show.version += 1
+        self._publish(showtime_id, booking_date, show.version, event, seats)
+
+    def _log_event(self, event, showtime_id, booking_date, seats, ms, booking_id=None, holder=None, user=None,
+                   prices=None):
+        """Append to the booking log; the show's lock must be held so its events stay in order"""
+        with self.records_lock:
+            self.event_seq += 1
+            self.event_log.append(booking_event(self.event_seq, event, showtime_id, booking_date, seats, ms,
+                                                booking_id, holder, user, prices))
+
+    def _events_after(self, after, count):
+        with self.records_lock:
+            if not self.event_log:
+                return []
+            start = max(int(after) + 1 - int(self.event_log[0]['id']), 0)
+            return list(islice(self.event_log, start, start + count))
+
+    def _sweep(self, show, showtime_id, booking_date, now):
+        expired = [label for label, (_, expiry) in show.holds.items() if expiry <= now]
+        for label in expired:
+            del show.holds[label]
+        if expired:
+            self._changed(show, showtime_id, booking_date, 'released', expired)
+            self._log_event('expired', showtime_id, booking_date, expired, now)
+        return len(expired)
+
+    def _conflicts(self, show, seats, holder):
+        """Seats that are booked or held by someone else; holds must already be swept"""
+        return [seat for seat in seats if seat in show.booked or (seat in show.holds and show.holds[seat][0] != holder)]
+
+    def seat_state(self, showtime_id, booking_date, holder=None):
+        now = now_ms()
+        with self._show(showtime_id, booking_date) as show:
+            taken = show.booked.union(label for label, (owner, expiry) in show.holds.items()
+                                      if expiry > now and owner != holder)
+            return bits_from_labels(taken), show.version, show.prebooked
+
+    def version(self, showtime_id, booking_date):
+        with self._show(showtime_id, booking_date) as show:
+            return show.version
+
+    def prebook(self, showtime_id, booking_date):
+        with self._show(showtime_id, booking_date) as show:
+            if show.prebooked:
+                return False
+            show.prebooked = True
+            if show.booked:
+                return False
+            show.booked.update(prebook_sample(showtime_id, booking_date))
+            self._changed(show, showtime_id, booking_date, 'reset', [])
+            return True
+
+    def _book(self, show, showtime_id, booking_date, seats, holder, now):
+        """Book the seats unless some are taken; returns the conflicting labels"""
+        self._sweep(show, showtime_id, booking_date, now)
+        conflicts = self._conflicts(show, seats, holder or '')
+        if conflicts:
+            return conflicts
+        show.booked.update(seats)
+        converted = [seat for seat in seats if show.holds.pop(seat, None)]
+        self._changed(show, showtime_id, booking_date, 'booked', seats)
+        if converted:
+            self._log_event('converted', showtime_id, booking_date, converted, now, holder=holder)
+        return []
+
+    def book(self, showtime_id, booking_date, seats, holder=None):
+        with self._show(showtime_id, booking_date) as show:
+            return self._book(show, showtime_id, booking_date, seats, holder, now_ms())
+
+    def create_booking(self, showtime_id, booking_date, seats, holder=None, user=None,
+                       idempotency_key=None, idempotency_ttl=IDEMPOTENCY_TTL_SECONDS, prices=None):
+        now = now_ms()
+        if idempotency_key:
+            # Claim the key before taking the show's lock, so one key sent for two shows at once books once
+            with self.records_lock:
+                booking_id, expiry = self.idempotency.get(idempotency_key, (None, 0))
+                if expiry > now:
+                    if booking_id is None:
+                        raise BookingInProgress()
+                    return self.bookings.get(booking_id), [], True
+                self.idempotency[idempotency_key] = (None, now + idempotency_ttl * 1000)
+        with self._show(showtime_id, booking_date) as show:
+            try:
+                conflicts = self._book(show, showtime_id, booking_date, seats, holder, now)
+            except Exception:
+                self._unclaim(idempotency_key)
+                raise
+            if conflicts:
+                self._unclaim(idempotency_key)
+                return None, conflicts, False
+            booking = booking_record(new_booking_id(), showtime_id, booking_date, seats, holder, user, now,
+                                     prices=prices)
+            with self.records_lock:
+                self.bookings[booking['booking_id']] = booking
+                if user:
+                    self.bookings_by_user[user].append(booking['booking_id'])
+                if idempotency_key:
+                    self.idempotency[idempotency_key] = (booking['booking_id'], now + idempotency_ttl * 1000)
+            self._log_event('booked', showtime_id, booking_date, seats, now, booking['booking_id'], holder, user, prices)
+            return booking, [], False
+
+    def _unclaim(self, idempotency_key):
+        """Drop a key claimed for a booking that was not made, so a retry can book"""
+        if idempotency_key:
+            with self.records_lock:
+                if self.idempotency.get(idempotency_key, (None, 0))[0] is None:
+                    self.idempotency.pop(idempotency_key, None)
+
+    def get_booking(self, booking_id):
+        with self.records_lock:
+            return self.bookings.get(booking_id)
+
+    def user_bookings(self, user):
+        with self.records_lock:
+            return [self.bookings[booking_id] for booking_id in self.bookings_by_user.get(user, [])]
+
+    def cancel_bookings(self, booking_ids):
+        out = []
+        for booking_id in booking_ids:
+            booking = self.get_booking(booking_id)
+            if booking is None:
+                out.append((None, False))
+                continue
+            showtime_id, booking_date = booking['showtime_id'], booking['date']
+            with self._show(showtime_id, booking_date) as show:
+                with self.records_lock:
+                    booking = self.bookings[booking_id]
+                    if booking['status'] == 'cancelled':
+                        out.append((booking, False))
+                        continue
+                    booking = self.bookings[booking_id] = dict(booking, status='cancelled', cancelled_ms=now_ms())
+                show.booked.difference_update(booking['seats'])
+                self._changed(show, showtime_id, booking_date, 'cancelled', booking['seats'])
+                self._log_event('cancelled', showtime_id, booking_date, booking['seats'], booking['cancelled_ms'],
+                                booking_id, booking['holder'], booking['user'], booking['prices'])
+            out.append((booking, True))
+        return out
+
+    def bookings_on(self, booking_date):
+        with self.records_lock:
+            return [booking for booking in self.bookings.values() if booking['date'] == booking_date]
+
+    def purge_date(self, booking_date):
+        for key in [key for key in list(self.shows) if key[1] == booking_date]:
+            with self.locks[hash(key) % len(self.locks)]:
+                self.shows.pop(key, None)
+        with self.records_lock:
+            for key in [key for key in self.waitlists if key[1] == booking_date]:
+                del self.waitlists[key]
+            for entry_id in [entry_id for entry_id, entry in self.waitlist_entries.items()
+                             if entry['date'] == booking_date]:
+                del self.waitlist_entries[entry_id]
+            gone = {booking_id for booking_id, booking in self.bookings.items() if booking['date'] == booking_date}
+            for booking_id in gone:
+                del self.bookings[booking_id]
+            for user in list(self.bookings_by_user):
+                kept = [booking_id for booking_id in self.bookings_by_user[user] if booking_id not in gone]
+                if kept:
+                    self.bookings_by_user[user] = kept
+                else:
+                    del self.bookings_by_user[user]
+        return len(gone)
+
+    def _with_position(self, entry):
+        """An entry with its place in line; the records lock must be held"""
+        if entry is None or entry['status'] != 'waiting':
+            return entry
+        return dict(entry, position=self.waitlists[(entry['showtime_id'], entry['date'])].index(entry['entry_id']) + 1)
+
+    def join_waitlist(self, showtime_id, booking_date, party, holder, user=None):
+        entry = waitlist_record(new_waitlist_id(), showtime_id, booking_date, party, holder, user, now_ms())
+        with self.records_lock:
+            self.waitlist_entries[entry['entry_id']] = entry
+            self.waitlists[(showtime_id, booking_date)].append(entry['entry_id'])
+            return self._with_position(entry)
+
+    def waitlist_entry(self, entry_id):
+        with self.records_lock:
+            return self._with_position(self.waitlist_entries.get(entry_id))
+
+    def waitlist_head(self, showtime_id, booking_date):
+        with self.records_lock:
+            line = self.waitlists.get((showtime_id, booking_date))
+            return self._with_position(self.waitlist_entries[line[0]]) if line else None
+
+    def promote_waitlist_entry(self, entry_id, seats, hold_ttl):
+        with self.records_lock:
+            entry = self.waitlist_entries.get(entry_id)
+            if entry is None or entry['status'] != 'waiting':
+                return None
+            line = self.waitlists[(entry['showtime_id'], entry['date'])]
+            if line[0] != entry_id:
+                return None
+            line.pop(0)
+            entry = self.waitlist_entries[entry_id] = dict(
+                entry, status='promoted', seats=list(seats), hold_expires_ms=now_ms() + hold_ttl * 1000)
+            return entry
+
+    def leave_waitlist(self, entry_id):
+        with self.records_lock:
+            entry = self.waitlist_entries.get(entry_id)
+            if entry is None:
+                return None, False
+            if entry['status'] not in ('waiting', 'promoted'):
+                return entry, False
+            if entry['status'] == 'waiting':
+                self.waitlists[(entry['showtime_id'], entry['date'])].remove(entry_id)
+            entry = self.waitlist_entries[entry_id] = dict(entry, status='left', position=None)
+            return entry, True
+
+    def hold(self, showtime_id, booking_date, seats, holder, ttl):
+        now = now_ms()
+        with self._show(showtime_id, booking_date) as show:
+            self._sweep(show, showtime_id, booking_date, now)
+            conflicts = self._conflicts(show, seats, holder)
+            if conflicts:
+                return conflicts
+            fresh = [seat for seat in seats if seat not in show.holds]
+            for seat in seats:
+                show.holds[seat] = (holder, now + ttl * 1000)
+            self._changed(show, showtime_id, booking_date, 'held', seats)
+            if fresh:
+                self._log_event('held', showtime_id, booking_date, fresh, now, holder=holder)
+            return []
+
+    def release(self, showtime_id, booking_date, holder, seats=None):
+        now = now_ms()
+        with self._show(showtime_id, booking_date) as show:
+            self._sweep(show, showtime_id, booking_date, now)
+            candidates = seats or list(show.holds)
+            released = [seat for seat in candidates if seat in show.holds and show.holds[seat][0] == holder]
+            for seat in released:
+                del show.holds[seat]
+            if released:
+                self._changed(show, showtime_id, booking_date, 'released', released)
+                self._log_event('released', showtime_id, booking_date, released, now, holder=holder)
+            return released
+
+    def sweep_holds(self):
+        now = now_ms()
+        swept = 0
+        for showtime_id, booking_date in [key for key, show in list(self.shows.items()) if show.holds]:
+            with self._show(showtime_id, booking_date) as show:
+                swept += self._sweep(show, showtime_id, booking_date, now)
+        # Forget lapsed idempotency keys while we are at it
+        with self.records_lock:
+            for key in [key for key, (_, expiry) in self.idempotency.items() if expiry <= now]:
+                del self.idempotency[key]
+        return swept
+
+    def counts(self, shows):
+        now = now_ms()
+        out = []
+        for showtime_id, booking_date in shows:
+            with self._show(showtime_id, booking_date) as show:
+                held = sum(1 for _, expiry in show.holds.values() if expiry > now)
+                out.append(seat_counts_from(len(show.booked), held, show.prebooked))
+        return out
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS booked_seats (
+    showtime_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    seat TEXT NOT NULL,
+    PRIMARY KEY (showtime_id, date, seat)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS seat_holds (
+    showtime_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    seat TEXT NOT NULL,
+    holder TEXT NOT NULL,
+    expires_ms INTEGER NOT NULL,
+    PRIMARY KEY (showtime_id, date, seat)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seat_holds_expiry ON seat_holds (expires_ms);
+CREATE TABLE IF NOT EXISTS shows (
+    showtime_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    prebooked INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (showtime_id, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bookings (
+    booking_id TEXT PRIMARY KEY,
+    showtime_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    seats TEXT NOT NULL,
+    holder TEXT NOT NULL,
+    user TEXT NOT NULL,
+    created_ms INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'confirmed',
+    cancelled_ms INTEGER,
+    prices TEXT NOT NULL DEFAULT ''
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS bookings_by_user ON bookings (user, created_ms);
+CREATE INDEX IF NOT EXISTS bookings_by_date ON bookings (date);
+CREATE TABLE IF NOT EXISTS waitlist (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry_id TEXT NOT NULL UNIQUE,
+    showtime_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    party INTEGER NOT NULL,
+    holder TEXT NOT NULL,
+    user TEXT NOT NULL,
+    joined_ms INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'waiting',
+    seats TEXT NOT NULL DEFAULT '',
+    hold_expires_ms INTEGER
+);
+CREATE INDEX IF NOT EXISTS waitlist_queue ON waitlist (showtime_id, date, status, seq);
+CREATE TABLE IF NOT EXISTS booking_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event TEXT NOT NULL,
+    showtime_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    seats TEXT NOT NULL,
+    ms INTEGER NOT NULL,
+    booking_id TEXT NOT NULL DEFAULT '',
+    holder TEXT NOT NULL DEFAULT '',
+    user TEXT NOT NULL DEFAULT '',
+    prices TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    booking_id TEXT NOT NULL,
+    expires_ms INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+BOOKING_COLUMNS = "booking_id, showtime_id, date, seats, holder, user, created_ms, status, cancelled_ms, prices"
+
+WAITLIST_COLUMNS = "entry_id, showtime_id, date, party, holder, user, joined_ms, status, seats, hold_expires_ms"
+
+EVENT_COLUMNS = "seq, event, showtime_id, date, seats, ms, booking_id, holder, user, prices"
+
+def booking_from_row(row):
+    """Booking record from a bookings row, or None"""
+    if row is None:
+        return None
+    return booking_record(row[0], row[1], row[2], row[3].split(','), *row[4:9], prices_from_csv(row[9]))
+
+def waitlist_from_row(row, position=None):
+    """Waitlist entry from a waitlist row, or None"""
+    if row is None:
+        return None
+    return waitlist_record(*row[:8], row[8].split(',') if row[8] else [], row[9], position)
+
+def placeholders(values):
+    """"?, ?, ..." for an IN clause over `values`"""
+    return ', '.join('?' * len(values))
+
+class SqliteSeatStore(SeatStore):
+    """Seats in a SQLite file (WAL mode), so bookings survive restarts without a
+    Redis server. Writers are serialized by BEGIN IMMEDIATE transactions; seat
+    events only reach listeners in the process that made the change."""
+
+    name = 'sqlite'
+
+    def __init__(self, path='seats.db'):
+        super().__init__()
+        self.path = path
+        self.local = threading.local()
+        conn = self._conn()
+        conn.executescript(SQLITE_SCHEMA)
+        # Files created before cancellations existed lack the status columns
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(bookings)")}
+        if 'status' not in columns:
+            conn.execute("ALTER TABLE bookings ADD COLUMN status TEXT NOT NULL DEFAULT 'confirmed'")
+            conn.execute("ALTER TABLE bookings ADD COLUMN cancelled_ms INTEGER")
+        # ...and files created before seat prices were recorded lack prices, on bookings and in the log
+        if 'prices' not in columns:
+            conn.execute("ALTER TABLE bookings ADD COLUMN prices TEXT NOT NULL DEFAULT ''")
+        if 'prices' not in {row[1] for row in conn.execute("PRAGMA table_info(booking_events)")}:
+            conn.execute("ALTER TABLE booking_events ADD COLUMN prices TEXT NOT NULL DEFAULT ''")
+
+    def _conn(self):
+        """This thread's connection, in autocommit mode so transactions are explicit"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self, mode='IMMEDIATE'):
+        conn = self._conn()
+        conn.execute(f'BEGIN {mode}')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _changed(self, conn, showtime_id, booking_date, event, seats):
+        conn.execute("INSERT INTO shows (showtime_id, date, version) VALUES (?, ?, 1) "
+                     "ON CONFLICT (showtime_id, date) DO UPDATE SET version = version + 1",
+                     (showtime_id, booking_date))
+        version = self._version(conn, showtime_id, booking_date)
+        # Published before COMMIT, while the write lock keeps versions in order
+        self._publish(showtime_id, booking_date, version, event, seats)
+
+    def _version(self, conn, showtime_id, booking_date):
+        row = conn.execute("SELECT version FROM shows WHERE showtime_id = ? AND date = ?",
+                           (showtime_id, booking_date)).fetchone()
+        return row[0] if row else 0
+
+    def _log_event(self, conn, event, showtime_id, booking_date, seats, ms, booking_id=None, holder=None, user=None,
+                   prices=None):
+        conn.execute("INSERT INTO booking_events (event, showtime_id, date, seats, ms, booking_id, holder, user, prices) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (event, showtime_id, booking_date, ','.join(seats), ms, booking_id or '', holder or '', user or '',
+                      prices_csv(prices)))
+
+    def _events_after(self, after, count):
+        rows = self._conn().execute(f"SELECT {EVENT_COLUMNS} FROM booking_events WHERE seq > ? ORDER BY seq LIMIT ?",
+                                    (int(after), count))
+        return [booking_event(row[0], row[1], row[2], row[3], row[4].split(',') if row[4] else [], *row[5:9],
+                              prices_from_csv(row[9]))
+                for row in rows]
+
+    def _sweep(self, conn, showtime_id, booking_date, now):
+        expired = [row[0] for row in conn.execute(
+            "SELECT seat FROM seat_holds WHERE showtime_id = ? AND date = ? AND expires_ms <= ?",
+            (showtime_id, booking_date, now))]
+        if expired:
+            conn.execute("DELETE FROM seat_holds WHERE showtime_id = ? AND date = ? AND expires_ms <= ?",
+                         (showtime_id, booking_date, now))
+            self._changed(conn, showtime_id, booking_date, 'released', expired)
+            self._log_event(conn, 'expired', showtime_id, booking_date, expired, now)
+        return len(expired)
+
+    def _conflicts(self, conn, showtime_id, booking_date, seats, holder):
+        """Seats that are booked or held by someone else; holds must already be swept"""
+        marks = placeholders(seats)
+        taken = {row[0] for row in conn.execute(
+            f"SELECT seat FROM booked_seats WHERE showtime_id = ? AND date = ? AND seat IN ({marks})",
+            (showtime_id, booking_date, *seats))}
+        taken.update(row[0] for row in conn.execute(
+            f"SELECT seat FROM seat_holds WHERE showtime_id = ? AND date = ? AND holder <> ? AND seat IN ({marks})",
+            (showtime_id, booking_date, holder, *seats)))
+        return [seat for seat in seats if seat in taken]
+
+    def seat_state(self, showtime_id, booking_date, holder=None):
+        with self._transaction('DEFERRED') as conn:
+            taken = {row[0] for row in conn.execute(
+                "SELECT seat FROM booked_seats WHERE showtime_id = ? AND date = ?", (showtime_id, booking_date))}
+            taken.update(row[0] for row in conn.execute(
+                "SELECT seat FROM seat_holds WHERE showtime_id = ? AND date = ? AND expires_ms > ? AND holder <> ?",
+                (showtime_id, booking_date, now_ms(), holder or '')))
+            row = conn.execute("SELECT version, prebooked FROM shows WHERE showtime_id = ? AND date = ?",
+                               (showtime_id, booking_date)).fetchone()
+        version, prebooked = row or (0, 0)
+        return bits_from_labels(taken), version, bool(prebooked)
+
+    def version(self, showtime_id, booking_date):
+        return self._version(self._conn(), showtime_id, booking_date)
+
+    def _prebook(self, conn, showtime_id, booking_date):
+        row = conn.execute("SELECT prebooked FROM shows WHERE showtime_id = ? AND date = ?",
+                           (showtime_id, booking_date)).fetchone()
+        if row and row[0]:
+            return False
+        conn.execute("INSERT INTO shows (showtime_id, date, prebooked) VALUES (?, ?, 1) "
+                     "ON CONFLICT (showtime_id, date) DO UPDATE SET prebooked = 1",
+                     (showtime_id, booking_date))
+        if conn.execute("SELECT 1 FROM booked_seats WHERE showtime_id = ? AND date = ? LIMIT 1",
+                        (showtime_id, booking_date)).fetchone():
+            return False
+        conn.executemany("INSERT INTO booked_seats (showtime_id, date, seat) VALUES (?, ?, ?)",
+                         [(showtime_id, booking_date, seat) for seat in prebook_sample(showtime_id, booking_date)])
+        self._changed(conn, showtime_id, booking_date, 'reset', [])
+        return True
+
+    def prebook(self, showtime_id, booking_date):
+        with self._transaction() as conn:
+            return self._prebook(conn, showtime_id, booking_date)
+
+    def warm(self, shows):
+        # One transaction for the whole batch
+        with self._transaction() as conn:
+            return sum(1 for showtime_id, booking_date in shows if self._prebook(conn, showtime_id, booking_date))
+
+    def _book(self, conn, showtime_id, booking_date, seats, holder, now):
+        """Book the seats unless some are taken; returns the conflicting labels"""
+        self._sweep(conn, showtime_id, booking_date, now)
+        conflicts = self._conflicts(conn, showtime_id, booking_date, seats, holder or '')
+        if conflicts:
+            return conflicts
+        conn.executemany("INSERT OR IGNORE INTO booked_seats (showtime_id, date, seat) VALUES (?, ?, ?)",
+                         [(showtime_id, booking_date, seat) for seat in seats])
+        converted = [row[0] for row in conn.execute(
+            f"SELECT seat FROM seat_holds WHERE showtime_id = ? AND date = ? AND seat IN ({placeholders(seats)})",
+            (showtime_id, booking_date, *seats))]
+        conn.execute(f"DELETE FROM seat_holds WHERE showtime_id = ? AND date = ? AND seat IN ({placeholders(seats)})",
+                     (showtime_id, booking_date, *seats))
+        self._changed(conn, showtime_id, booking_date, 'booked', seats)
+        if converted:
+            self._log_event(conn, 'converted', showtime_id, booking_date, converted, now, holder=holder)
+        return []
+
+    def book(self, showtime_id, booking_date, seats, holder=None):
+        with self._transaction() as conn:
+            return self._book(conn, showtime_id, booking_date, seats, holder, now_ms())
+
+    def create_booking(self, showtime_id, booking_date, seats, holder=None, user=None,
+                       idempotency_key=None, idempotency_ttl=IDEMPOTENCY_TTL_SECONDS, prices=None):
+        now = now_ms()
+        with self._transaction() as conn:
+            if idempotency_key:
+                row = conn.execute(f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE booking_id = "
+                                   "(SELECT booking_id FROM idempotency_keys WHERE key = ? AND expires_ms > ?)",
+                                   (idempotency_key, now)).fetchone()
+                if row:
+                    return booking_from_row(row), [], True
+            conflicts = self._book(conn, showtime_id, booking_date, seats, holder, now)
+            if conflicts:
+                return None, conflicts, False
+            booking = booking_record(new_booking_id(), showtime_id, booking_date, seats, holder, user, now,
+                                     prices=prices)
+            conn.execute("INSERT INTO bookings (booking_id, showtime_id, date, seats, holder, user, created_ms, prices) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (booking['booking_id'], showtime_id, booking_date, ','.join(seats),
+                          holder or '', user or '', now, prices_csv(prices)))
+            if idempotency_key:
+                conn.execute("INSERT OR REPLACE INTO idempotency_keys (key, booking_id, expires_ms) VALUES (?, ?, ?)",
+                             (idempotency_key, booking['booking_id'], now + idempotency_ttl * 1000))
+            self._log_event(conn, 'booked', showtime_id, booking_date, seats, now, booking['booking_id'], holder, user,
+                            prices)
+            return booking, [], False
+
+    def get_booking(self, booking_id):
+        return booking_from_row(self._conn().execute(
+            f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE booking_id = ?", (booking_id,)).fetchone())
+
+    def user_bookings(self, user):
+        rows = self._conn().execute(
+            f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE user = ? ORDER BY created_ms", (user,))
+        return [booking_from_row(row) for row in rows]
+
+    def cancel_bookings(self, booking_ids):
+        out = []
+        for booking_id in booking_ids:
+            with self._transaction() as conn:
+                booking = booking_from_row(conn.execute(
+                    f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE booking_id = ?", (booking_id,)).fetchone())
+                if booking is None or booking['status'] == 'cancelled':
+                    out.append((booking, False))
+                    continue
+                showtime_id, booking_date, seats = booking['showtime_id'], booking['date'], booking['seats']
+                booking = dict(booking, status='cancelled', cancelled_ms=now_ms())
+                conn.execute("UPDATE bookings SET status = 'cancelled', cancelled_ms = ? WHERE booking_id = ?",
+                             (booking['cancelled_ms'], booking_id))
+                conn.execute(f"DELETE FROM booked_seats WHERE showtime_id = ? AND date = ? AND seat IN ({placeholders(seats)})",
+                             (showtime_id, booking_date, *seats))
+                self._changed(conn, showtime_id, booking_date, 'cancelled', seats)
+                self._log_event(conn, 'cancelled', showtime_id, booking_date, seats, booking['cancelled_ms'],
+                                booking_id, booking['holder'], booking['user'], booking['prices'])
+            out.append((booking, True))
+        return out
+
+    def bookings_on(self, booking_date):
+        rows = self._conn().execute(
+            f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE date = ? ORDER BY created_ms", (booking_date,))
+        return [booking_from_row(row) for row in rows]
+
+    def purge_date(self, booking_date):
+        with self._transaction() as conn:
+            for table in ('booked_seats', 'seat_holds', 'shows', 'waitlist'):
+                conn.execute(f"DELETE FROM {table} WHERE date = ?", (booking_date,))
+            return conn.execute("DELETE FROM bookings WHERE date = ?", (booking_date,)).rowcount
+
+    def _waitlist_position(self, conn, entry):
+        """An entry with its place in line"""
+        if entry is None or entry['status'] != 'waiting':
+            return entry
+        ahead = conn.execute("SELECT COUNT(*) FROM waitlist WHERE showtime_id = ? AND date = ? AND status = 'waiting' "
+                             "AND seq < (SELECT seq FROM waitlist WHERE entry_id = ?)",
+                             (entry['showtime_id'], entry['date'], entry['entry_id'])).fetchone()[0]
+        return dict(entry, position=ahead + 1)
+
+    def join_waitlist(self, showtime_id, booking_date, party, holder, user=None):
+        entry = waitlist_record(new_waitlist_id(), showtime_id, booking_date, party, holder, user, now_ms())
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO waitlist (entry_id, showtime_id, date, party, holder, user, joined_ms) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (entry['entry_id'], showtime_id, booking_date, entry['party'], holder, user or '',
+                          entry['joined_ms']))
+            return self._waitlist_position(conn, entry)
+
+    def waitlist_entry(self, entry_id):
+        conn = self._conn()
+        return self._waitlist_position(conn, waitlist_from_row(conn.execute(
+            f"SELECT {WAITLIST_COLUMNS} FROM waitlist WHERE entry_id = ?", (entry_id,)).fetchone()))
+
+    def waitlist_head(self, showtime_id, booking_date):
+        return waitlist_from_row(self._conn().execute(
+            f"SELECT {WAITLIST_COLUMNS} FROM waitlist WHERE showtime_id = ? AND date = ? AND status = 'waiting' "
+            "ORDER BY seq LIMIT 1", (showtime_id, booking_date)).fetchone(), 1)
+
+    def promote_waitlist_entry(self, entry_id, seats, hold_ttl):
+        with self._transaction() as conn:
+            entry = waitlist_from_row(conn.execute(
+                f"SELECT {WAITLIST_COLUMNS} FROM waitlist WHERE entry_id = ?", (entry_id,)).fetchone())
+            if entry is None or entry['status'] != 'waiting':
+                return None
+            if self._waitlist_position(conn, entry)['position'] != 1:
+                return None
+            expires = now_ms() + hold_ttl * 1000
+            conn.execute("UPDATE waitlist SET status = 'promoted', seats = ?, hold_expires_ms = ? WHERE entry_id = ?",
+                         (','.join(seats), expires, entry_id))
+            return dict(entry, status='promoted', seats=list(seats), hold_expires_ms=expires)
+
+    def leave_waitlist(self, entry_id):
+        with self._transaction() as conn:
+            entry = waitlist_from_row(conn.execute(
+                f"SELECT {WAITLIST_COLUMNS} FROM waitlist WHERE entry_id = ?", (entry_id,)).fetchone())
+            if entry is None or entry['status'] not in ('waiting', 'promoted'):
+                return entry, False
+            conn.execute("UPDATE waitlist SET status = 'left' WHERE entry_id = ?", (entry_id,))
+            return dict(entry, status='left', position=None), True
+
+    def hold(self, showtime_id, booking_date, seats, holder, ttl):
+        now = now_ms()
+        with self._transaction() as conn:
+            self._sweep(conn, showtime_id, booking_date, now)
+            conflicts = self._conflicts(conn, showtime_id, booking_date, seats, holder)
+            if conflicts:
+                return conflicts
+            already = {row[0] for row in conn.execute(
+                f"SELECT seat FROM seat_holds WHERE showtime_id = ? AND date = ? AND seat IN ({placeholders(seats)})",
+                (showtime_id, booking_date, *seats))}
+            fresh = [seat for seat in seats if seat not in already]
+            conn.executemany("INSERT OR REPLACE INTO seat_holds (showtime_id, date, seat, holder, expires_ms) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             [(showtime_id, booking_date, seat, holder, now + ttl * 1000) for seat in seats])
+            self._changed(conn, showtime_id, booking_date, 'held', seats)
+            if fresh:
+                self._log_event(conn, 'held', showtime_id, booking_date, fresh, now, holder=holder)
+            return []
+
+    def release(self, showtime_id, booking_date, holder, seats=None):
+        now = now_ms()
+        with self._transaction() as conn:
+            self._sweep(conn, showtime_id, booking_date, now)
+            held = [row[0] for row in conn.execute(
+                "SELECT seat FROM seat_holds WHERE showtime_id = ? AND date = ? AND holder = ?",
+                (showtime_id, booking_date, holder))]
+            released = [seat for seat in seats if seat in held] if seats else held
+            if released:
+                conn.execute(f"DELETE FROM seat_holds WHERE showtime_id = ? AND date = ? AND seat IN ({placeholders(released)})",
+                             (showtime_id, booking_date, *released))
+                self._changed(conn, showtime_id, booking_date, 'released', released)
+                self._log_event(conn, 'released', showtime_id, booking_date, released, now, holder=holder)
+            return released
+
+    def sweep_holds(self):
+        now = now_ms()
+        with self._transaction() as conn:
+            lapsed = conn.execute("SELECT DISTINCT showtime_id, date FROM seat_holds WHERE expires_ms <= ?",
+                                  (now,)).fetchall()
+            conn.execute("DELETE FROM idempotency_keys WHERE expires_ms <= ?", (now,))
+            return sum(self._sweep(conn, showtime_id, booking_date, now) for showtime_id, booking_date in lapsed)
+
+    def counts(self, shows):
+        shows = list(shows)
+        if not shows:
+            return []
+        ids = sorted({showtime_id for showtime_id, _ in shows})
+        dates = sorted({booking_date for _, booking_date in shows})
+        scope = f"showtime_id IN ({placeholders(ids)}) AND date IN ({placeholders(dates)})"
+        with self._transaction('DEFERRED') as conn:
+            booked = {(sid, d): n for sid, d, n in conn.execute(
+                f"SELECT showtime_id, date, COUNT(*) FROM booked_seats WHERE {scope} GROUP BY showtime_id, date",
+                (*ids, *dates))}
+            held = {(sid, d): n for sid, d, n in conn.execute(
+                f"SELECT showtime_id, date, COUNT(*) FROM seat_holds WHERE {scope} AND expires_ms > ? "
+                "GROUP BY showtime_id, date", (*ids, *dates, now_ms()))}
+            prebooked = {(sid, d) for sid, d in conn.execute(
+                f"SELECT showtime_id, date FROM shows WHERE {scope} AND prebooked = 1", (*ids, *dates))}
+        return [seat_counts_from(booked.get(key, 0), held.get(key, 0), key in prebooked) for key in shows]
+
+def create_store(backend, redis_url='redis://localhost:6379/0', storage='set', sqlite_path='seats.db',
+                 shards=None, shard_key=None):
+    """Build the seat store named by `backend` ("redis", "memory" or "sqlite"); Redis
+    seats are spread over the `shards` URLs when there are several"""
+    if backend == 'redis':
+        return RedisSeatStore(redis_url, storage=storage, shards=shards, shard_key=shard_key)
+    if backend == 'memory':
+        return MemorySeatStore()
+    if backend == 'sqlite':
+        return SqliteSeatStore(sqlite_path)
+    raise ValueError(f"Unknown seat store {backend!r}; expected redis, memory or sqlite")
+
+class AsyncStoreAdapter:
+    """Awaitable front for an in-process store: each call runs in a worker thread"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+    async def aclose(self):
+        pass
+
+def async_store_for(store, max_connections=100):
+    """asyncio counterpart of a seat store: redis.asyncio for Redis, worker threads otherwise"""
+    if isinstance(store, RedisSeatStore):
+        return AsyncRedisSeatStore(store.url, storage=store.storage, max_connections=max_connections,
+                                   shards=store.shard_urls, shard_key=store.shard_key)
+    return AsyncStoreAdapter(store)
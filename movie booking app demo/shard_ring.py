@@ -0,0 +1,28 @@
+"""Consistent hashing of shard keys onto Redis nodes.
+
+Each node gets `replicas` points on a 64-bit ring, placed by hashing its
+name; a key belongs to the node of the first point at or after the key's own
+hash. Adding or removing a node only moves the keys next to its points,
+about 1/N of them, where `hash % N` would move nearly all of them.
+"""
+import hashlib
+from bisect import bisect
+
+def ring_hash(value):
+    """Position of a string on the ring"""
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+class HashRing:
+    """Maps keys to node indexes into `names`; names (the node URLs) place the points,
+    so a node keeps its keys whatever position it is listed at"""
+
+    def __init__(self, names, replicas=160):
+        points = sorted((ring_hash(f"{name}#{i}"), node) for node, name in enumerate(names) for i in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+        self.size = len(names)
+
+    def node_for(self, key):
+        if self.size == 1:
+            return 0
+        return self.nodes[bisect(self.hashes, ring_hash(str(key))) % len(self.hashes)]
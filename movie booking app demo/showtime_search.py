@@ -0,0 +1,110 @@
+"""Inverted indexes over the static showtime catalog for /search/showtimes.
+
+Every showtime gets a bit position, in start-time order. Each facet value
+(location, theatre, movie, technology) maps to an int bitmask of its shows,
+and start times and base prices keep cumulative masks in sorted order, so a
+query is a handful of ANDs over precomputed masks and the matches are read
+off the set bits already sorted by start time.
+"""
+from bisect import bisect_left
+
+# Named time-of-day windows as [start, end) minutes after midnight; night wraps past midnight
+TIME_WINDOWS = {
+    'morning': (6 * 60, 12 * 60),
+    'afternoon': (12 * 60, 17 * 60),
+    'evening': (17 * 60, 21 * 60),
+    'night': (21 * 60, 6 * 60),
+}
+
+# Named price bands over the catalog (base) price as [low, high) rupees
+PRICE_BANDS = {
+    'budget': (0, 175),
+    'standard': (175, 250),
+    'premium': (250, None),
+}
+
+def minutes_of(show_time):
+    """Minutes after midnight for a catalog time like "09:10 AM" """
+    clock, meridiem = show_time.split()
+    hour, minute = (int(part) for part in clock.split(':'))
+    hour = hour % 12 + (12 if meridiem.upper() == 'PM' else 0)
+    return hour * 60 + minute
+
+def parse_clock(value):
+    """Minutes after midnight for a 24-hour "HH:MM"; raises ValueError"""
+    hour, _, minute = value.partition(':')
+    hour, minute = int(hour), int(minute or 0)
+    if not (0 <= hour <= 24 and 0 <= minute < 60) or hour * 60 + minute > 24 * 60:
+        raise ValueError(f"Invalid time {value!r}, expected HH:MM")
+    return hour * 60 + minute
+
+class RangeIndex:
+    """Bitmasks of the shows whose value falls in a range, from cumulative masks over the sorted values"""
+
+    def __init__(self, values):
+        by_value = {}
+        for bit, value in enumerate(values):
+            by_value[value] = by_value.get(value, 0) | (1 << bit)
+        self.keys = sorted(by_value)
+        self.below = [0]  # below[i]: shows whose value is smaller than keys[i]
+        for key in self.keys:
+            self.below.append(self.below[-1] | by_value[key])
+
+    def between(self, low=None, high=None):
+        """Shows with low <= value < high; either bound may be None"""
+        upper = self.below[bisect_left(self.keys, high) if high is not None else len(self.keys)]
+        lower = self.below[bisect_left(self.keys, low)] if low is not None else 0
+        return upper & ~lower
+
+class ShowtimeSearchIndex:
+    """Facet and range indexes over every showtime, built once at boot"""
+
+    def __init__(self, showtimes, theatres, base_prices):
+        self.showtimes = sorted(showtimes, key=lambda st: (minutes_of(st["time"]), int(st["theatre_id"]), st["movie_id"]))
+        self.ids = [st["id"] for st in self.showtimes]
+        self.all = (1 << len(self.showtimes)) - 1
+        self.facets = {'location': {}, 'theatre_id': {}, 'movie_id': {}, 'technology': {}}
+        for bit, st in enumerate(self.showtimes):
+            values = {
+                'location': theatres[st["theatre_id"]]["location"].lower(),
+                'theatre_id': st["theatre_id"],
+                'movie_id': st["movie_id"],
+                'technology': st["technology"].upper(),
+            }
+            for facet, value in values.items():
+                index = self.facets[facet]
+                index[value] = index.get(value, 0) | (1 << bit)
+        self.start = RangeIndex([minutes_of(st["time"]) for st in self.showtimes])
+        self.price = RangeIndex([base_prices[st["id"]] for st in self.showtimes])
+
+    def facet(self, name, values):
+        """Shows matching any of the values of one facet (all shows when there are none)"""
+        if not values:
+            return self.all
+        mask = 0
+        for value in values:
+            mask |= self.facets[name].get(value, 0)
+        return mask
+
+    def window(self, start, end):
+        """Shows starting in [start, end) minutes; a window with end <= start wraps past midnight"""
+        if end > start:
+            return self.start.between(start, end)
+        return self.start.between(start, None) | self.start.between(None, end)
+
+    def search(self, locations=(), theatre_ids=(), movie_ids=(), technologies=(), price_range=None, time_range=None):
+        """Showtime ids matching every given filter, by start time"""
+        mask = (self.facet('location', [location.lower() for location in locations])
+                & self.facet('theatre_id', theatre_ids)
+                & self.facet('movie_id', movie_ids)
+                & self.facet('technology', [tech.upper() for tech in technologies]))
+        if price_range is not None:
+            mask &= self.price.between(*price_range)
+        if time_range is not None:
+            mask &= self.window(*time_range)
+        ids = []
+        while mask:
+            low = mask & -mask
+            ids.append(self.ids[low.bit_length() - 1])
+            mask ^= low
+        return ids
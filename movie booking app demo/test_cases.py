@@ -2,7 +2,30 @@ import unittest
 import requests
 import json
 import os
-from datetime import datetime
+import asyncio
+import gzip
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+from datetime import datetime, timedelta
+import redis
+from seat_store import (
+    MemorySeatStore, SqliteSeatStore, RedisSeatStore, PREBOOK_COUNT, SEAT_LABELS,
+    CATALOG_VERSION_KEY, CATALOG_SEED_LOCK_KEY, BookingInProgress, idempotency_key_for, new_booking_id,
+    new_waitlist_id, now_ms, pending_marker, seat_version_key, seat_events_channel
+)
+from shard_ring import HashRing
+from seat_allocator import FreeRunIndex, seat_segment
+from booking_archive import archive_past_dates, read_archive
+from booking_views import LocalBookingViews, catch_up, movie_view_key, theatre_view_key
+from pricing import PRICE_TIERS, OCCUPANCY_BANDS, PriceBook, occupancy_band, price_table
+from rate_limit import LocalRateLimiter, RedisRateLimiter
+import cinebook
+from cinebook import booking_outcome, load_rate_limits
+from seat_rush import HttpClient, run_rush, free_seats as free_seat_labels
+import asgi_app
 
 class TestCineBookAPI(unittest.TestCase):
     """Test cases for CineBook movie booking application"""
@@ -50,6 +73,22 @@ class TestCineBookAPI(unittest.TestCase):
             self.assertIn("price", data[0])
             self.assertIn("showtime_id", data[0])
     
+    def test_get_showtimes_for_movie(self):
+        """Test filtering showtimes by movie"""
+        response = requests.get(f"{self.BASE_URL}/showtimes/1", params={"movie_id": "201"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data), 12)
+        self.assertTrue(all(s["movie_id"] == "201" for s in data))
+    
+    def test_showtimes_etag_revalidation(self):
+        """Test that a repeat poll with the ETag returns 304"""
+        response = requests.get(f"{self.BASE_URL}/showtimes/1")
+        etag = response.headers.get("ETag")
+        self.assertIsNotNone(etag)
+        response = requests.get(f"{self.BASE_URL}/showtimes/1", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+    
     def test_get_seatmap(self):
         """Test fetching seat map"""
         response = requests.get(f"{self.BASE_URL}/seatmap/{self.test_showtime_id}")
@@ -57,6 +96,66 @@ class TestCineBookAPI(unittest.TestCase):
         data = response.json()
         self.assertIsInstance(data, list)
     
+    def test_get_occupancy(self):
+        """Test seat counts for a showtime"""
+        requests.get(f"{self.BASE_URL}/seatmap/{self.test_showtime_id}", params={"date": self.test_date})
+        response = requests.get(f"{self.BASE_URL}/occupancy/{self.test_showtime_id}", params={"date": self.test_date})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertGreater(data["booked"], 0)
+        self.assertEqual(data["total"], 392)
+    
+    def test_get_seatmap_layout(self):
+        """Test fetching the cacheable hall layout"""
+        response = requests.get(f"{self.BASE_URL}/seatmap/layout")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["rows"]), 14)
+        self.assertEqual(data["seats_per_row"], 28)
+        self.assertIn("immutable", response.headers.get("Cache-Control", ""))
+    
+    def test_get_seatmap_compact(self):
+        """Test that the compact seat map matches the full one"""
+        params = {"date": self.test_date}
+        full = requests.get(f"{self.BASE_URL}/seatmap/{self.test_showtime_id}", params=params).json()
+        compact = requests.get(f"{self.BASE_URL}/seatmap/{self.test_showtime_id}",
+                               params={**params, "format": "compact"}).json()
+        self.assertIn("version", compact)
+        self.assertEqual(len(compact["rows"]), len(full))
+        for row_obj, bits in zip(full, compact["rows"]):
+            expected = "".join("1" if seat["booked"] else "0" for block in row_obj["blocks"] for seat in block)
+            self.assertEqual(bits, expected)
+    
+    def test_get_availability(self):
+        """Test free-seat counts per showtime and date"""
+        response = requests.get(f"{self.BASE_URL}/availability",
+                                params={"theatre_id": "1", "movie_id": "201", "days": 3})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["dates"]), 3)
+        self.assertEqual(len(data["showtimes"]), 12)
+        for show in data["showtimes"]:
+            self.assertEqual(set(show["free"]), set(data["dates"]))
+            self.assertTrue(all(0 <= free <= data["total"] for free in show["free"].values()))
+    
+    def test_availability_reflects_booking(self):
+        """Test that a booking is visible in availability right away"""
+        date = datetime.now().strftime('%Y-%m-%d')
+        params = {"theatre_id": "1", "movie_id": "202", "days": 1}
+        before = requests.get(f"{self.BASE_URL}/availability", params=params).json()
+        show = before["showtimes"][0]
+        seat_map = requests.get(f"{self.BASE_URL}/seatmap/{show['showtime_id']}", params={"date": date}).json()
+        free = [seat["label"] for row in seat_map for block in row["blocks"] for seat in block if not seat["booked"]]
+        requests.post(f"{self.BASE_URL}/book/batch",
+                      json={"showtime_id": show["showtime_id"], "seats": free[:2], "date": date})
+        after = requests.get(f"{self.BASE_URL}/availability", params=params).json()
+        self.assertEqual(after["showtimes"][0]["free"][date], show["free"][date] - 2)
+    
+    def test_availability_requires_theatre(self):
+        """Test availability validation"""
+        response = requests.get(f"{self.BASE_URL}/availability")
+        self.assertEqual(response.status_code, 400)
+    
     # Booking Tests
     def test_book_seat_success(self):
         """Test successful seat booking"""
@@ -91,6 +190,961 @@ class TestCineBookAPI(unittest.TestCase):
         payload = {"showtime_id": ""}
         response = requests.post(f"{self.BASE_URL}/book", json=payload)
         self.assertEqual(response.status_code, 400)
+    
+    def test_book_batch_success(self):
+        """Test booking several seats in one request"""
+        stamp = datetime.now().strftime('%H%M%S%f')
+        payload = {
+            "showtime_id": self.test_showtime_id,
+            "seats": [f"B1{stamp}", f"B2{stamp}"],
+            "date": self.test_date
+        }
+        response = requests.post(f"{self.BASE_URL}/book/batch", json=payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["seats"], payload["seats"])
+    
+    def test_book_batch_conflict_is_all_or_nothing(self):
+        """Test that a conflicting batch books none of its seats"""
+        stamp = datetime.now().strftime('%H%M%S%f')
+        taken, free = f"C1{stamp}", f"C2{stamp}"
+        requests.post(f"{self.BASE_URL}/book", json={
+            "showtime_id": self.test_showtime_id, "seat": taken, "date": self.test_date
+        })
+        response = requests.post(f"{self.BASE_URL}/book/batch", json={
+            "showtime_id": self.test_showtime_id, "seats": [taken, free], "date": self.test_date
+        })
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["conflicts"], [taken])
+        # The free seat must still be bookable
+        response = requests.post(f"{self.BASE_URL}/book", json={
+            "showtime_id": self.test_showtime_id, "seat": free, "date": self.test_date
+        })
+        self.assertEqual(response.status_code, 200)
+    
+    def test_book_batch_invalid_data(self):
+        """Test batch booking without seats"""
+        response = requests.post(f"{self.BASE_URL}/book/batch", json={"showtime_id": "1", "seats": []})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_booking_record_lookup(self):
+        """Test that bookings get server ids and can be found by id and by user"""
+        stamp = datetime.now().strftime('%H%M%S%f')
+        user = f"user-{stamp}"
+        response = requests.post(f"{self.BASE_URL}/book/batch", json={
+            "showtime_id": self.test_showtime_id, "seats": [f"R1{stamp}", f"R2{stamp}"],
+            "date": self.test_date, "user": user
+        })
+        self.assertEqual(response.status_code, 200)
+        booking_id = response.json()["booking_id"]
+        booking = requests.get(f"{self.BASE_URL}/bookings/{booking_id}").json()
+        self.assertEqual(booking["seats"], [f"R1{stamp}", f"R2{stamp}"])
+        self.assertEqual(booking["user"], user)
+        mine = requests.get(f"{self.BASE_URL}/bookings", params={"user": user}).json()
+        self.assertEqual([b["booking_id"] for b in mine], [booking_id])
+        self.assertEqual(requests.get(f"{self.BASE_URL}/bookings/BK-missing").status_code, 404)
+    
+    def test_idempotent_retry_returns_original_booking(self):
+        """Test that a retried idempotency key replays the first booking"""
+        stamp = datetime.now().strftime('%H%M%S%f')
+        payload = {"showtime_id": self.test_showtime_id, "seat": f"I{stamp}", "date": self.test_date}
+        headers = {"Idempotency-Key": uuid.uuid4().hex}
+        first = requests.post(f"{self.BASE_URL}/book", json=payload, headers=headers)
+        retry = requests.post(f"{self.BASE_URL}/book", json=payload, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()["booking_id"], first.json()["booking_id"])
+        self.assertEqual(retry.headers.get("Idempotent-Replayed"), "true")
+        # The same key cannot be reused for other seats
+        reused = requests.post(f"{self.BASE_URL}/book", json=dict(payload, seat=f"J{stamp}"), headers=headers)
+        self.assertEqual(reused.status_code, 422)
+    
+    def test_cancel_booking_frees_seats(self):
+        """Test that cancelling a booking refunds it and frees its seats exactly once"""
+        seat = f"X{datetime.now().strftime('%H%M%S%f')}"
+        payload = {"showtime_id": self.test_showtime_id, "seat": seat, "date": self.test_date}
+        booking_id = requests.post(f"{self.BASE_URL}/book", json=payload).json()["booking_id"]
+        response = requests.delete(f"{self.BASE_URL}/bookings/{booking_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.json()["refund"], 0)
+        self.assertEqual(response.json()["booking"]["status"], "cancelled")
+        self.assertEqual(requests.delete(f"{self.BASE_URL}/bookings/{booking_id}").status_code, 409)
+        self.assertEqual(requests.post(f"{self.BASE_URL}/book", json=payload).status_code, 200)
+    
+    def test_refund_is_the_booked_price(self):
+        """Test that bookings record each seat's tier price and cancelling refunds exactly that"""
+        date = (datetime.now() + timedelta(days=4)).strftime('%Y-%m-%d')
+        seatmap = requests.get(f"{self.BASE_URL}/seatmap/2", params={"date": date, "format": "compact"}).json()
+        free = free_seat_labels(seatmap)
+        seats = [next(seat for seat in free if seat[0] == "A"), next(seat for seat in free if seat[0] == "N")]
+        booking = requests.post(f"{self.BASE_URL}/book/batch", json={
+            "showtime_id": "2", "seats": seats, "date": date}).json()["booking"]
+        front, recliner = booking["prices"]
+        tier_prices = dict(zip(PRICE_TIERS, seatmap["prices"]))
+        self.assertEqual((front, recliner), (tier_prices["front"], tier_prices["recliner"]))
+        self.assertLess(front, recliner)
+        response = requests.delete(f"{self.BASE_URL}/bookings/{booking['booking_id']}")
+        self.assertEqual(response.json()["refund"], front + recliner)
+    
+    def test_bulk_cancel_honors_cancellable(self):
+        """Test that bulk cancel skips bookings for non-cancellable showtimes"""
+        stamp = datetime.now().strftime('%H%M%S%f')
+        # Showtime 1 is cancellable, showtime 4 (the fourth slot) is not
+        ok = requests.post(f"{self.BASE_URL}/book", json={
+            "showtime_id": "1", "seat": f"Y{stamp}", "date": self.test_date}).json()["booking_id"]
+        fixed = requests.post(f"{self.BASE_URL}/book", json={
+            "showtime_id": "4", "seat": f"Y{stamp}", "date": self.test_date}).json()["booking_id"]
+        response = requests.post(f"{self.BASE_URL}/bookings/cancel", json={"booking_ids": [ok, fixed, "BK-missing"]})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([b["booking_id"] for b in data["cancelled"]], [ok])
+        self.assertEqual(sorted(data["failed"]), sorted([fixed, "BK-missing"]))
+        self.assertEqual(requests.get(f"{self.BASE_URL}/bookings/{fixed}").json()["status"], "confirmed")
+
+class TestSeatAllocation(unittest.TestCase):
+    """Test best-available seat allocation"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def labels(self, index, size, **prefs):
+        picked = index.best(size, **prefs)
+        return [SEAT_LABELS[idx] for idx in picked] if picked else None
+    
+    def test_best_seats_are_adjacent(self):
+        """Test that a party gets adjacent seats in one row and block"""
+        seats = self.labels(FreeRunIndex("0" * len(SEAT_LABELS), 0), 4)
+        self.assertEqual(len(seats), 4)
+        self.assertEqual(len({seat_segment(seat) for seat in seats}), 1)
+        indexes = [SEAT_LABELS.index(seat) for seat in seats]
+        self.assertEqual(indexes, list(range(indexes[0], indexes[0] + 4)))
+    
+    def test_index_tracks_seat_changes(self):
+        """Test that marking seats taken or free updates the runs"""
+        index = FreeRunIndex("1" * len(SEAT_LABELS), 0)
+        self.assertIsNone(index.best(1))
+        index.mark(["C05", "C06", "C07"], 1)
+        self.assertEqual(self.labels(index, 3), ["C05", "C06", "C07"])
+        index.mark(["C06"], 0)
+        self.assertIsNone(index.best(2))
+        self.assertEqual(self.labels(index, 1, rows={"C"}), ["C05"])
+        self.assertIsNone(index.best(1, rows={"D"}))
+    
+    def test_allocate_holds_disjoint_seats(self):
+        """Test that two parties allocating at once get different seats"""
+        date = (datetime.now() + timedelta(days=6)).strftime('%Y-%m-%d')
+        first = requests.post(f"{self.BASE_URL}/allocate", json={
+            "showtime_id": "7", "date": date, "size": 3, "holder": f"a-{uuid.uuid4().hex}"})
+        second = requests.post(f"{self.BASE_URL}/allocate", json={
+            "showtime_id": "7", "date": date, "size": 3, "holder": f"b-{uuid.uuid4().hex}"})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertTrue(first.json()["held"])
+        self.assertFalse(set(first.json()["seats"]) & set(second.json()["seats"]))
+        response = requests.post(f"{self.BASE_URL}/allocate", json={"showtime_id": "7", "size": 99})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_allocate_requires_holder(self):
+        """Test that seats are never picked without holding them"""
+        response = requests.post(f"{self.BASE_URL}/allocate", json={"showtime_id": "7", "size": 2})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("holder", response.json()["error"])
+
+class TestCompression(unittest.TestCase):
+    """Test response compression negotiation"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def test_static_response_is_gzipped_once(self):
+        """Test that showtimes are gzipped, byte-identical across requests and revalidate per encoding"""
+        first = requests.get(f"{self.BASE_URL}/showtimes/1", headers={"Accept-Encoding": "gzip"}, stream=True)
+        raw = first.raw.read(decode_content=False)
+        self.assertEqual(first.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", first.headers["Vary"])
+        self.assertTrue(first.headers["ETag"].endswith('-gzip"'))
+        again = requests.get(f"{self.BASE_URL}/showtimes/1", headers={"Accept-Encoding": "gzip"}, stream=True)
+        self.assertEqual(again.raw.read(decode_content=False), raw)
+        self.assertEqual(json.loads(gzip.decompress(raw)), requests.get(f"{self.BASE_URL}/showtimes/1").json())
+        revalidated = requests.get(f"{self.BASE_URL}/showtimes/1", headers={
+            "Accept-Encoding": "gzip", "If-None-Match": first.headers["ETag"]})
+        self.assertEqual(revalidated.status_code, 304)
+    
+    def test_identity_and_small_responses_are_plain(self):
+        """Test that clients without gzip and small payloads get uncompressed JSON"""
+        response = requests.get(f"{self.BASE_URL}/showtimes/1", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        response = requests.get(f"{self.BASE_URL}/locations", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+    
+    def test_full_seatmap_is_compressed(self):
+        """Test that large per-request payloads are compressed too"""
+        response = requests.get(f"{self.BASE_URL}/seatmap/1", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(len(response.json()), 14)
+
+class TestRequestMetrics(unittest.TestCase):
+    """Test the Prometheus metrics endpoint"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def test_metrics_record_routes_statuses_and_redis_usage(self):
+        """Test that requests show up under their route with status codes and Redis counts"""
+        requests.get(f"{self.BASE_URL}/seatmap/1", params={"date": datetime.now().strftime('%Y-%m-%d')})
+        requests.get(f"{self.BASE_URL}/bookings/BKmissing")
+        response = requests.get(f"{self.BASE_URL}/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        text = response.text
+        self.assertIn("# TYPE http_request_duration_seconds histogram", text)
+        self.assertIn('http_request_duration_seconds_bucket{route="/seatmap/<showtime_id>",method="GET",le="+Inf"}', text)
+        self.assertIn('http_responses_total{route="/bookings/<booking_id>",method="GET",status="404"}', text)
+        self.assertIn('redis_commands_per_request_count{route="/seatmap/<showtime_id>"}', text)
+        if os.environ.get('SEAT_BACKEND', 'redis') == 'redis':
+            line = next(l for l in text.splitlines()
+                        if l.startswith('redis_commands_per_request_sum{route="/seatmap/<showtime_id>"}'))
+            self.assertGreater(float(line.split()[-1]), 0)
+
+class TestRateLimiting(unittest.TestCase):
+    """Test token-bucket rate limiting"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def check_buckets(self, limiter):
+        client, show = f"test:client:{uuid.uuid4().hex}", f"test:show:{uuid.uuid4().hex}"
+        for _ in range(3):
+            self.assertEqual(limiter.take([(client, 1, 3), (show, 1, 100)]), (0, None))
+        wait, dry = limiter.take([(client, 1, 3), (show, 1, 100)])
+        self.assertEqual(dry, 0)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1)
+        # A refused request takes no token from the buckets that still had some
+        other = f"test:client:{uuid.uuid4().hex}"
+        for _ in range(97):
+            self.assertEqual(limiter.take([(other, 1, 200), (show, 1, 100)])[0], 0)
+        self.assertEqual(limiter.take([(other, 1, 200), (show, 1, 100)])[1], 1)
+    
+    def test_local_buckets(self):
+        """Test that the in-process limiter takes from all buckets or none"""
+        self.check_buckets(LocalRateLimiter())
+    
+    def test_redis_buckets(self):
+        """Test that the Redis limiter takes from all buckets or none"""
+        client = redis.Redis(decode_responses=True)
+        try:
+            client.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis not available")
+        self.check_buckets(RedisRateLimiter(client))
+    
+    def test_rate_limits_need_refilling_buckets(self):
+        """Test that RATE_LIMITS entries whose buckets never refill or never admit a request are refused"""
+        self.assertEqual(load_rate_limits('{"/book": {"client": [5, 20]}}'), {"/book": {"client": [5, 20]}})
+        for bucket in ('[0, 20]', '[-1, 20]', '[5, 0]', '"fast"', '[5]'):
+            with self.assertRaises(ValueError):
+                load_rate_limits(f'{{"/book": {{"client": {bucket}}}}}')
+    
+    def test_burst_is_shed_with_retry_after(self):
+        """Test that one session bursting a limited route gets 429s with Retry-After, counted as shed"""
+        headers = {"X-Session-Id": f"burst-{uuid.uuid4().hex[:8]}"}
+        statuses = [requests.post(f"{self.BASE_URL}/allocate", json={}, headers=headers) for _ in range(30)]
+        shed = [r for r in statuses if r.status_code == 429]
+        self.assertTrue(shed)
+        self.assertGreaterEqual(int(shed[0].headers["Retry-After"]), 1)
+        self.assertIn('http_requests_shed_total{route="/allocate",scope="client"}',
+                      requests.get(f"{self.BASE_URL}/metrics").text)
+    
+    def test_sessions_from_one_address_are_limited_apart(self):
+        """Test that sessions sharing an address, like every user of the Streamlit frontend, get their own buckets"""
+        first, second = ({"X-Session-Id": f"session-{uuid.uuid4().hex[:8]}"} for _ in range(2))
+        statuses = {requests.post(f"{self.BASE_URL}/allocate", json={}, headers=first).status_code for _ in range(30)}
+        self.assertEqual(statuses, {400, 429})
+        self.assertEqual(requests.post(f"{self.BASE_URL}/allocate", json={}, headers=second).status_code, 400)
+
+class TestShowtimeSearch(unittest.TestCase):
+    """Test city-wide showtime search"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def test_search_matches_a_linear_scan(self):
+        """Test that the indexed search returns exactly the shows a scan of the catalog finds"""
+        response = requests.get(f"{self.BASE_URL}/search/showtimes",
+                                params={"location": "Kolkata", "technology": "ATMOS,LASER", "window": "evening"})
+        self.assertEqual(response.status_code, 200)
+        found = response.json()["showtimes"]
+        self.assertTrue(found)
+        kolkata = {tid for tid, name in requests.get(f"{self.BASE_URL}/theatres/Kolkata").json().items()}
+        expected = set()
+        for tid in kolkata:
+            for show in requests.get(f"{self.BASE_URL}/showtimes/{tid}").json():
+                hour = datetime.strptime(show["time"], "%I:%M %p").hour
+                if show["technology"] in ("ATMOS", "LASER") and 17 <= hour < 21:
+                    expected.add(show["showtime_id"])
+        self.assertEqual({show["showtime_id"] for show in found}, expected)
+        minutes = [datetime.strptime(show["time"], "%I:%M %p") for show in found]
+        self.assertEqual(minutes, sorted(minutes))
+    
+    def test_search_by_price_band_and_availability(self):
+        """Test price band filtering and that ?seats= reports free seats and date prices"""
+        date = (datetime.now() + timedelta(days=4)).strftime('%Y-%m-%d')
+        response = requests.get(f"{self.BASE_URL}/search/showtimes",
+                                params={"location": "Delhi", "price_band": "premium", "seats": 2, "date": date})
+        shows = response.json()["showtimes"]
+        self.assertTrue(shows)
+        for show in shows:
+            self.assertGreaterEqual(show["free"], 2)
+            self.assertGreaterEqual(show["price"], 300)
+        self.assertEqual(requests.get(f"{self.BASE_URL}/search/showtimes",
+                                      params={"location": "Delhi", "window": "brunch"}).status_code, 400)
+
+class TestBookingAnalytics(unittest.TestCase):
+    """Test the analytics views built from the booking log"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def theatre(self, date):
+        revenue = requests.get(f"{self.BASE_URL}/analytics/revenue", params={"date": date}).json()
+        return next(t for t in revenue["theatres"] if t["theatre_id"] == "1")
+    
+    def movie(self, date):
+        fill = requests.get(f"{self.BASE_URL}/analytics/fill-rate", params={"date": date}).json()
+        return next(m for m in fill["movies"] if m["movie_id"] == "201")
+    
+    def test_views_follow_bookings_and_cancellations(self):
+        """Test that revenue and fill rate count a booking at its charged prices and give it back when it is cancelled"""
+        date = (datetime.now() + timedelta(days=3)).strftime('%Y-%m-%d')
+        show = requests.get(f"{self.BASE_URL}/showtimes/1", params={"movie_id": "201"}).json()[0]
+        seat_map = requests.get(f"{self.BASE_URL}/seatmap/{show['showtime_id']}", params={"date": date}).json()
+        free = [seat["label"] for row in seat_map for block in row["blocks"] for seat in block if not seat["booked"]]
+        theatre, movie = self.theatre(date), self.movie(date)
+        booking = requests.post(f"{self.BASE_URL}/book/batch", json={
+            "showtime_id": show["showtime_id"], "seats": free[:2], "date": date}).json()
+        booked = self.theatre(date)
+        self.assertEqual(booked["revenue"] - theatre["revenue"], sum(booking["booking"]["prices"]))
+        self.assertEqual(booked["seats_sold"] - theatre["seats_sold"], 2)
+        self.assertEqual(self.movie(date)["seats_sold"] - movie["seats_sold"], 2)
+        popular = requests.get(f"{self.BASE_URL}/analytics/popular-seats", params={"limit": 100}).json()
+        self.assertTrue(popular["as_of"])
+        self.assertTrue(popular["seats"])
+        requests.delete(f"{self.BASE_URL}/bookings/{booking['booking_id']}")
+        self.assertEqual(self.theatre(date)["revenue"], theatre["revenue"])
+        self.assertEqual(self.movie(date)["seats_sold"], movie["seats_sold"])
+
+class TestWaitlist(unittest.TestCase):
+    """Test the waitlist API"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def test_join_promotes_when_seats_are_free(self):
+        """Test that a party joining a show with room gets seats held at once and can leave"""
+        date = (datetime.now() + timedelta(days=9)).strftime('%Y-%m-%d')
+        holder = f"wl-{uuid.uuid4().hex[:8]}"
+        response = requests.post(f"{self.BASE_URL}/waitlist",
+                                 json={"showtime_id": "7", "date": date, "party": 3, "holder": holder})
+        self.assertEqual(response.status_code, 200)
+        entry = response.json()
+        self.assertEqual(entry["status"], "promoted")
+        self.assertEqual(len(entry["seats"]), 3)
+        self.assertIsNone(entry["position"])
+        # The held seats are taken for everyone else
+        conflict = requests.post(f"{self.BASE_URL}/hold", json={"showtime_id": "7", "date": date,
+                                                                "seats": entry["seats"][:1], "holder": "someone-else"})
+        self.assertEqual(conflict.status_code, 409)
+        left = requests.delete(f"{self.BASE_URL}/waitlist/{entry['entry_id']}")
+        self.assertEqual(left.json()["status"], "left")
+        self.assertEqual(requests.delete(f"{self.BASE_URL}/waitlist/{entry['entry_id']}").status_code, 409)
+        self.assertEqual(requests.get(f"{self.BASE_URL}/waitlist/WL-missing").status_code, 404)
+    
+    def test_invalid_party(self):
+        """Test that parties must name a holder and a size within the largest block"""
+        response = requests.post(f"{self.BASE_URL}/waitlist", json={"showtime_id": "7", "party": 99, "holder": "x"})
+        self.assertEqual(response.status_code, 400)
+
+class TestSeatHolds(unittest.TestCase):
+    """Test temporary seat holds"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def setUp(self):
+        self.test_date = (datetime.now() + timedelta(days=3)).strftime('%Y-%m-%d')
+        self.showtime_id = "2"
+        seat_map = requests.get(f"{self.BASE_URL}/seatmap/{self.showtime_id}", params={"date": self.test_date}).json()
+        self.free_seats = [seat["label"] for row in seat_map for block in row["blocks"] for seat in block if not seat["booked"]]
+        self.stamp = datetime.now().strftime('%H%M%S%f')
+    
+    def _hold(self, seats, holder, method="post"):
+        return requests.request(method, f"{self.BASE_URL}/hold", json={
+            "showtime_id": self.showtime_id, "date": self.test_date, "seats": seats, "holder": holder
+        })
+    
+    def test_held_seat_is_unavailable_to_others(self):
+        """Test that a held seat blocks other holders and bookers"""
+        seat = self.free_seats[0]
+        self.assertEqual(self._hold([seat], f"alice{self.stamp}").status_code, 200)
+        response = self._hold([seat], f"bob{self.stamp}")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["conflicts"], [seat])
+        response = requests.post(f"{self.BASE_URL}/book/batch", json={
+            "showtime_id": self.showtime_id, "date": self.test_date, "seats": [seat]
+        })
+        self.assertEqual(response.status_code, 409)
+        # Other users see the seat as taken, the holder still sees it as free
+        seat_map = requests.get(f"{self.BASE_URL}/seatmap/{self.showtime_id}",
+                                params={"date": self.test_date}).json()
+        booked = {s["label"] for row in seat_map for block in row["blocks"] for s in block if s["booked"]}
+        self.assertIn(seat, booked)
+        seat_map = requests.get(f"{self.BASE_URL}/seatmap/{self.showtime_id}",
+                                params={"date": self.test_date, "holder": f"alice{self.stamp}"}).json()
+        booked = {s["label"] for row in seat_map for block in row["blocks"] for s in block if s["booked"]}
+        self.assertNotIn(seat, booked)
+    
+    def test_holder_converts_holds_into_booking(self):
+        """Test that the holder can book their held seats"""
+        seats = self.free_seats[1:3]
+        holder = f"carol{self.stamp}"
+        self.assertEqual(self._hold(seats, holder).status_code, 200)
+        response = requests.post(f"{self.BASE_URL}/book/batch", json={
+            "showtime_id": self.showtime_id, "date": self.test_date, "seats": seats, "holder": holder
+        })
+        self.assertEqual(response.status_code, 200)
+        # Nothing left to release once the holds became bookings
+        self.assertEqual(self._hold([], holder, method="delete").json()["released"], [])
+    
+    def test_release_hold(self):
+        """Test that releasing a hold frees the seat for others"""
+        seat = self.free_seats[3]
+        self._hold([seat], f"dave{self.stamp}")
+        response = self._hold([seat], f"dave{self.stamp}", method="delete")
+        self.assertEqual(response.json()["released"], [seat])
+        self.assertEqual(self._hold([seat], f"erin{self.stamp}").status_code, 200)
+        self._hold([seat], f"erin{self.stamp}", method="delete")
+    
+    def test_hold_requires_holder(self):
+        """Test hold validation"""
+        response = requests.post(f"{self.BASE_URL}/hold", json={"showtime_id": "1", "seats": ["A01"]})
+        self.assertEqual(response.status_code, 400)
+
+class TestSeatEvents(unittest.TestCase):
+    """Test the seat change event stream"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def test_booking_is_streamed(self):
+        """Test that a booking shows up on the showtime's event stream"""
+        date = (datetime.now() + timedelta(days=4)).strftime('%Y-%m-%d')
+        seat = f"EV{datetime.now().strftime('%H%M%S%f')}"
+        with requests.get(f"{self.BASE_URL}/seatmap/3/events", params={"date": date}, stream=True, timeout=5) as stream:
+            lines = stream.iter_lines(decode_unicode=True)
+            self.assertEqual(next(lines), "event: hello")
+            hello = json.loads(next(lines)[len("data: "):])
+            requests.post(f"{self.BASE_URL}/book", json={"showtime_id": "3", "seat": seat, "date": date})
+            event = [line for line in (next(lines) for _ in range(4)) if line]
+        self.assertIn("event: booked", event)
+        payload = json.loads(event[-1][len("data: "):])
+        self.assertEqual(payload["seats"], [seat])
+        self.assertEqual(payload["version"], hello["version"] + 1)
+
+class TestSeatRush(unittest.TestCase):
+    """Test concurrent booking through the API"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def test_rush_never_double_books(self):
+        """Test that a burst of concurrent bookings sells each seat at most once"""
+        report = run_rush(HttpClient(self.BASE_URL, 16), showtime_id="4", attempts=200, concurrency=16)
+        self.assertEqual(report["oversold"], [])
+        self.assertEqual(report["lost"], [])
+        self.assertGreater(report["outcome"].get("booked", 0), 0)
+        self.assertIn("POST /book/batch", report["routes"])
+
+class TestAsgiEdition(unittest.TestCase):
+    """Test that the ASGI edition answers like the Flask server"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    @classmethod
+    def setUpClass(cls):
+        if asgi_app.SEAT_BACKEND != "redis":
+            raise unittest.SkipTest("ASGI and Flask editions only share seats through Redis")
+        cls.loop = asyncio.new_event_loop()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.run_until_complete(asgi_app.store.aclose())
+        cls.loop.close()
+    
+    def call(self, method, path, query="", body=None, headers=()):
+        """Drive the ASGI app directly and return (status, headers, body)"""
+        scope = {"type": "http", "method": method, "path": path, "query_string": query.encode(),
+                 "headers": [(k.lower().encode(), v.encode()) for k, v in headers]}
+        payload = json.dumps(body).encode() if body is not None else b""
+        sent = []
+        async def receive():
+            return {"type": "http.request", "body": payload, "more_body": False}
+        async def send(message):
+            sent.append(message)
+        self.loop.run_until_complete(asgi_app.app(scope, receive, send))
+        return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+    
+    def test_catalog_routes_match_flask(self):
+        """Test that catalog routes return the same data as the Flask edition"""
+        for path in ["/locations", "/movies", "/theatres/Kolkata", "/showtimes/1"]:
+            status, _, body = self.call("GET", path)
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body), requests.get(f"{self.BASE_URL}{path}").json())
+    
+    def test_showtimes_revalidate(self):
+        """Test that repeat showtime polls get 304"""
+        _, headers, _ = self.call("GET", "/showtimes/1")
+        status, _, body = self.call("GET", "/showtimes/1", headers=[("If-None-Match", headers[b"etag"].decode())])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b"")
+    
+    def test_booking_is_shared_with_flask(self):
+        """Test that seats booked through the ASGI edition are taken in the Flask edition"""
+        date = (datetime.now() + timedelta(days=5)).strftime('%Y-%m-%d')
+        status, _, body = self.call("GET", "/seatmap/6", query=f"date={date}&format=compact")
+        self.assertEqual(status, 200)
+        seatmap = json.loads(body)
+        seat = free_seat_labels(seatmap)[0]
+        status, _, body = self.call("POST", "/book", body={"showtime_id": "6", "seat": seat, "date": date})
+        self.assertEqual(status, 200)
+        booking = requests.get(f"{self.BASE_URL}/bookings/{json.loads(body)['booking_id']}").json()
+        self.assertEqual(booking["seats"], [seat])
+        response = requests.post(f"{self.BASE_URL}/book", json={"showtime_id": "6", "seat": seat, "date": date})
+        self.assertEqual(response.status_code, 409)
+        flask_map = requests.get(f"{self.BASE_URL}/seatmap/6", params={"date": date, "format": "compact"}).json()
+        self.assertEqual(flask_map["version"], seatmap["version"] + 1)
+    
+    def test_booking_burst_is_shed(self):
+        """Test that the ASGI edition applies the /book rate limits with a Retry-After"""
+        headers = [("X-Session-Id", f"asgi-{uuid.uuid4().hex}")]
+        replies = [self.call("POST", "/book", body={"showtime_id": "6"}, headers=headers) for _ in range(40)]
+        self.assertEqual({status for status, _, _ in replies}, {400, 429})
+        status, headers, body = replies[-1]
+        self.assertEqual(status, 429)
+        self.assertGreaterEqual(int(headers[b"retry-after"]), 1)
+    
+    def test_unknown_route(self):
+        """Test 404 and 405 handling"""
+        self.assertEqual(self.call("GET", "/nope")[0], 404)
+        self.assertEqual(self.call("GET", "/book")[0], 405)
+
+class SeatStoreContract:
+    """Checks every seat store backend must pass; mixed into one TestCase per backend"""
+    
+    def make_store(self):
+        raise NotImplementedError
+    
+    def setUp(self):
+        self.store = self.make_store()
+        self.showtime_id = f"test-{uuid.uuid4().hex[:8]}"
+        self.date = "2030-01-01"
+    
+    def test_batch_book_is_all_or_nothing(self):
+        """Test that a batch with one taken seat books nothing"""
+        self.assertEqual(self.store.book(self.showtime_id, self.date, ["A01", "A02"]), [])
+        self.assertEqual(self.store.book(self.showtime_id, self.date, ["A03", "A02"]), ["A02"])
+        bits, version, _ = self.store.seat_state(self.showtime_id, self.date)
+        self.assertEqual(bits.count("1"), 2)
+        self.assertEqual(version, 1)
+    
+    def test_holds(self):
+        """Test that holds block others, convert into bookings and can be released"""
+        self.assertEqual(self.store.hold(self.showtime_id, self.date, ["B01", "B02"], "alice", 60), [])
+        self.assertEqual(self.store.hold(self.showtime_id, self.date, ["B02"], "bob", 60), ["B02"])
+        self.assertEqual(self.store.count(self.showtime_id, self.date)[1], 2)
+        self.assertEqual(self.store.seat_state(self.showtime_id, self.date, "alice")[0].count("1"), 0)
+        self.assertEqual(self.store.book(self.showtime_id, self.date, ["B01"], "alice"), [])
+        self.assertEqual(self.store.release(self.showtime_id, self.date, "alice"), ["B02"])
+        self.assertEqual(self.store.count(self.showtime_id, self.date), (1, 0))
+    
+    def test_prebook_runs_once(self):
+        """Test that prebooking applies its sample exactly once"""
+        self.assertEqual(self.store.count(self.showtime_id, self.date), (PREBOOK_COUNT, 0))
+        self.assertTrue(self.store.prebook(self.showtime_id, self.date))
+        self.assertFalse(self.store.prebook(self.showtime_id, self.date))
+        bits, _, prebooked = self.store.seat_state(self.showtime_id, self.date)
+        self.assertTrue(prebooked)
+        self.assertEqual(bits.count("1"), PREBOOK_COUNT)
+    
+    def test_concurrent_bookings_never_oversell(self):
+        """Test that racing bookers get each seat at most once"""
+        winners = []
+        def rush(n):
+            for seat in ["C01", "C02", "C03", "C04"]:
+                if not self.store.book(self.showtime_id, self.date, [seat], f"user{n}"):
+                    winners.append(seat)
+        threads = [threading.Thread(target=rush, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(winners), ["C01", "C02", "C03", "C04"])
+    
+    def test_booking_records(self):
+        """Test that bookings are recorded per user and replayed for a known idempotency key"""
+        user, key = f"user-{uuid.uuid4().hex[:8]}", uuid.uuid4().hex
+        booking, conflicts, replayed = self.store.create_booking(
+            self.showtime_id, self.date, ["D01", "D02"], user=user, idempotency_key=key, prices=[200, 250])
+        self.assertEqual((conflicts, replayed), ([], False))
+        self.assertEqual(booking["prices"], [200, 250])
+        self.assertEqual(self.store.get_booking(booking["booking_id"]), booking)
+        again, _, replayed = self.store.create_booking(
+            self.showtime_id, self.date, ["D01", "D02"], user=user, idempotency_key=key)
+        self.assertTrue(replayed)
+        self.assertEqual(again, booking)
+        _, conflicts, _ = self.store.create_booking(self.showtime_id, self.date, ["D02", "D03"], user=user)
+        self.assertEqual(conflicts, ["D02"])
+        self.assertEqual(self.store.user_bookings(user), [booking])
+        self.assertIsNone(self.store.get_booking("BK-missing"))
+    
+    def test_cancel_booking(self):
+        """Test that cancelling frees the booking's seats exactly once"""
+        booking, _, _ = self.store.create_booking(self.showtime_id, self.date, ["E01", "E02"])
+        version = self.store.version(self.showtime_id, self.date)
+        (cancelled, applied), (missing, _) = self.store.cancel_bookings([booking["booking_id"], "BK-missing"])
+        self.assertTrue(applied)
+        self.assertEqual(cancelled["status"], "cancelled")
+        self.assertIsNone(missing)
+        self.assertEqual(self.store.version(self.showtime_id, self.date), version + 1)
+        self.assertEqual(self.store.get_booking(booking["booking_id"])["status"], "cancelled")
+        self.assertFalse(self.store.cancel_booking(booking["booking_id"])[1])
+        self.assertEqual(self.store.book(self.showtime_id, self.date, ["E01", "E02"]), [])
+    
+    def test_waitlist_is_first_come_first_served(self):
+        """Test that only the party first in line can be promoted and that leaving moves the line up"""
+        first = self.store.join_waitlist(self.showtime_id, self.date, 2, "wl-first")
+        second = self.store.join_waitlist(self.showtime_id, self.date, 1, "wl-second", user="second")
+        third = self.store.join_waitlist(self.showtime_id, self.date, 3, "wl-third")
+        self.assertEqual([e["position"] for e in (first, second, third)], [1, 2, 3])
+        self.assertEqual(self.store.waitlist_head(self.showtime_id, self.date)["entry_id"], first["entry_id"])
+        self.assertIsNone(self.store.promote_waitlist_entry(second["entry_id"], ["H01"], 60))
+        promoted = self.store.promote_waitlist_entry(first["entry_id"], ["H01", "H02"], 60)
+        self.assertEqual((promoted["status"], promoted["seats"]), ("promoted", ["H01", "H02"]))
+        self.assertIsNone(self.store.promote_waitlist_entry(first["entry_id"], ["H01", "H02"], 60))
+        self.assertEqual(self.store.waitlist_entry(second["entry_id"])["position"], 1)
+        entry, left = self.store.leave_waitlist(second["entry_id"])
+        self.assertTrue(left)
+        self.assertEqual(entry["status"], "left")
+        self.assertFalse(self.store.leave_waitlist(second["entry_id"])[1])
+        self.assertEqual(self.store.waitlist_entry(third["entry_id"])["position"], 1)
+        self.assertEqual(self.store.waitlist_head(self.showtime_id, self.date)["entry_id"], third["entry_id"])
+    
+    def test_one_key_for_several_shows_at_once_books_once(self):
+        """Test that concurrent requests with one idempotency key for different shows make one booking"""
+        key, user = uuid.uuid4().hex, f"user-{uuid.uuid4().hex[:8]}"
+        outcomes = []
+        
+        def attempt(n):
+            try:
+                _, _, replayed = self.store.create_booking(f"{self.showtime_id}-{n}", self.date, ["K01"],
+                                                           user=user, idempotency_key=key)
+                outcomes.append("replayed" if replayed else "booked")
+            except BookingInProgress:
+                outcomes.append("in progress")
+        
+        threads = [threading.Thread(target=attempt, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(outcomes.count("booked"), 1)
+        self.assertEqual(len(self.store.user_bookings(user)), 1)
+    
+    def logged(self, after='0'):
+        """This test's show's entries in the booking log after an offset"""
+        events = []
+        while True:
+            batch = self.store.booking_events(after, 1000)
+            if not batch:
+                return [event for event in events if event["showtime_id"] == self.showtime_id]
+            events += batch
+            after = batch[-1]["id"]
+    
+    def test_booking_log_and_views(self):
+        """Test that bookings, holds and cancellations are logged in order and fold into the views once"""
+        booking, _, _ = self.store.create_booking(self.showtime_id, self.date, ["G01", "G02"], user="fan",
+                                                  prices=[180, 200])
+        self.store.hold(self.showtime_id, self.date, ["G03"], "fan", 60)
+        self.store.cancel_booking(booking["booking_id"])
+        self.store.create_booking(self.showtime_id, self.date, ["G01"], prices=[210])
+        mine = self.logged()
+        self.assertEqual([(e["event"], e["seats"]) for e in mine],
+                         [("booked", ["G01", "G02"]), ("held", ["G03"]), ("cancelled", ["G01", "G02"]), ("booked", ["G01"])])
+        self.assertEqual((mine[2]["booking_id"], mine[2]["user"], mine[2]["prices"]), (booking["booking_id"], "fan", [180, 200]))
+        self.assertEqual(self.logged(mine[2]["id"]), mine[3:])
+        views, catalog = LocalBookingViews(), {self.showtime_id: ("1", "201", 150)}
+        self.assertGreaterEqual(catch_up(views, self.store, catalog), 4)
+        self.assertEqual(catch_up(views, self.store, catalog), 0)
+        self.assertEqual(views.view(theatre_view_key(self.date)), {"1:revenue": 210, "1:sold": 1, "1:held": 1})
+        self.assertEqual(views.view(movie_view_key(self.date)), {"201": 1})
+        self.assertEqual(views.popular_seats(2), [("G01", 2), ("G02", 1)])
+    
+    def test_held_view_follows_releases_expiry_and_bookings(self):
+        """Test that released, expired and booked holds stop counting as held, and re-holds count once"""
+        self.store.hold(self.showtime_id, self.date, ["H01", "H02", "H03", "H04"], "fan", 60)
+        self.store.hold(self.showtime_id, self.date, ["H01"], "fan", 60)
+        self.store.release(self.showtime_id, self.date, "fan", ["H02"])
+        self.store.create_booking(self.showtime_id, self.date, ["H03", "H05"], holder="fan")
+        self.store.hold(self.showtime_id, self.date, ["H06"], "late", 1)
+        with mock.patch("seat_store.now_ms", return_value=now_ms() + 2000):
+            self.store.sweep_holds()
+        self.assertEqual([(e["event"], e["seats"]) for e in self.logged()],
+                         [("held", ["H01", "H02", "H03", "H04"]), ("released", ["H02"]), ("converted", ["H03"]),
+                          ("booked", ["H03", "H05"]), ("held", ["H06"]), ("expired", ["H06"])])
+        views, catalog = LocalBookingViews(), {self.showtime_id: ("1", "201", 150)}
+        catch_up(views, self.store, catalog)
+        self.assertEqual(views.view(theatre_view_key(self.date))["1:held"], 2)
+        # Bookings without recorded prices fall back to the catalog price
+        self.assertEqual(views.view(theatre_view_key(self.date))["1:revenue"], 300)
+    
+    def test_archive_and_purge_past_date(self):
+        """Test that archiving a past date keeps its bookings on disk and drops them from the store"""
+        today = datetime(2031, 3, 2)
+        past = "2031-03-01"
+        booking, _, _ = self.store.create_booking(self.showtime_id, past, ["F01", "F02"], user="archivist",
+                                                  prices=[150, 150])
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.assertIn((past, 1), archive_past_dates(self.store, tmp.name, days=1, today=today))
+        archived = read_archive(tmp.name, past)
+        self.assertEqual([(b["booking_id"], b["seats"], b["prices"]) for b in archived],
+                         [(booking["booking_id"], ["F01", "F02"], [150, 150])])
+        self.assertIsNone(self.store.get_booking(booking["booking_id"]))
+        self.assertEqual(self.store.seat_state(self.showtime_id, past)[0].count("1"), 0)
+        # Already archived dates are left alone
+        self.assertEqual(archive_past_dates(self.store, tmp.name, days=1, today=today), [])
+
+class TestMemorySeatStore(SeatStoreContract, unittest.TestCase):
+    """Test the in-process lock-striped seat store"""
+    
+    def make_store(self):
+        return MemorySeatStore()
+    
+    def test_events_before_first_consumer_are_kept(self):
+        """Test that seat events published before anyone reads the feed are still delivered"""
+        self.store.book(self.showtime_id, self.date, ["A01"])
+        feed = self.store.events()
+        published = [next(feed) for _ in range(self.store._events.qsize())]
+        self.assertIn(seat_events_channel(self.showtime_id, self.date), {channel for channel, _ in published})
+        self.assertTrue(any(message.endswith(" A01") for _, message in published))
+    
+    def test_empty_past_date_is_archived(self):
+        """Test that a past date the store never had bookings for is archived as empty"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.assertEqual(archive_past_dates(self.store, tmp.name, days=1, today=datetime(2020, 1, 3)), [("2020-01-02", 0)])
+        self.assertEqual(read_archive(tmp.name, "2020-01-02"), [])
+    
+    def test_claimed_idempotency_key_is_in_progress(self):
+        """Test that a key claimed by a booking still being made answers in progress"""
+        self.store.idempotency["claimed"] = (None, now_ms() + 5000)
+        with self.assertRaises(BookingInProgress):
+            self.store.create_booking(self.showtime_id, self.date, ["A02"], idempotency_key="claimed")
+
+class TestSqliteSeatStore(SeatStoreContract, unittest.TestCase):
+    """Test the SQLite seat store"""
+    
+    def make_store(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return SqliteSeatStore(os.path.join(tmp.name, "seats.db"))
+
+class TestRedisSeatStore(SeatStoreContract, unittest.TestCase):
+    """Test the Redis seat store"""
+    
+    def make_store(self):
+        store = RedisSeatStore()
+        try:
+            store.r.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis not available")
+        return store
+    
+    def test_idempotency_key_pending_while_first_request_books(self):
+        """Test that a key claimed by a request still booking answers in progress, not as a lost booking"""
+        key = uuid.uuid4().hex
+        client = self.store.nodes[self.store.node_for_key(key)]
+        client.set(idempotency_key_for(key), pending_marker("BKFIRST"), px=5000)
+        with self.assertRaises(BookingInProgress) as raised:
+            self.store.create_booking(self.showtime_id, self.date, ["E01"], idempotency_key=key)
+        status, payload = booking_outcome(self.showtime_id, self.date, ["E01"], False, error=raised.exception)
+        self.assertEqual((status, payload["retry_after"]), (409, 1))
+        client.delete(idempotency_key_for(key))
+        booking, _, _ = self.store.create_booking(self.showtime_id, self.date, ["E01"], idempotency_key=key)
+        self.assertEqual(client.get(idempotency_key_for(key)), booking["booking_id"])
+        self.assertEqual(self.store.create_booking(self.showtime_id, self.date, ["E01"], idempotency_key=key)[0], booking)
+    
+    def test_expired_past_date_is_not_archived_empty(self):
+        """Test that a date whose keys may have expired is skipped rather than archived as empty"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.assertFalse(self.store.keeps_date("2020-01-02"))
+        self.assertEqual(archive_past_dates(self.store, tmp.name, days=1, today=datetime(2020, 1, 3)), [])
+        self.assertIsNone(read_archive(tmp.name, "2020-01-02"))
+
+# Several local redis-server processes, e.g. `redis-server --port 6380` and `--port 6381`
+SHARD_URLS = os.environ.get('REDIS_TEST_SHARDS',
+                            'redis://localhost:6379/0,redis://localhost:6380/0,redis://localhost:6381/0').split(',')
+
+class TestShardedRedisSeatStore(SeatStoreContract, unittest.TestCase):
+    """Test the Redis seat store spread over several nodes"""
+    
+    def make_store(self):
+        store = RedisSeatStore(SHARD_URLS[0], shards=SHARD_URLS)
+        try:
+            for client in store.nodes:
+                client.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis shards not available")
+        return store
+    
+    def test_shows_stay_on_one_node(self):
+        """Test that each show's seats and bookings live on one node and cross-show reads merge every node"""
+        user = f"user-{uuid.uuid4().hex[:8]}"
+        shows = [f"{self.showtime_id}-{n}" for n in range(12)]
+        for show in shows:
+            self.store.create_booking(show, self.date, ["A01", "A02"], user=user)
+        self.assertGreater(len({self.store.node_for_show(show) for show in shows}), 1)
+        for show in shows:
+            holders = [n for n, client in enumerate(self.store.nodes) if client.exists(seat_version_key(show, self.date))]
+            self.assertEqual(holders, [self.store.node_for_show(show)])
+        bookings = self.store.user_bookings(user)
+        self.assertEqual(sorted(booking["showtime_id"] for booking in bookings), sorted(shows))
+        for booking in bookings:
+            self.assertEqual(self.store.node_for_id(booking["booking_id"]), self.store.node_for_show(booking["showtime_id"]))
+        self.assertEqual(self.store.counts([(show, self.date) for show in shows]), [(2, 0)] * len(shows))
+    
+    def test_idempotency_key_is_seen_across_nodes(self):
+        """Test that a key reused for a show on another node replays the first booking instead of booking again"""
+        key = uuid.uuid4().hex
+        shows = [f"{self.showtime_id}-{n}" for n in range(12)]
+        first = shows[0]
+        other = next(show for show in shows if self.store.node_for_show(show) != self.store.node_for_show(first))
+        booking, _, _ = self.store.create_booking(first, self.date, ["B01"], idempotency_key=key)
+        again, conflicts, replayed = self.store.create_booking(other, self.date, ["B01"], idempotency_key=key)
+        self.assertEqual((again, conflicts, replayed), (booking, [], True))
+        # A key whose booking found its seats taken is free for the next attempt
+        retry = uuid.uuid4().hex
+        _, conflicts, _ = self.store.create_booking(first, self.date, ["B01"], idempotency_key=retry)
+        self.assertEqual(conflicts, ["B01"])
+        booked, conflicts, replayed = self.store.create_booking(other, self.date, ["B01"], idempotency_key=retry)
+        self.assertEqual((booked["showtime_id"], conflicts, replayed), (other, [], False))
+
+class TestHashRing(unittest.TestCase):
+    """Test consistent hashing of shard keys onto nodes"""
+    
+    def test_keys_spread_and_mostly_stay_when_a_node_joins(self):
+        """Test that keys spread evenly and a new node only takes keys from the others"""
+        keys = [f"theatre-{n}" for n in range(3000)]
+        three = HashRing(["redis://a", "redis://b", "redis://c"])
+        placed = [three.node_for(key) for key in keys]
+        for node in range(3):
+            self.assertGreater(placed.count(node), 700)
+        four = HashRing(["redis://a", "redis://b", "redis://c", "redis://d"])
+        moved = [key for key, node in zip(keys, placed) if four.node_for(key) != node]
+        self.assertTrue(all(four.node_for(key) == 3 for key in moved))
+        self.assertLess(len(moved), 1100)
+        # Nodes are placed by name, not by list position
+        shuffled = HashRing(["redis://c", "redis://a", "redis://b"])
+        self.assertEqual([["redis://c", "redis://a", "redis://b"][shuffled.node_for(key)] for key in keys[:100]],
+                         [["redis://a", "redis://b", "redis://c"][node] for node in placed[:100]])
+    
+    def test_shows_follow_their_theatre(self):
+        """Test that every show of a theatre maps to the theatre's node"""
+        store = RedisSeatStore(SHARD_URLS[0], shards=SHARD_URLS, shard_key=lambda showtime_id: f"T{int(showtime_id) % 4}")
+        self.assertEqual({store.node_for_show(str(n)) for n in range(0, 400, 4)}, {store.node_for_show("0")})
+        self.assertEqual(store.node_for_id(store.issue_id(new_booking_id, 1)), 1)
+        self.assertEqual(store.node_for_id(store.issue_id(new_waitlist_id, 0)), 0)
+
+class TestRedisKeyExpiry(unittest.TestCase):
+    """Test that date-partitioned Redis keys expire with their show date"""
+    
+    def test_show_date_keys_expire(self):
+        """Test that seat, version and booking keys get an expiry after the show date"""
+        store = RedisSeatStore()
+        try:
+            store.r.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis not available")
+        showtime_id = f"test-{uuid.uuid4().hex[:8]}"
+        date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        booking, _, _ = store.create_booking(showtime_id, date, ["G01"])
+        end_of_date = (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)).timestamp()
+        for key in [store.seat_key(showtime_id, date), f"showtime:{showtime_id}:version:{date}",
+                    f"booking:{booking['booking_id']}"]:
+            self.assertGreaterEqual(store.r.ttl(key), end_of_date - datetime.now().timestamp())
+    
+    def test_lapsed_hold_is_swept_and_logged(self):
+        """Test that a hold's keys outlive the hold, so the sweep finds it lapsed and logs it as expired"""
+        store = RedisSeatStore()
+        try:
+            store.r.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis not available")
+        showtime_id = f"test-{uuid.uuid4().hex[:8]}"
+        date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        store.hold(showtime_id, date, ["A01"], "slow", 1)
+        time.sleep(1.5)
+        self.assertGreaterEqual(store.sweep_holds(), 1)
+        events, after = [], '0'
+        while True:
+            batch = store.booking_events(after, 1000)
+            if not batch:
+                break
+            events += [event for event in batch if event["showtime_id"] == showtime_id]
+            after = batch[-1]["id"]
+        self.assertEqual([(e["event"], e["seats"]) for e in events], [("held", ["A01"]), ("expired", ["A01"])])
+
+class TestCatalogSeeding(unittest.TestCase):
+    """Test that processes booting together seed the catalog exactly once"""
+    
+    THEATRES = {"seedtest": {"name": "Seed Test", "location": "Nowhere"}}
+    MOVIES = {"seedtest": {"name": "Seed Test", "genres": "Test", "rating": "-", "poster_url": ""}}
+    SHOWTIMES = [{"id": "seedtest", "theatre_id": "seedtest", "movie_id": "seedtest", "time": "09:10 AM",
+                  "technology": "LASER", "cancellable": True}]
+    
+    def setUp(self):
+        self.store = RedisSeatStore()
+        try:
+            self.store.r.ping()
+        except redis.ConnectionError:
+            self.skipTest("Redis not available")
+        self.original = self.store.r.get(CATALOG_VERSION_KEY)
+    
+    def tearDown(self):
+        # The app's own catalog version is put back so its workers do not reseed
+        if self.original is not None:
+            self.store.r.set(CATALOG_VERSION_KEY, self.original)
+        self.store.r.delete("theatre:seedtest", "movie:seedtest", "showtime:seedtest", CATALOG_SEED_LOCK_KEY)
+    
+    def seed(self, store, version, **kwargs):
+        return store.seed_catalog(self.THEATRES, self.MOVIES, self.SHOWTIMES, version, **kwargs)
+    
+    def test_parallel_boot_elects_one_seeder(self):
+        """Test that of many processes seeding at once exactly one writes and all see it ready"""
+        version = f"test-{uuid.uuid4().hex}"
+        stores = [RedisSeatStore() for _ in range(8)]
+        barrier = threading.Barrier(len(stores))
+        results = []
+        def boot(store):
+            barrier.wait()
+            results.append(self.seed(store, version))
+        threads = [threading.Thread(target=boot, args=(store,)) for store in stores]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(results), [False] * 7 + [True])
+        self.assertEqual(self.store.r.get(CATALOG_VERSION_KEY), version)
+        self.assertEqual(self.store.r.hget("showtime:seedtest", "technology"), "LASER")
+        self.assertIsNone(self.store.r.get(CATALOG_SEED_LOCK_KEY))
+    
+    def test_lock_of_a_dead_seeder_expires(self):
+        """Test that a seeder that died holding the lock only delays the next one by its TTL"""
+        self.store.r.set(CATALOG_SEED_LOCK_KEY, "crashed", px=300)
+        self.assertTrue(self.seed(self.store, f"test-{uuid.uuid4().hex}", wait=5))
+        self.store.r.set(CATALOG_SEED_LOCK_KEY, "stuck", px=5000)
+        with self.assertRaises(TimeoutError):
+            self.seed(self.store, f"test-{uuid.uuid4().hex}", wait=0.2)
 
 class TestPricingLogic(unittest.TestCase):
     """Test pricing calculations"""
@@ -119,6 +1173,63 @@ class TestPricingLogic(unittest.TestCase):
         if night_shows:
             self.assertEqual(night_shows[0]["price"], 150)
 
+class TestDynamicPricing(unittest.TestCase):
+    """Test tiered, occupancy-aware seat prices"""
+    
+    BASE_URL = "http://localhost:5000"
+    
+    def test_price_table_changes_only_with_band(self):
+        """Test that a show keeps its cached table until its occupancy band changes"""
+        book = PriceBook()
+        total = len(SEAT_LABELS)
+        first = book.observe("1", "2030-01-01", 200, 10)
+        self.assertEqual(first.band, OCCUPANCY_BANDS[0][0])
+        self.assertEqual(first.standard, 200)
+        self.assertIs(book.observe("1", "2030-01-01", 200, 20), first)
+        book.touch("1", "2030-01-01")
+        self.assertEqual(book.unchecked([("1", "2030-01-01"), ("2", "2030-01-01")]),
+                         [("1", "2030-01-01"), ("2", "2030-01-01")])
+        busy = book.observe("1", "2030-01-01", 200, total)
+        self.assertEqual(occupancy_band(total), len(OCCUPANCY_BANDS) - 1)
+        self.assertIsNot(busy, first)
+        self.assertGreater(busy.standard, first.standard)
+        self.assertIs(book.current("1", "2030-01-01", 200), busy)
+    
+    def test_quote_counts_a_show_this_process_never_priced(self):
+        """Test that a busy show is quoted at its band, not the lowest, by a process with a fresh price book"""
+        date = (datetime.now() + timedelta(days=365 + uuid.uuid4().int % 3000)).strftime('%Y-%m-%d')
+        seats = SEAT_LABELS[:int(0.85 * len(SEAT_LABELS))]
+        self.assertEqual(cinebook.store.book("1", date, seats), [])
+        with mock.patch.object(cinebook, "price_book", PriceBook()):
+            quoted = cinebook.quote_prices("1", date, [SEAT_LABELS[-1]])
+        base = cinebook.BASE_PRICES["1"]
+        self.assertEqual(quoted, [price_table(base, occupancy_band(sum(cinebook.store.count("1", date)))).seat_prices[-1]])
+        self.assertGreater(quoted[0], price_table(base, 0).seat_prices[-1])
+    
+    def test_seatmap_prices_follow_layout_tiers(self):
+        """Test that compact seat maps carry tier prices matching the full seat map"""
+        date = (datetime.now() + timedelta(days=3)).strftime('%Y-%m-%d')
+        layout = requests.get(f"{self.BASE_URL}/seatmap/layout").json()
+        self.assertEqual(layout["tiers"], PRICE_TIERS)
+        compact = requests.get(f"{self.BASE_URL}/seatmap/1", params={"date": date, "format": "compact"}).json()
+        self.assertEqual(len(compact["prices"]), len(PRICE_TIERS))
+        full = requests.get(f"{self.BASE_URL}/seatmap/1", params={"date": date}).json()
+        for row, tiers in zip(full, layout["tier_rows"]):
+            seats = [seat for block in row["blocks"] for seat in block]
+            self.assertEqual([seat["price"] for seat in seats], [compact["prices"][int(t)] for t in tiers])
+    
+    def test_dated_showtimes_have_band_prices(self):
+        """Test that /showtimes?date= prices each show for that date's occupancy"""
+        date = (datetime.now() + timedelta(days=3)).strftime('%Y-%m-%d')
+        shows = requests.get(f"{self.BASE_URL}/showtimes/1", params={"date": date, "movie_id": "201"}).json()
+        self.assertEqual(len(shows), 12)
+        catalog = {s["showtime_id"]: s for s in requests.get(f"{self.BASE_URL}/showtimes/1").json()}
+        for show in shows:
+            self.assertEqual(show["date"], date)
+            self.assertIn(show["band"], [band for band, _, _ in OCCUPANCY_BANDS])
+            self.assertEqual(set(show["prices"]), set(PRICE_TIERS))
+            self.assertGreaterEqual(show["price"], catalog[show["showtime_id"]]["price"])
+
 class TestAdvanceBooking(unittest.TestCase):
     """Test advance booking functionality"""
     
@@ -196,7 +1307,26 @@ if __name__ == '__main__':
     
     # Add test cases
     test_suite.addTest(unittest.makeSuite(TestCineBookAPI))
+    test_suite.addTest(unittest.makeSuite(TestSeatAllocation))
+    test_suite.addTest(unittest.makeSuite(TestCompression))
+    test_suite.addTest(unittest.makeSuite(TestRequestMetrics))
+    test_suite.addTest(unittest.makeSuite(TestRateLimiting))
+    test_suite.addTest(unittest.makeSuite(TestShowtimeSearch))
+    test_suite.addTest(unittest.makeSuite(TestBookingAnalytics))
+    test_suite.addTest(unittest.makeSuite(TestWaitlist))
+    test_suite.addTest(unittest.makeSuite(TestSeatHolds))
+    test_suite.addTest(unittest.makeSuite(TestSeatEvents))
+    test_suite.addTest(unittest.makeSuite(TestSeatRush))
+    test_suite.addTest(unittest.makeSuite(TestAsgiEdition))
+    test_suite.addTest(unittest.makeSuite(TestMemorySeatStore))
+    test_suite.addTest(unittest.makeSuite(TestSqliteSeatStore))
+    test_suite.addTest(unittest.makeSuite(TestRedisSeatStore))
+    test_suite.addTest(unittest.makeSuite(TestShardedRedisSeatStore))
+    test_suite.addTest(unittest.makeSuite(TestHashRing))
+    test_suite.addTest(unittest.makeSuite(TestRedisKeyExpiry))
+    test_suite.addTest(unittest.makeSuite(TestCatalogSeeding))
     test_suite.addTest(unittest.makeSuite(TestPricingLogic))
+    test_suite.addTest(unittest.makeSuite(TestDynamicPricing))
     test_suite.addTest(unittest.makeSuite(TestAdvanceBooking))
     test_suite.addTest(unittest.makeSuite(TestUIComponents))
     test_suite.addTest(unittest.makeSuite(TestErrorHandling))